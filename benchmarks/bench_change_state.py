@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the per-call overhead of a transitioned method.
+
+    python benchmarks/bench_change_state.py [--number 200000]
+
+Runs an empty transition method with and without signal receivers and
+prints the mean cost per call in microseconds.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=['django_fsm_ex'],
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+)
+django.setup()
+
+from django.db import models
+from django_fsm_ex import FSMField, transition, post_transition
+
+
+class BenchOrder(models.Model):
+    state = FSMField(default='new')
+
+    @transition(field=state, source='new', target='paid')
+    def pay(self):
+        pass
+
+    @transition(field=state, source='paid', target='new')
+    def refund(self):
+        pass
+
+    @transition(field=state, source='*', target='new')
+    def reset(self):
+        pass
+
+    class Meta:
+        app_label = 'django_fsm_ex'
+
+
+def run_cycle(order):
+    order.pay()
+    order.refund()
+
+
+def measure(number, repeat):
+    order = BenchOrder()
+    # 每次循环执行两次转移
+    best = min(timeit.repeat(lambda: run_cycle(order), number=number, repeat=repeat))
+    return best / number / 2 * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    print(f'no receivers:   {measure(options.number, options.repeat):.3f} us/transition')
+
+    def receiver(**kwargs):
+        pass
+
+    post_transition.connect(receiver, sender=BenchOrder)
+    print(f'post receiver:  {measure(options.number, options.repeat):.3f} us/transition')
+
+
+if __name__ == '__main__':
+    main()
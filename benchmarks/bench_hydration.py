@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Time and memory needed to load FSM models from the database.
+
+    python benchmarks/bench_hydration.py [--rows 100000]
+
+Loads ``--rows`` rows of a plain FSM model and of a model using
+ConcurrentTransitionMixin from an in-memory SQLite database and prints the
+best wall time and the tracemalloc peak / retained size of ``list(queryset)``.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=['django_fsm_ex'],
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+)
+django.setup()
+
+from django.db import connection, models
+from django_fsm_ex import FSMField, ConcurrentTransitionMixin, transition
+
+
+class PlainRow(models.Model):
+    state = FSMField(default='new')
+    review_state = FSMField(default='waiting')
+    title = models.CharField(max_length=50)
+
+    @transition(field=state, source='new', target='done')
+    def finish(self):
+        pass
+
+    class Meta:
+        app_label = 'django_fsm_ex'
+
+
+class LockedRow(ConcurrentTransitionMixin, models.Model):
+    state = FSMField(default='new')
+    review_state = FSMField(default='waiting')
+    title = models.CharField(max_length=50)
+
+    @transition(field=state, source='new', target='done')
+    def finish(self):
+        pass
+
+    class Meta:
+        app_label = 'django_fsm_ex'
+
+
+def measure(model, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(model.objects.all())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    rows = list(model.objects.all())
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return best, peak, retained
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    with connection.schema_editor() as editor:
+        editor.create_model(PlainRow)
+        editor.create_model(LockedRow)
+    for model in (PlainRow, LockedRow):
+        model.objects.bulk_create((model(title=str(i)) for i in range(options.rows)), batch_size=250)
+
+    for model in (PlainRow, LockedRow):
+        best, peak, retained = measure(model, options.repeat)
+        print(f'{model.__name__:10} {best:.3f}s  peak {peak / 2 ** 20:.1f} MiB  retained {retained / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
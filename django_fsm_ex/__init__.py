@@ -4,6 +4,14 @@ State tracking functionality for django models
 """
 from .errors import *
 from .signals import *
+from .registry import *
 from .fields import *
 from .transition import *
 from .decorators import *
+from .queryset import *
+from .unit_of_work import *
+from .feed import *
+from .history import *
+from .counters import *
+from .sweep import *
+from .dwell import *
@@ -0,0 +1,279 @@
+# coding: utf-8
+import threading
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, Optional, Tuple, Type
+
+from django.db import connections, models, router, transaction
+from django.db.models import Case, Count, F, Model, Q, Value, When
+from django.db.models.signals import class_prepared, post_delete, post_save
+
+from django_fsm_ex.oncommit import CommitBuffer, current_buffer
+
+__author__ = 'banxi'
+
+__all__ = ['recount_states', 'state_counts']
+
+COUNTER_ATTR_NAME = '_fsm_counted_state'
+"""实例 __dict__ 中转移前数据库里的状态: field name -> state,在 save() 时计入计数"""
+
+RECOUNT_BATCH_SIZE = 10000
+
+CounterKey = Tuple[str, str, str]  # (app_label.ModelName, field name, state)
+
+
+def _key(field, state) -> CounterKey:
+    # 按声明字段的模型计数,代理模型和子表共用父表的计数
+    return field.model._meta.label, field.name, '' if state is None else str(state)
+
+
+def _add(deltas: Dict[CounterKey, int], field, state, n: int):
+    key = _key(field, state)
+    deltas[key] = deltas.get(key, 0) + n
+
+
+def _counted_field(model: Type[Model], field: str):
+    field = model._meta.get_field(field)
+    if not getattr(field, 'count_states', False):
+        raise ValueError(f'{model._meta.label}.{field.name} 没有设置 count_states,没有状态计数')
+    return field
+
+
+def note_transition(instance: Model, field, source):
+    """Remember the state stored in the database before the first transition since the last save."""
+    instance.__dict__.setdefault(COUNTER_ATTR_NAME, {}).setdefault(field.name, source)
+
+
+def pop_saved_transitions(instance: Model, fields: Iterable, deltas: Dict[CounterKey, int]):
+    """Move the transitions noted on ``instance`` for the saved ``fields`` into ``deltas``."""
+    noted = instance.__dict__.get(COUNTER_ATTR_NAME)
+    if not noted:
+        return
+    for field in fields:
+        if field.name in noted:
+            source = noted.pop(field.name)
+            state = instance.__dict__[field.attname]
+            if source != state:
+                _add(deltas, field, source, -1)
+                _add(deltas, field, state, 1)
+    if not noted:
+        del instance.__dict__[COUNTER_ATTR_NAME]
+
+
+class _TransactionDeltas(CommitBuffer):
+    """一个事务中等待提交后应用的计数增量"""
+
+    def write(self, entries):
+        totals = {}
+        for deltas in entries:
+            for key, n in deltas.items():
+                totals[key] = totals.get(key, 0) + n
+        apply_deltas(totals, self.using)
+
+
+class _CounterBuffer:
+    """
+    按事务累积计数增量
+
+    Deltas added inside a transaction are summed up and applied by one UPDATE after it
+    commits (deltas of rolled back transactions or savepoints are dropped, see
+    ``oncommit.CommitBuffer``), so that the hot counter rows are not locked for the
+    duration of the transaction. Outside of a transaction they are applied right away.
+    """
+
+    def __init__(self):
+        self._local = threading.local()  # 和数据库连接一样按线程区分
+
+    def add(self, deltas: Dict[CounterKey, int], using: Optional[str] = None):
+        if not deltas:
+            return
+        if using is None:
+            using = _counter_db()
+        if not connections[using].in_atomic_block:
+            apply_deltas(deltas, using)
+            return
+        current_buffer(self._local, using, _TransactionDeltas).add(deltas)
+
+
+counter_buffer = _CounterBuffer()
+
+
+def _counter_db(instance: Optional[Model] = None) -> str:
+    from django_fsm_ex.models import StateCounter
+
+    return router.db_for_write(StateCounter, instance=instance)
+
+
+class _MissingCounters(Exception):
+    pass
+
+
+def apply_deltas(deltas: Dict[CounterKey, int], using: str):
+    """
+    Add ``deltas`` to the counters with one ``UPDATE ... SET count = count + CASE ... END``;
+    counters which do not exist yet are created first.
+    """
+    from django_fsm_ex.models import StateCounter
+
+    keys = sorted(key for key, n in deltas.items() if n)  # 固定加锁顺序
+    if not keys:
+        return
+    manager = StateCounter.objects.using(using)
+    where = reduce(or_, (Q(model=model, field=field, state=state) for model, field, state in keys))
+    increment = Case(*(When(model=model, field=field, state=state, then=Value(deltas[model, field, state]))
+                       for model, field, state in keys), default=Value(0), output_field=models.BigIntegerField())
+    try:
+        with transaction.atomic(using=using):
+            if manager.filter(where).update(count=F('count') + increment) != len(keys):
+                raise _MissingCounters
+    except _MissingCounters:
+        manager.bulk_create((StateCounter(model=model, field=field, state=state) for model, field, state in keys),
+                            ignore_conflicts=True)
+        manager.filter(where).update(count=F('count') + increment)
+
+
+def count_transition(instance: Model, field, source, target):
+    """Count a transition already written to the database, e.g. by an ``sql_update`` transition."""
+    noted = instance.__dict__.get(COUNTER_ATTR_NAME)
+    if noted:
+        noted.pop(field.name, None)
+    if source != target:
+        deltas = {}
+        _add(deltas, field, source, -1)
+        _add(deltas, field, target, 1)
+        counter_buffer.add(deltas, _counter_db(instance))
+
+
+def count_bulk_update(queryset: models.QuerySet, field, target):
+    """
+    Count the rows of ``queryset`` per source state before it is moved to ``target``;
+    returns a function to call with the number of updated rows.
+
+    The rows are read with ``SELECT ... FOR UPDATE`` (``GROUP BY`` cannot lock them), so
+    call it in the transaction of the ``UPDATE``: the rows counted cannot change state
+    before they are updated. When the ``UPDATE`` matches another number of rows (rows
+    which entered ``queryset`` in between), their source states are unknown: the
+    deltas are dropped and the counters of the field are rebuilt with
+    ``recount_states()`` once the transaction commits.
+    """
+    sources = {}
+    rows = queryset.select_for_update().order_by('pk').values_list(field.attname, flat=True)
+    for state in rows.iterator(chunk_size=RECOUNT_BATCH_SIZE):
+        sources[state] = sources.get(state, 0) + 1
+
+    def counted(count: int):
+        if count != sum(sources.values()):
+            transaction.on_commit(lambda: recount_states(field.model, field.name, using=queryset.db),
+                                  using=queryset.db)
+        elif count:
+            deltas = {}
+            for state, n in sources.items():
+                _add(deltas, field, state, -n)
+            _add(deltas, field, target, count)
+            counter_buffer.add(deltas)
+    return counted
+
+
+_counted_fields = {}  # model -> (fields counted on save, fields counted on delete)
+
+
+def _count_saved(sender, instance, created, update_fields, **kwargs):
+    save_fields, delete_fields = _counted_fields[sender]
+    deltas = {}
+    if created:
+        instance.__dict__.pop(COUNTER_ATTR_NAME, None)
+        for field in save_fields:
+            _add(deltas, field, instance.__dict__.get(field.attname), 1)
+    else:
+        if update_fields is not None:
+            save_fields = [field for field in save_fields if field.name in update_fields]
+        pop_saved_transitions(instance, save_fields, deltas)
+    counter_buffer.add(deltas, _counter_db(instance))
+
+
+def _count_deleted(sender, instance, **kwargs):
+    save_fields, delete_fields = _counted_fields[sender]
+    noted = instance.__dict__.get(COUNTER_ATTR_NAME) or {}
+    deltas = {}
+    for field in delete_fields:
+        # 转移后没有保存时,数据库中还是转移前的状态
+        _add(deltas, field, noted.get(field.name, instance.__dict__.get(field.attname)), -1)
+    counter_buffer.add(deltas, _counter_db(instance))
+
+
+def _connect_model(sender, **kwargs):
+    opts = sender._meta
+    save_fields = [field for field in opts.concrete_fields if getattr(field, 'count_states', False)]
+    if save_fields:
+        # 删除子表的行时父表的行也会发送 post_delete,只计数本表的字段
+        delete_fields = [field for field in save_fields if field.model is opts.concrete_model]
+        _counted_fields[sender] = (save_fields, delete_fields)
+        # 按 sender 连接,其他模型的 QuerySet.delete() 仍然可以快速删除
+        post_save.connect(_count_saved, sender=sender, weak=False)
+        post_delete.connect(_count_deleted, sender=sender, weak=False)
+
+
+_connected = False
+
+
+def connect_counters():
+    """Start counting the models prepared from now on; called when the first ``count_states=True`` field is declared."""
+    global _connected
+    if not _connected:
+        class_prepared.connect(_connect_model, weak=False, dispatch_uid='django_fsm_ex.counters')
+        _connected = True
+
+
+def state_counts(model: Type[Model], field: str = 'state', using: Optional[str] = None) -> Dict[object, int]:
+    """
+    各状态的行数
+
+    Read the number of rows per state of a ``count_states=True`` field from its counters,
+    one row per state, instead of ``SELECT state, COUNT(*) ... GROUP BY state``.
+    States without rows are left out, like in the ``GROUP BY`` result.
+    Also available as ``Model.state_counts(field)``.
+    """
+    from django_fsm_ex.models import StateCounter
+
+    field = _counted_field(model, field)
+    counters = StateCounter.objects.using(using or router.db_for_read(StateCounter)) \
+        .filter(model=field.model._meta.label, field=field.name).exclude(count=0)
+    return {field.to_python(state or None): count for state, count in counters.values_list('state', 'count')}
+
+
+def recount_states(model: Type[Model], field: str = 'state', batch: int = RECOUNT_BATCH_SIZE,
+                   using: Optional[str] = None) -> Dict[object, int]:
+    """
+    重新统计各状态的行数
+
+    Rebuild the counters of a ``count_states=True`` field with one ``GROUP BY`` query per
+    ``batch`` rows (in primary key order), e.g. after rows were changed with
+    ``QuerySet.update()`` or raw SQL, which bypass the counters. Transitions committed
+    while the table is scanned may be missed; run it when the table is quiet.
+    Returns the new counts.
+    """
+    from django_fsm_ex.models import StateCounter
+
+    field = _counted_field(model, field)
+    concrete_model = field.model._meta.concrete_model
+    rows = concrete_model._base_manager.using(using).order_by()
+    totals, last = {}, None
+    while True:
+        chunk = rows if last is None else rows.filter(pk__gt=last)
+        upper = list(chunk.order_by('pk').values_list('pk', flat=True)[batch - 1:batch])
+        if upper:
+            chunk = chunk.filter(pk__lte=upper[0])
+        for state, n in chunk.values_list(field.attname).annotate(n=Count('pk')):
+            key = '' if state is None else str(state)
+            totals[key] = totals.get(key, 0) + n
+        if not upper:
+            break
+        last = upper[0]
+
+    counter_db = using or router.db_for_write(StateCounter)
+    label = field.model._meta.label
+    with transaction.atomic(using=counter_db):
+        StateCounter.objects.using(counter_db).filter(model=label, field=field.name).delete()
+        StateCounter.objects.using(counter_db).bulk_create(
+            StateCounter(model=label, field=field.name, state=state, count=n) for state, n in totals.items())
+    return {field.to_python(state or None): n for state, n in totals.items()}
@@ -1,9 +1,10 @@
 # coding: utf-8
+from datetime import timedelta
 from functools import wraps
 from typing import Optional, Union, Iterable
 
-from django.db.models import Model
-from django_fsm_ex.fields import FSMMeta,FSMFieldType
+from django.db.models import Model, Q
+from django_fsm_ex.fields import FSMMeta,FSMFieldType, FSM_META_ATTR_NAME
 from django_fsm_ex.types import StateType, TransitionPermission
 
 __author__ = 'banxi'
@@ -12,11 +13,6 @@ __all__ = [
     'transition'
 ]
 
-FSM_META_ATTR_NAME = '_django_fsm'
-"""
-添加在 Django Model 实例方法对象中隐藏属性。
-"""
-
 
 def transition(field:FSMFieldType,
                source:Union[StateType,Iterable[StateType]]='*',
@@ -24,35 +20,73 @@ def transition(field:FSMFieldType,
                on_error:Optional[StateType]=None,
                conditions:Optional[list]=None,
                permission:Optional[TransitionPermission]=None,
-               custom:Optional[dict]=None):
+               custom:Optional[dict]=None,
+               sql_condition:Optional[Q]=None,
+               sql_update:bool=False,
+               save:bool=False,
+               after:Optional[timedelta]=None,
+               auto:bool=False):
     """
     Method decorator for mark allowed transitions
 
     Set target to None if current state needs to be validated and
     has not changed after the function call
 
+    ``sql_condition`` is the ``Q`` equivalent of ``conditions``; it is used by
+    ``FSMQuerySet.with_available_transitions()``, ``can_transition()`` and the bulk
+    operations, which cannot call Python conditions. It is not checked on the instance.
+
+    With ``sql_update=True`` the transition runs as one guarded ``UPDATE`` of the
+    row and the result comes from the row count, see ``FSMFieldMixin.change_state_in_db``.
+    The target must be a fixed state.
+
+    With ``save=True`` (or ``fsm_save_transitions = True`` on the model) the instance is
+    saved after the transition with ``update_fields`` limited to the state field and the
+    fields changed by the method, see ``FSMFieldMixin.save_transition``.
+
+    With ``after=timedelta(...)`` the transition is run by ``manage.py fsm_sweep`` on the
+    rows which entered their source state longer than ``after`` ago; the field must be
+    declared with ``track_entered_at=True`` and the method is called without arguments,
+    see ``django_fsm_ex.sweep``.
+
+    With ``auto=True`` the transition is run by ``manage.py fsm_sweep`` on the rows in a
+    source state whose conditions are met; declare an ``sql_condition`` so that the rows
+    whose conditions cannot be met are filtered out in the query instead of being loaded.
+
     带参数的装饰器函数
 
 
     :return:
     """
 
+    if sql_update and (target is None or hasattr(target, 'get_state') or on_error is not None):
+        raise ValueError('sql_update 的转移必须有确定的目标状态,且不能设置 on_error')
+    if after is not None and not isinstance(after, timedelta):
+        raise ValueError('after 必须是 timedelta')
+
     def inner_transition(func):
         wrapper_installed, fsm_meta = True, getattr(func,  FSM_META_ATTR_NAME, None)
         if not fsm_meta:
             wrapper_installed = False
             fsm_meta = FSMMeta(field=field, method=func)
             setattr(func, FSM_META_ATTR_NAME, fsm_meta)
+        fsm_meta.sql_update = fsm_meta.sql_update or sql_update
+        fsm_meta.save = fsm_meta.save or save
+        fsm_meta.after = fsm_meta.after or after
+        fsm_meta.auto = fsm_meta.auto or auto
         if isinstance(source, (list, tuple, set)):
             iter_sources = source
         else:
             iter_sources = [source]
         for state in iter_sources:
-            fsm_meta.add_transition(func, state, target, on_error, conditions, permission, custom)
+            fsm_meta.add_transition(func, state, target, on_error, conditions, permission, custom, sql_condition)
 
         @wraps(func)
         def _change_state(instance:Model, *args, **kwargs):
-            return fsm_meta.field.change_state(instance, func, *args, **kwargs)
+            field = fsm_meta.field
+            if isinstance(field, str):
+                field = fsm_meta.resolve_field(instance.__class__)
+            return field.change_state(instance, func, *args, **kwargs)
 
         if not wrapper_installed:
             return _change_state
@@ -0,0 +1,67 @@
+# coding: utf-8
+import threading
+
+from django.db import connections, router
+
+from django_fsm_ex.oncommit import CommitBuffer, current_buffer
+from django_fsm_ex.signals import post_transition, post_transition_committed
+
+__author__ = 'banxi'
+
+__all__ = ['send_post_transition']
+
+
+class _CommitBatch(CommitBuffer):
+    """
+    一个事务中等待提交后发送的信号
+
+    The ``post_transition`` deliveries queued in one transaction of a connection, sent
+    in order once it commits; deliveries queued in a rolled back savepoint are dropped
+    and duplicates of the same instance and transition are delivered once (the first
+    one wins).
+    """
+
+    def write(self, entries):
+        sent = set()
+        for key, signal, signal_kwargs in entries:
+            if (signal, key) not in sent:
+                sent.add((signal, key))
+                signal.send(**signal_kwargs)
+
+
+_local = threading.local()  # 和数据库连接一样按线程区分
+
+
+def _delivery_key(signal_kwargs):
+    instance = signal_kwargs['instance']
+    identity = (instance._meta.concrete_model, instance.pk) if instance.pk is not None else id(instance)
+    return identity, signal_kwargs['field'].name, signal_kwargs['name']
+
+
+def defer_until_commit(signal, signal_kwargs):
+    """
+    Send ``signal`` once the current transaction of the instance's database commits,
+    right away outside of a transaction. Rolled back deliveries are dropped and
+    duplicates of the same instance and transition are coalesced.
+    """
+    instance = signal_kwargs['instance']
+    using = instance._state.db or router.db_for_write(instance.__class__, instance=instance)
+    if not connections[using].in_atomic_block:
+        signal.send(**signal_kwargs)
+        return
+    current_buffer(_local, using, _CommitBatch).add((_delivery_key(signal_kwargs), signal, signal_kwargs))
+
+
+def send_post_transition(signal_kwargs):
+    """
+    Deliver ``post_transition`` (deferred to commit for fields declared with
+    ``defer_post_transition=True``) and queue ``post_transition_committed``.
+    """
+    field, sender = signal_kwargs['field'], signal_kwargs['sender']
+    if post_transition.has_listeners(sender):
+        if field.defer_post_transition:
+            defer_until_commit(post_transition, signal_kwargs)
+        else:
+            post_transition.send(**signal_kwargs)
+    if post_transition_committed.has_listeners(sender):
+        defer_until_commit(post_transition_committed, signal_kwargs)
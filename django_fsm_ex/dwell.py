@@ -0,0 +1,253 @@
+# coding: utf-8
+import math
+from datetime import date, datetime, time, timedelta
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Max, Model, QuerySet, Window
+from django.db.models.functions import Lead
+from django.utils import timezone
+
+from django_fsm_ex.history import _log_field
+
+__author__ = 'banxi'
+
+__all__ = ['DwellStats', 'dwell_times', 'dwell_stats', 'rollup_dwell', 'prune_transition_log']
+
+DWELL_CHUNK_SIZE = 2000
+PRUNE_CHUNK_SIZE = 500
+
+PERCENTILES = (50, 90, 99)
+"""DwellStats 中的百分位数: p50, p90, p99"""
+
+ALL_TRANSITIONS = ''
+"""DwellStats.name: 离开状态的所有转移合计"""
+
+
+class DwellStats(NamedTuple):
+    """一个状态(经由 ``name`` 转移离开)的停留时间分布,单位为秒"""
+    state: str
+    name: str
+    count: int
+    total: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """Nearest-rank percentile of the sorted ``values``, like ``PERCENTILE_DISC``"""
+    if not values:
+        return 0.0
+    return values[max(0, min(len(values), math.ceil(len(values) * percent / 100)) - 1)]
+
+
+def _stats(state: str, name: str, durations: List[float]) -> DwellStats:
+    """Stats of the sorted ``durations``"""
+    return DwellStats(state, name, len(durations), sum(durations),
+                      *(percentile(durations, percent) for percent in PERCENTILES), durations[-1])
+
+
+def _day(value: datetime) -> date:
+    return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+
+
+def _day_start(day: date) -> datetime:
+    value = datetime.combine(day, time.min)
+    return timezone.make_aware(value) if settings.USE_TZ else value
+
+
+def _stays(model: Type[Model], field: str, since: Optional[datetime], until: Optional[datetime],
+           using: Optional[str]) -> QuerySet:
+    """``(object_pk, state, name, entered, left)`` of the log rows, see ``dwell_times()``"""
+    from django_fsm_ex.models import TransitionLog
+
+    field = _log_field(model, field)
+    log = TransitionLog.objects.using(using).filter(model=model._meta.label, field=field.name).exclude(target='')
+    if until is not None:
+        log = log.filter(created__lt=until)
+    if since is not None:
+        log = log.filter(object_pk__in=log.filter(created__gte=since).values('object_pk'))
+
+    window = {'partition_by': [F('object_pk')], 'order_by': [F('created').asc(), F('id').asc()]}
+    return log.order_by().annotate(left=Window(Lead('created'), **window), left_by=Window(Lead('name'), **window)) \
+        .values_list('object_pk', 'target', 'left_by', 'created', 'left')
+
+
+def dwell_times(model: Type[Model], field: str = 'state', since: Optional[datetime] = None,
+                until: Optional[datetime] = None, chunk_size: int = DWELL_CHUNK_SIZE,
+                using: Optional[str] = None) -> Iterator[Tuple[str, str, str, datetime, datetime]]:
+    """
+    每次在某个状态中的停留
+
+    Stream ``(object_pk, state, name, entered, left)`` for each stay of a row in a state
+    which ended in ``[since, until)``: ``name`` is the transition which left the state.
+    Computed from the transition log (the field must be declared with
+    ``log_transitions=True``) in one query with
+    ``LEAD(created) OVER (PARTITION BY object_pk ORDER BY created, id)``, so the database
+    needs window functions (PostgreSQL, MySQL 8, SQLite 3.25+).
+
+    The time spent in the state a row was created in is not logged, and stays not
+    ended yet are left out. ``since`` limits the query to the rows with a transition
+    logged since then, but the whole history of those rows is read.
+    """
+    for object_pk, state, name, entered, left in _stays(model, field, since, until, using).iterator(chunk_size=chunk_size):
+        if left is not None and (since is None or left >= since):
+            yield object_pk, state, name, entered, left
+
+
+def _sql_stats(stays: QuerySet, since: Optional[datetime], by_day: bool) -> List[Tuple[Optional[date], DwellStats]]:
+    """
+    Aggregate ``stays`` in the database with ``PERCENTILE_DISC(...) WITHIN GROUP`` and
+    ``GROUPING SETS`` (PostgreSQL): only one row per state and transition is read.
+    """
+    connection = connections[stays.db]
+    qn = connection.ops.quote_name
+    sql, params = stays.query.sql_with_params()
+    left = qn('left')
+    columns = [f'{qn("target")} AS state', f'{qn("left_by")} AS name',
+               f'CAST(EXTRACT(EPOCH FROM {left} - {qn("created")}) AS double precision) AS seconds']
+    keys = 'state'
+    if by_day:
+        # 和 _day() 一样按当前时区取停留结束的日期
+        if settings.USE_TZ:
+            columns.insert(0, f'CAST({left} AT TIME ZONE %s AS date) AS day')
+            params = (timezone.get_current_timezone_name(), *params)
+        else:
+            columns.insert(0, f'CAST({left} AS date) AS day')
+        keys = 'day, state'
+    where = f'{left} IS NOT NULL'
+    if since is not None:
+        where += f' AND {left} >= %s'
+        params = (*params, since)
+    fractions = ', '.join(str(percent / 100) for percent in PERCENTILES)
+    query = (f'SELECT {keys}, name, GROUPING(name), COUNT(*), SUM(seconds), '
+             f'PERCENTILE_DISC(CAST(ARRAY[{fractions}] AS double precision[])) WITHIN GROUP (ORDER BY seconds), '
+             f'MAX(seconds) '
+             f'FROM (SELECT {", ".join(columns)} FROM ({sql}) stays WHERE {where}) durations '
+             f'GROUP BY GROUPING SETS (({keys}, name), ({keys}))')
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    result = []
+    for row in rows:
+        day, row = (row[0], row[1:]) if by_day else (None, row)
+        state, name, total_row, count, total, percentiles, longest = row
+        result.append((day, DwellStats(state, ALL_TRANSITIONS if total_row else name, count, total,
+                                       *percentiles, longest)))
+    result.sort(key=lambda item: (item[0] or date.min, item[1].state, item[1].name))
+    return result
+
+
+def _python_stats(stays: QuerySet, since: Optional[datetime], by_day: bool) -> List[Tuple[Optional[date], DwellStats]]:
+    """
+    Aggregate ``stays`` in Python, keeping one float per stay in memory: the fallback of
+    the backends without ``PERCENTILE_DISC`` (SQLite, MySQL). The stays of all the
+    transitions leaving a state are merged from the sorted lists, one state at a time.
+    """
+    durations = {}  # (day, state, name) -> [seconds]
+    for object_pk, state, name, entered, left in stays.iterator(chunk_size=DWELL_CHUNK_SIZE):
+        if left is not None and (since is None or left >= since):
+            key = (_day(left) if by_day else None, state, name)
+            durations.setdefault(key, []).append((left - entered).total_seconds())
+
+    result = []
+    keys = sorted(durations, key=lambda key: (key[0] or date.min, key[1], key[2]))
+    for (day, state), group in groupby(keys, key=itemgetter(0, 1)):
+        per_name = []
+        for key in group:
+            values = durations.pop(key)
+            values.sort()
+            per_name.append((key[2], values))
+        result.append((day, _stats(state, ALL_TRANSITIONS, list(merge(*(values for name, values in per_name))))))
+        result.extend((day, _stats(state, name, values)) for name, values in per_name)
+    return result
+
+
+def _aggregate(stays: QuerySet, since: Optional[datetime], by_day: bool = False) -> List[Tuple[Optional[date], DwellStats]]:
+    if connections[stays.db].vendor == 'postgresql':
+        return _sql_stats(stays, since, by_day)
+    return _python_stats(stays, since, by_day)
+
+
+def dwell_stats(model: Type[Model], field: str = 'state', since: Optional[datetime] = None,
+                until: Optional[datetime] = None, using: Optional[str] = None) -> List[DwellStats]:
+    """
+    各状态停留时间的百分位数
+
+    Aggregate ``dwell_times()`` into the count, total, p50/p90/p99 (nearest rank, like
+    ``PERCENTILE_DISC``) and maximum (in seconds) of the time spent in each state, per
+    transition leaving it and for all of them (``name`` is ``ALL_TRANSITIONS``).
+
+    On PostgreSQL the percentiles are computed by the database and only the result rows
+    are read; on other backends the durations are read and computed in Python.
+    """
+    return [stats for day, stats in _aggregate(_stays(model, field, since, until, using), since)]
+
+
+def rollup_dwell(model: Type[Model], field: str = 'state', until: Optional[date] = None,
+                 using: Optional[str] = None) -> int:
+    """
+    按天汇总停留时间
+
+    Store ``dwell_stats()`` of each complete day before ``until`` (today by default) not
+    rolled up yet as ``StateDwellDaily`` rows, a stay being counted on the day it ended,
+    so that older transition log rows can be pruned with ``prune_transition_log()``.
+    Percentiles of several days cannot be combined exactly, ``count`` and ``total`` can.
+    Returns the number of rows written.
+    """
+    from django_fsm_ex.models import StateDwellDaily
+
+    field = _log_field(model, field)
+    label = model._meta.label
+    until = until or timezone.localdate()
+    rolled = StateDwellDaily.objects.using(using).filter(model=label, field=field.name)
+    last_day = rolled.aggregate(last=Max('day'))['last']
+    since = _day_start(last_day + timedelta(days=1)) if last_day is not None else None
+
+    stays = _stays(model, field.name, since, _day_start(until), using)
+    rows = [StateDwellDaily(model=label, field=field.name, day=day, **stats._asdict())
+            for day, stats in _aggregate(stays, since, by_day=True)]
+    with transaction.atomic(using=using):
+        StateDwellDaily.objects.using(using).bulk_create(rows)
+    return len(rows)
+
+
+def prune_transition_log(model: Type[Model], field: str = 'state', before: Optional[date] = None,
+                         using: Optional[str] = None) -> int:
+    """
+    删除已经汇总的转移日志
+
+    Delete the transition log rows of ``model``/``field`` logged before ``before`` (by
+    default the day after the last day rolled up by ``rollup_dwell()``, which must cover
+    it). The last row of each object before that day is kept: it is the start of the
+    stay in its current state. Take a ``StateSnapshot`` first when ``states_as_of()``
+    needs to go back before ``before``. Returns the number of deleted rows.
+    """
+    from django_fsm_ex.models import StateDwellDaily, TransitionLog
+
+    field = _log_field(model, field)
+    label = model._meta.label
+    last_day = StateDwellDaily.objects.using(using).filter(model=label, field=field.name) \
+        .aggregate(last=Max('day'))['last']
+    if last_day is None or (before is not None and before > last_day + timedelta(days=1)):
+        raise ValueError(f'{label}.{field.name} 的停留时间还没有汇总到 {before},不能删除之前的日志')
+    cutoff = _day_start(before or last_day + timedelta(days=1))
+
+    old = TransitionLog.objects.using(using).filter(model=label, field=field.name, created__lt=cutoff)
+    # 每个对象在 cutoff 之前的最后一条记录是当前状态的开始,需要保留
+    latest = old.exclude(target='').order_by().values('object_pk').annotate(last=Max('id')).values('last')
+    # 先查出要删除的 id 再分批删除: MySQL 不能在 DELETE 的子查询中读取同一张表
+    ids = old.exclude(id__in=latest).order_by('id').values_list('id', flat=True)
+    deleted = 0
+    while True:
+        chunk = list(ids[:PRUNE_CHUNK_SIZE])
+        if not chunk:
+            return deleted
+        deleted += TransitionLog.objects.using(using).filter(id__in=chunk).delete()[0]
@@ -0,0 +1,112 @@
+# coding: utf-8
+import time
+from datetime import timedelta
+from typing import Iterable, Iterator, NamedTuple, Optional, Type, Union
+
+from django.db.models import Model
+from django.utils import timezone
+
+__author__ = 'banxi'
+
+__all__ = ['ChangeEvent', 'ChangeFeed', 'change_feed']
+
+
+class ChangeEvent(NamedTuple):
+    """``TransitionLog`` 中的一条状态变化,``cursor`` 用于从它之后继续读取"""
+    cursor: int
+    model: str
+    object_pk: str
+    field: str
+    name: str
+    source: str
+    target: str
+    user_pk: str
+    exception: str
+    created: object
+
+    def as_dict(self) -> dict:
+        data = self._asdict()
+        data['created'] = self.created.isoformat()
+        return data
+
+
+class ChangeFeed:
+    """
+    按主键(keyset)分页读取状态转移日志
+
+    Iterates ``TransitionLog`` rows after ``since`` in id order, ``batch`` rows per query
+    (``WHERE id > last ORDER BY id LIMIT batch``, never ``OFFSET``), as ``ChangeEvent``
+    tuples. ``cursor`` is the id of the last event yielded, to be stored and passed back
+    as ``since`` to resume. With ``follow`` the feed waits ``interval`` seconds and polls
+    again when it has caught up instead of stopping.
+
+    Entries are written when their transaction commits, so with concurrent writers a
+    smaller id may become visible after a larger one was read; consumers that cannot
+    miss events should stay a little behind the head: with ``lag`` a page stops at the
+    first row inserted less than ``lag`` seconds ago (``TransitionLog.inserted``, set
+    when the row is written, not when the transition ran; the cursor does not move past
+    it), and the feed reads it again once it is old enough. In ``'sync'`` mode the rows
+    are inserted inside the transaction, so ``lag`` must also cover its duration.
+    """
+
+    def __init__(self, since: Union[int, str, None] = None,
+                 models: Optional[Iterable[Union[str, Type[Model]]]] = None,
+                 batch: int = 1000, follow: bool = False, interval: float = 1.0,
+                 lag: float = 0, using: Optional[str] = None):
+        self.cursor = int(since) if since not in (None, '') else 0
+        self.models = None if models is None else [
+            model if isinstance(model, str) else model._meta.label for model in models]
+        self.batch = batch
+        self.follow = follow
+        self.interval = interval
+        self.lag = lag
+        self.using = using
+        self.stopped = False
+
+    def stop(self):
+        """Stop a following feed after the current batch, e.g. from a signal handler."""
+        self.stopped = True
+
+    def _queryset(self):
+        from django_fsm_ex.models import TransitionLog
+
+        queryset = TransitionLog.objects.using(self.using).filter(id__gt=self.cursor)
+        if self.models is not None:
+            queryset = queryset.filter(model__in=self.models)
+        return queryset.order_by('id').values_list(*_EVENT_COLUMNS, 'inserted')[:self.batch]
+
+    def __iter__(self) -> Iterator[ChangeEvent]:
+        while not self.stopped:
+            count = 0
+            cutoff = timezone.now() - timedelta(seconds=self.lag) if self.lag else None
+            # iterator(): 不缓存结果集,在支持的数据库上使用服务端游标
+            for row in self._queryset().iterator(chunk_size=self.batch):
+                event = ChangeEvent(*row[:-1])
+                if cutoff is not None and (row[-1] or event.created) > cutoff:
+                    # 不能跳过这一行: 它之前可能还有没有提交的行,等它足够旧后再读
+                    break
+                self.cursor = event.cursor
+                count += 1
+                yield event
+            if count < self.batch:
+                if not self.follow:
+                    return
+                time.sleep(self.interval)
+
+
+# ChangeEvent 各字段对应的列,cursor 即主键
+_EVENT_COLUMNS = ('id',) + ChangeEvent._fields[1:]
+
+
+def change_feed(since=None, models=None, batch: int = 1000, **options) -> ChangeFeed:
+    """
+    Tail the state changes recorded by fields declared with ``log_transitions=True``::
+
+        feed = change_feed(since=last_cursor, models=[Order])
+        for event in feed:
+            index(event)
+        last_cursor = feed.cursor
+
+    See ``ChangeFeed``.
+    """
+    return ChangeFeed(since=since, models=models, batch=batch, **options)
@@ -1,15 +1,23 @@
 # coding: utf-8
 import inspect
-from typing import Type, TYPE_CHECKING, Optional
+from types import MappingProxyType
+from typing import Type, TYPE_CHECKING, Optional, Mapping
 
 from django.apps import apps
-from django.db import models
-from django.db.models import Model
-from django.db.models.signals import class_prepared
+from django.db import models, router, transaction
+from django.db.models import DEFERRED, F, Model, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from functools import partialmethod
 
+from django_fsm_ex.counters import connect_counters, count_transition, note_transition, state_counts
+from django_fsm_ex.deferred import send_post_transition
 from django_fsm_ex.errors import TransitionNotAllowed
-from django_fsm_ex.signals import pre_transition, post_transition, transition_not_allowed, no_transition
+from django_fsm_ex.log import transition_logger
+from django_fsm_ex.outbox import connect_outbox, record_transition, write_outbox
+from django_fsm_ex.registry import registry
+from django_fsm_ex.signals import pre_transition, post_transition, transition_not_allowed, no_transition, \
+    post_transition_committed
 from django_fsm_ex.types import StateType, TransitionPermission, OptStateType, OptTransitionConditions, \
     OptTransitionPermission, OptDict
 
@@ -18,7 +26,17 @@ if TYPE_CHECKING:
 
 __author__ = 'banxi'
 
-__all__ = ['Transition','FSMFieldMixin','FSMFieldType', 'FSMField', 'FSMIntegerField','FSMKeyField','get_all_FIELD_transitions', 'get_available_FIELD_transitions', 'get_available_user_FIELD_transitions','FSMMeta','get_fsm_meta']
+__all__ = ['Transition','TransitionIndex','FSMFieldMixin','FSMFieldType', 'FSMField', 'FSMIntegerField','FSMKeyField','get_all_FIELD_transitions', 'get_available_FIELD_transitions', 'get_available_user_FIELD_transitions','FSMMeta','get_fsm_meta']
+
+FSM_META_ATTR_NAME = '_django_fsm'
+"""
+添加在 Django Model 实例方法对象中隐藏属性。
+"""
+
+UNIT_OF_WORK_ATTR_NAME = '_fsm_unit_of_work'
+"""
+实例处于 unit_of_work 中时,保存在实例 __dict__ 中的 UnitOfWork 对象。
+"""
 
 class Transition:
     def __init__(self, method,
@@ -27,7 +45,8 @@ class Transition:
                  on_error: Optional[StateType],
                  conditions:list,
                  permission: TransitionPermission,
-                 custom:dict):
+                 custom:dict,
+                 sql_condition:Optional[Q]=None):
         """
 
         :param method:  应用了 transition 装饰的  django.Model 实例方法
@@ -37,6 +56,7 @@ class Transition:
         :param conditions:
         :param permission: 执行状态转换方法所需要的权限,或者是一个接收 instance,user 参数的回调函数 。
         :param custom: 其他自定义参数。
+        :param sql_condition: conditions 在数据库中的等价条件(Q 对象),用于在查询中判断转移是否可用。
         """
         self.method = method
         self.source = source
@@ -45,11 +65,15 @@ class Transition:
         self.conditions = conditions
         self.permission = permission
         self.custom = custom
+        self.sql_condition = sql_condition
 
     @property
     def name(self):
         return self.method.__name__
 
+    def conditions_met(self, instance:Model):
+        return all(condition(instance) for condition in self.conditions)
+
     def has_perm(self, instance:Model, user:'User'):
         if not self.permission:
             return True
@@ -63,6 +87,70 @@ class Transition:
             return False
 
 
+class TransitionIndex:
+    """
+    预编译的 状态 -> 可用转移 索引
+
+    Immutable index of one (model class, field) pair mapping every known state
+    straight to the transitions available from it, ordered like the transition
+    methods of the class, with ``'*'`` and ``'+'`` sources already expanded.
+
+    Known states are the field choices plus every concrete source, target and
+    on_error state of the transitions; any other state resolves to ``fallback``.
+
+    Transitions are keyed by the attribute name of their method in the registry table,
+    not by ``method.__name__``: an alias, or methods built by a factory, keep their own
+    name. ``names`` maps each method back to its (first) attribute name.
+
+    ``save_transitions`` is the ``fsm_save_transitions`` flag of the class, read once here
+    instead of on every transition.
+    """
+    __slots__ = ('by_state', 'fallback', 'all', 'names', 'save_transitions')
+
+    def __init__(self, field, table:Mapping[str, object], save_transitions:bool=False):
+        metas = [(name, get_fsm_meta(method)) for name, method in table.items()]
+        states = set(value for value, label in field.flatchoices)
+        for name, meta in metas:
+            for source, transition in meta.state_to_transition.items():
+                if source not in ('*', '+'):
+                    states.add(source)
+                target = transition.target
+                if hasattr(target, 'get_state'):
+                    states.update(getattr(target, 'allowed_states', None) or ())
+                elif target is not None:
+                    states.add(target)
+                if transition.on_error is not None:
+                    states.add(transition.on_error)
+
+        self.by_state = {state: self._available(metas, state) for state in states}
+        # 不在已知状态中的状态只能匹配到 '*' 或 '+' 转移,而且 '+' 的目标一定是已知状态
+        self.fallback = MappingProxyType(dict(
+            (name, transition)
+            for name, transition in ((name, meta.state_to_transition.get('*') or meta.state_to_transition.get('+'))
+                                     for name, meta in metas)
+            if transition is not None))
+        self.all = tuple(transition for name, meta in metas for transition in meta.state_to_transition.values())
+        self.names = MappingProxyType({method: name for name, method in reversed(list(table.items()))})
+        self.save_transitions = bool(save_transitions)
+
+    @staticmethod
+    def _available(metas, state):
+        return MappingProxyType(dict(
+            (name, meta.get_transition(state))
+            for name, meta in metas if meta.has_transition(state)))
+
+    def lookup(self, state:StateType) -> Mapping[str, Transition]:
+        """
+        Returns ``{attribute name: Transition}`` of the transitions available from ``state``,
+        without checking conditions.
+        """
+        try:
+            return self.by_state.get(state, self.fallback)
+        except TypeError:
+            # 不可哈希的状态值
+            return self.fallback
+
+
 class FSMFieldDescriptor:
     def __init__(self, field):
         self.field :FSMFieldType = field
@@ -91,13 +179,55 @@ def _fmt_field_label(field:models.Field):
         # 如果重复定义时此时没有 model
         return field.verbose_name
 
+def _has_receivers(signal, sender):
+    return bool(signal.receivers) and signal.has_listeners(sender)
+
+def _has_post_receivers(sender):
+    # 没有任何接收者时不调用 has_listeners
+    return ((post_transition.receivers and post_transition.has_listeners(sender))
+            or (post_transition_committed.receivers and post_transition_committed.has_listeners(sender)))
+
+def version_field(model:Type[Model]) -> Optional[models.Field]:
+    """The ``ConcurrentTransitionMixin.version_field`` of ``model`` as a field, or None"""
+    name = getattr(model, 'version_field', None)
+    return None if name is None else model._meta.get_field(name)
+
+def version_increment(field:models.Field):
+    """``UPDATE`` value bumping the version like ``ConcurrentTransitionMixin.save()`` does"""
+    return Coalesce(F(field.attname), Value(0)) + Value(1)
+
+def _signal_kwargs(instance:Model, method, field, source, args, kwargs, **extra):
+    return dict({
+        'sender': instance.__class__,
+        'instance': instance,
+        'name': method.__name__,
+        'field': field,
+        'source': source,
+        'method_args': args,
+        'method_kwargs': kwargs
+    }, **extra)
+
 class FSMFieldMixin:
     descriptor_class = FSMFieldDescriptor
 
     def __init__(self, *args, **kwargs):
         self.protected = kwargs.pop('protected', False)
-        self.transitions = {}  # cls -> (transitions name -> method)
+        # 为 True 时 post_transition 在事务提交后才发送,见 django_fsm_ex.deferred
+        self.defer_post_transition = kwargs.pop('defer_post_transition', False)
+        # 为 True 时每次成功的转移随 save() 写入一条发件箱记录,见 django_fsm_ex.outbox
+        self.outbox = kwargs.pop('outbox', False)
+        # 为 True 时每次转移写入一条审计日志,见 django_fsm_ex.log
+        self.log_transitions = kwargs.pop('log_transitions', False)
+        # 为 True 时维护每个状态的行数,见 django_fsm_ex.counters
+        self.count_states = kwargs.pop('count_states', False)
+        # 为 True 时添加 <name>_entered_at 字段记录进入当前状态的时间,见 transition(after=...)
+        self.track_entered_at = kwargs.pop('track_entered_at', False)
+        self.entered_at_field = None
+        # 是否需要在转移后记录日志、发件箱、计数或进入时间,在 contribute_to_class 中确定
+        self._records_transitions = False
+        self._indexes = {}  # cls -> TransitionIndex, 从 registry 取得后缓存
         self.state_proxy = {}  # state -> ProxyClsRef
+        self._state_proxy_classes = {}  # state -> proxy model class
 
         state_choices = kwargs.pop('state_choices', None)
         choices = kwargs.get('choices', None)
@@ -117,6 +247,15 @@ class FSMFieldMixin:
         name, path, args, kwargs = super().deconstruct()
         if self.protected:
             kwargs['protected'] = self.protected
+        if self.defer_post_transition:
+            kwargs['defer_post_transition'] = self.defer_post_transition
+        if self.outbox:
+            kwargs['outbox'] = self.outbox
+        if self.log_transitions:
+            kwargs['log_transitions'] = self.log_transitions
+        if self.count_states:
+            kwargs['count_states'] = self.count_states
+        # track_entered_at 不写入迁移: 迁移中已经有它添加的字段和索引,历史模型不能再添加一次
         return name, path, args, kwargs
 
     def get_state(self, instance:Model):
@@ -129,127 +268,334 @@ class FSMFieldMixin:
     def set_state(self, instance:Model, state):
         instance.__dict__[self.name] = state
 
+    def touch_entered_at(self, instance:Model, when=None):
+        if self.entered_at_field is not None:
+            instance.__dict__[self.entered_at_field.attname] = when or timezone.now()
+
     def set_proxy(self, instance:Model, state):
         """
         Change class
         """
-        if state in self.state_proxy:
-            state_proxy = self.state_proxy[state]
+        if self.state_proxy:
+            proxy = self.get_state_proxy(state)
+            if proxy is not None and instance.__class__ is not proxy:
+                instance.__class__ = proxy
 
+    def get_state_proxy(self, state) -> Optional[Type[Model]]:
+        """
+        Returns the proxy model class declared for ``state`` through ``state_choices``, or None.
+        The class is looked up in the app registry once and cached on the field.
+        """
+        proxy = self._state_proxy_classes.get(state)
+        if proxy is None and state in self.state_proxy:
+            state_proxy = self.state_proxy[state]
             try:
                 app_label, model_name = state_proxy.split(".")
             except ValueError:
                 # If we can't split, assume a model in current app
-                app_label = instance._meta.app_label
+                app_label = self.model._meta.app_label
                 model_name = state_proxy
-            model = apps.get_model(app_label, model_name)
             # if not model found will raise LookupError
-            instance.__class__ = model
+            proxy = self._state_proxy_classes[state] = apps.get_model(app_label, model_name)
+        return proxy
+
+    def resolve_state_proxies(self):
+        """
+        Resolve all proxy classes of ``state_choices`` ahead of time
+        """
+        for state in self.state_proxy:
+            self.get_state_proxy(state)
 
     def change_state(self, instance:Model, method, *args, **kwargs):
         meta = get_fsm_meta(method)
-        method_name = method.__name__
+        if meta.sql_update:
+            return self.change_state_in_db(instance, method, *args, **kwargs)
         current_state = self.get_state(instance)
-        field = meta.field
-        method_label = getattr(method,'label',method_name)
-        state_label = getattr(current_state,'label', str(current_state))
-        field_label = _fmt_field_label(field)
-        signal_kwargs = {
-            'sender': instance.__class__,
-            'instance': instance,
-            'name': method_name,
-            'field': field,
-            'source': current_state,
-            'method_args' : args,
-            'method_kwargs' : kwargs
-        }
-        if not meta.has_transition(current_state):
-            error_msg = f"{field_label}当前处于{state_label}状态,不能进行{method_label}操作"
-            no_transition.send(**signal_kwargs)
-            raise TransitionNotAllowed(error_msg, object=instance, method=method,field=field,current_state=current_state)
-
-        next_state = meta.next_state(current_state)
-        signal_kwargs['target'] = next_state
-        if not meta.conditions_met(instance, current_state):
-            error_msg = f"{field_label}当前处于{state_label}状态,尚未满足进行{method_label}操作的条件"
-            transition_not_allowed.send(**signal_kwargs)
-            raise TransitionNotAllowed(error_msg, object=instance, method=method,field=field,current_state=current_state)
-
-        pre_transition.send(**signal_kwargs)
+        # 只解析一次转移,错误信息和信号参数只在需要时才构造
+        transition = meta.resolve(current_state)
+        if transition is None or not transition.conditions_met(instance):
+            self._reject_transition(instance, method, transition, current_state, args, kwargs)
+
+        sender = instance.__class__
+        next_state = transition.target
+        signal_kwargs = None
+        if pre_transition.receivers and pre_transition.has_listeners(sender):
+            signal_kwargs = _signal_kwargs(instance, method, meta.field, current_state, args, kwargs, target=next_state)
+            pre_transition.send(**signal_kwargs)
+
+        # 在 unit_of_work 中由其统一保存并发送 post_transition
+        snapshot = None
+        if (meta.save or (self._indexes.get(sender) or self.get_transition_index(sender)).save_transitions) \
+                and UNIT_OF_WORK_ATTR_NAME not in instance.__dict__:
+            snapshot = self._snapshot(instance)
 
         try:
             result = method(instance, *args, **kwargs)
             if next_state is not None:
                 if hasattr(next_state, 'get_state'):
-                    from django_fsm_ex.decorators import transition
+                    from django_fsm_ex.decorators import transition as transition_decorator
                     next_state = next_state.get_state(
-                        instance, transition, result,
+                        instance, transition_decorator, result,
                         args=args, kwargs=kwargs)
-                    signal_kwargs['target'] = next_state
+                    if signal_kwargs is not None:
+                        signal_kwargs['target'] = next_state
                 self._do_update_state(instance, next_state)
+                if self._records_transitions:
+                    self.touch_entered_at(instance)
         except Exception as exc:
-            exception_state = meta.exception_state(current_state)
+            exception_state = transition.on_error
+            if self.log_transitions:
+                transition_logger.log(instance, self, method.__name__, current_state, exception_state, exc)
             if exception_state:
                 self._do_update_state(instance, exception_state)
-                signal_kwargs['target'] = exception_state
-                signal_kwargs['exception'] = exc
-                post_transition.send(**signal_kwargs)
+                self.touch_entered_at(instance)
+                if self.count_states:
+                    note_transition(instance, self, current_state)
+                if _has_post_receivers(sender):
+                    if signal_kwargs is None:
+                        signal_kwargs = _signal_kwargs(instance, method, meta.field, current_state, args, kwargs)
+                    signal_kwargs['target'] = exception_state
+                    signal_kwargs['exception'] = exc
+                    self._send_post_transition(instance, signal_kwargs)
             raise
         else:
-            post_transition.send(**signal_kwargs)
+            if self._records_transitions:
+                if self.log_transitions:
+                    transition_logger.log(instance, self, method.__name__, current_state, next_state)
+                if self.outbox:
+                    record_transition(instance, method.__name__, current_state, next_state)
+                if self.count_states:
+                    note_transition(instance, self, current_state)
+            if snapshot is not None:
+                self.save_transition(instance, snapshot)
+            if _has_post_receivers(sender):
+                if signal_kwargs is None:
+                    signal_kwargs = _signal_kwargs(instance, method, meta.field, current_state, args, kwargs, target=next_state)
+                self._send_post_transition(instance, signal_kwargs)
 
         return result
 
-    def get_all_transitions(self, instance_cls:Type[Model]):
+    @staticmethod
+    def _send_post_transition(instance:Model, signal_kwargs:dict):
+        unit_of_work = instance.__dict__.get(UNIT_OF_WORK_ATTR_NAME)
+        if unit_of_work is None:
+            send_post_transition(signal_kwargs)
+        else:
+            unit_of_work.pending.append(signal_kwargs)
+
+    @staticmethod
+    def _snapshot(instance:Model) -> dict:
+        values = instance.__dict__
+        return {field.attname: values[field.attname]
+                for field in instance._meta.concrete_fields if field.attname in values}
+
+    def save_transition(self, instance:Model, snapshot:dict):
         """
-        Returns [(source, target, name, method)] for all field transitions
+        转移后只保存被修改的字段
+
+        Saves the instance after a transition with ``update_fields`` limited to this field
+        and the fields whose value differs from ``snapshot`` (taken before the transition
+        method was called); new instances are saved in full. Values mutated in place
+        (e.g. a dict of a JSON field) are not detected. Fields loaded lazily by the method
+        are saved as well.
+        """
+        if instance._state.adding or instance.pk is None:
+            instance.save()
+            return
+        values = instance.__dict__
+        update_fields = {self.name}
+        for field in instance._meta.concrete_fields:
+            attname = field.attname
+            if attname in values and not field.primary_key:
+                old = snapshot.get(attname, DEFERRED)
+                value = values[attname]
+                if old is DEFERRED or (value is not old and value != old):
+                    update_fields.add(field.name)
+        instance.save(update_fields=update_fields)
+
+    def change_state_in_db(self, instance:Model, method, *args, **kwargs):
+        """
+        以一条带条件的 UPDATE 执行状态转移
+
+        Runs the transition as ``UPDATE ... SET state = target WHERE pk = ? AND state = <in-memory
+        state> AND <sql_condition>``; the row count tells whether it was allowed, so the
+        transition is race-free without ``ConcurrentTransitionMixin`` and needs no ``save()``.
+
+        The row must still hold the in-memory state, which is the source recorded by the
+        signals, the transition log, the outbox and the state counters: a stale instance
+        is rejected even when the state in the database is another source. The method body is called before the UPDATE and
+        should not have side effects: raising from it aborts the transition.
+        Python ``conditions`` are not called, only ``sql_condition``.
+        It cannot run inside ``unit_of_work()``, which saves the instance once at the end.
+        """
+        from django_fsm_ex.queryset import compile_guards, _check_bulk_conditions
+
+        if UNIT_OF_WORK_ATTR_NAME in instance.__dict__:
+            raise ValueError(f'{getattr(method, "label", method.__name__)}直接更新数据库,不能在 unit_of_work 中执行')
+        meta = get_fsm_meta(method)
+        if meta._sql_guards is None:
+            guards = compile_guards(meta)
+            _check_bulk_conditions(guards)
+            meta._sql_guards = guards
+        if instance.pk is None:
+            raise ValueError(f'{getattr(method, "label", method.__name__)}只能在已保存的实例上执行')
+
+        current_state = self.get_state(instance)
+        transition = meta.resolve(current_state)
+        guard = next((guard for guard in meta._sql_guards if guard.matches(current_state)), None)
+        if guard is None:
+            self._reject_transition(instance, method, transition, current_state, args, kwargs)
+
+        sender = instance.__class__
+        next_state = guard.target
+        signal_kwargs = None
+        if _has_receivers(pre_transition, sender):
+            signal_kwargs = _signal_kwargs(instance, method, meta.field, current_state, args, kwargs, target=next_state)
+            pre_transition.send(**signal_kwargs)
+
+        result = method(instance, *args, **kwargs)
+        using = instance._state.db or router.db_for_write(sender, instance=instance)
+        # 按内存中的状态更新,记录的源状态就是数据库中被替换的状态
+        queryset = sender._base_manager.using(using).filter(
+            guard.as_q(self.attname), pk=instance.pk, **{self.attname: current_state})
+        updates = {self.attname: next_state}
+        entered_at = None
+        if self.entered_at_field is not None:
+            entered_at = updates[self.entered_at_field.attname] = timezone.now()
+        # 和 save() 一样增加版本号,否则按版本号检查的旧实例仍然可以覆盖这次转移
+        version = version_field(sender)
+        if version is not None:
+            updates[version.attname] = version_increment(version)
+        if self.outbox:
+            with transaction.atomic(using=using):
+                updated = queryset.update(**updates)
+                if updated:
+                    record_transition(instance, method.__name__, current_state, next_state)
+                    write_outbox(instance, using)
+        else:
+            updated = queryset.update(**updates)
+        if not updated:
+            self._reject_transition(instance, method, transition, current_state, args, kwargs)
+        if self.log_transitions:
+            transition_logger.log(instance, self, method.__name__, current_state, next_state)
+        if self.count_states:
+            count_transition(instance, self, current_state, next_state)
+
+        self._do_update_state(instance, next_state)
+        self.touch_entered_at(instance, entered_at)
+        # ConcurrentTransitionMixin: 数据库中的状态已经是目标状态
+        set_initial_state = getattr(instance, '_set_initial_state', None)
+        if set_initial_state is not None:
+            set_initial_state(self, next_state)
+        if version is not None:
+            # 实例加载时的版本号加一;实例已经过期时,之后的 save() 仍然会冲突
+            loaded = getattr(instance, '_fsm_initial_version', DEFERRED)
+            if loaded is not DEFERRED:
+                instance.__dict__[version.attname] = instance._fsm_initial_version = (loaded or 0) + 1
+
+        if _has_post_receivers(sender):
+            if signal_kwargs is None:
+                signal_kwargs = _signal_kwargs(instance, method, meta.field, current_state, args, kwargs, target=next_state)
+            send_post_transition(signal_kwargs)
+        return result
+
+    def _reject_transition(self, instance:Model, method, transition:Optional[Transition], current_state, args, kwargs):
+        """
+        Sends ``no_transition``/``transition_not_allowed`` and raises ``TransitionNotAllowed``
         """
-        transitions = self.transitions[instance_cls]
+        field = get_fsm_meta(method).field
+        method_label = getattr(method, 'label', method.__name__)
+        state_label = getattr(current_state, 'label', str(current_state))
+        field_label = _fmt_field_label(field)
+        if transition is None:
+            error_msg = f"{field_label}当前处于{state_label}状态,不能进行{method_label}操作"
+            no_transition.send(**_signal_kwargs(instance, method, field, current_state, args, kwargs))
+        else:
+            error_msg = f"{field_label}当前处于{state_label}状态,尚未满足进行{method_label}操作的条件"
+            transition_not_allowed.send(
+                **_signal_kwargs(instance, method, field, current_state, args, kwargs, target=transition.target))
+        raise TransitionNotAllowed(error_msg, object=instance, method=method, field=field, current_state=current_state)
 
-        for name, transition in transitions.items():
-            meta = get_fsm_meta(transition)
+    @property
+    def transitions(self):
+        """
+        cls -> (transitions name -> method), collected lazily by the registry
+        """
+        return _FieldTransitions(self)
 
-            for transition in meta.state_to_transition.values():
-                yield transition
+    def get_transition_index(self, instance_cls:Type[Model]) -> TransitionIndex:
+        index = self._indexes.get(instance_cls)
+        if index is None:
+            index = self._indexes[instance_cls] = registry.get_index(instance_cls, self)
+        return index
+
+    def get_state_transitions(self, instance:Model) -> Mapping[str, Transition]:
+        """
+        Returns ``{name: Transition}`` available in current instance state, conditions are not checked
+        """
+        return registry.get_index(instance.__class__, self).lookup(self.get_state(instance))
+
+    def get_all_transitions(self, instance_cls:Type[Model]):
+        """
+        Returns [(source, target, name, method)] for all field transitions
+        """
+        yield from registry.get_index(instance_cls, self).all
 
     def contribute_to_class(self, cls, name, **kwargs):
         self.base_cls = cls
+        # 抽象模型的字段是浅复制的,不共用父类字段的缓存
+        self._indexes = {}
         super(FSMFieldMixin, self).contribute_to_class(cls, name, **kwargs)
         field_name = self.name
         setattr(cls, field_name, self.descriptor_class(self))
+        if self.outbox:
+            connect_outbox()
+        if self.track_entered_at and not cls._meta.abstract:
+            self._add_entered_at_field(cls)
+        if self.count_states:
+            connect_counters()
+            if not hasattr(cls, 'state_counts'):
+                setattr(cls, 'state_counts', classmethod(state_counts))
+        self._records_transitions = bool(self.log_transitions or self.outbox or self.count_states
+                                         or self.entered_at_field is not None)
         setattr(cls, f'get_all_{field_name}_transitions', partialmethod(get_all_FIELD_transitions, field=self))
         setattr(cls, f'get_available_{field_name}_transitions',
                 partialmethod(get_available_FIELD_transitions, field=self))
         setattr(cls, f'get_available_user_{field_name}_transitions',
                 partialmethod(get_available_user_FIELD_transitions, field=self))
 
-        class_prepared.connect(self._collect_transitions)
+    def _add_entered_at_field(self, cls):
+        """
+        Add the ``<name>_entered_at`` column, set by each transition, and an index on
+        ``(<name>, <name>_entered_at)`` used to find the rows due for an ``after`` transition.
+        """
+        name = f'{self.name}_entered_at'
+        self.entered_at_field = models.DateTimeField(default=timezone.now, editable=False)
+        cls.add_to_class(name, self.entered_at_field)
+        # 索引名在模型准备完成时生成;不修改可能和父类共用的列表
+        cls._meta.indexes = [*cls._meta.indexes, models.Index(fields=[self.name, name])]
+        # 迁移只从 original_attrs 中读取 Meta.indexes
+        cls._meta.original_attrs['indexes'] = cls._meta.indexes
 
-    def _collect_transitions(self, *args, **kwargs):
 
-        sender = kwargs['sender']
+class _FieldTransitions:
+    """
+    Read-only ``cls -> {name: method}`` view of the transitions of a field
+    """
+    def __init__(self, field:'FSMFieldMixin'):
+        self.field = field
+
+    def __getitem__(self, cls:Type[Model]):
+        return registry.get_transitions(cls, self.field)
 
-        if not issubclass(sender, self.base_cls):
-            return
+    def get(self, cls:Type[Model], default=None):
+        try:
+            return self[cls]
+        except KeyError:
+            return default
 
-        def is_field_transition_method(attr):
-            if inspect.ismethod(attr) or inspect.isfunction(attr):
-                try:
-                    fsm_meta = get_fsm_meta(attr)
-                except TypeError:
-                    return  False
-                else:
-                    return fsm_meta.field in [self, self.name]
-            return  False
-
-        sender_transitions = {}
-        transitions = inspect.getmembers(sender, predicate=is_field_transition_method)
-        for method_name, method in transitions:
-            meta = get_fsm_meta(method)
-            meta.field = self
-            sender_transitions[method_name] = method
-
-        self.transitions[sender] = sender_transitions
+    def __contains__(self, cls:Type[Model]):
+        return self.get(cls) is not None
 
 class FSMFieldType(FSMFieldMixin, models.Field):
     pass
@@ -285,13 +631,9 @@ def get_available_FIELD_transitions(instance:Model, field:FSMFieldType):
     List of transitions available in current model state
     with all conditions met
     """
-    curr_state = field.get_state(instance)
-    transitions = field.transitions[instance.__class__]
-
-    for name, transition in transitions.items():
-        meta = get_fsm_meta(transition)
-        if meta.has_transition(curr_state) and meta.conditions_met(instance, curr_state):
-            yield meta.get_transition(curr_state)
+    for transition in field.get_state_transitions(instance).values():
+        if transition.conditions_met(instance):
+            yield transition
 
 
 def get_all_FIELD_transitions(instance:Model, field:FSMFieldType):
@@ -320,6 +662,15 @@ class FSMMeta:
     def __init__(self, field:FSMFieldType, method):
         self.field = field
         self.state_to_transition = {}  # source -> Transition
+        # 为 True 时在数据库中以一条带条件的 UPDATE 执行转移,见 FSMFieldMixin.change_state_in_db
+        self.sql_update = False
+        self._sql_guards = None
+        # 为 True 时转移后只保存被修改的字段,见 FSMFieldMixin.save_transition
+        self.save = False
+        # 在源状态停留超过这个时间(timedelta)后由 fsm_sweep 执行,见 django_fsm_ex.sweep
+        self.after = None
+        # 为 True 时在条件满足后由 fsm_sweep 执行
+        self.auto = False
 
     def get_transition(self, source:StateType):
         transition = self.state_to_transition.get(source, None)
@@ -329,7 +680,33 @@ class FSMMeta:
             transition = self.state_to_transition.get('+', None)
         return transition
 
-    def add_transition(self, method, source:StateType, target:StateType, on_error:OptStateType=None, conditions:OptTransitionConditions=None, permission:OptTransitionPermission=None, custom:OptDict=None):
+    def resolve_field(self, instance_cls:Type[Model]) -> 'FSMFieldType':
+        """
+        Returns the field of the transition, collecting the transitions of ``instance_cls``
+        when it was declared by field name (e.g. on a mixin) and is not bound yet
+        """
+        if isinstance(self.field, str):
+            field = instance_cls._meta.get_field(self.field)
+            registry.get_transitions(instance_cls, field)
+            return field
+        return self.field
+
+    def resolve(self, state:StateType) -> Optional[Transition]:
+        """
+        Returns the transition applicable in ``state`` or None,
+        same as ``has_transition`` followed by ``get_transition`` but with a single lookup
+        """
+        table = self.state_to_transition
+        transition = table.get(state)
+        if transition is None:
+            transition = table.get('*')
+            if transition is None:
+                transition = table.get('+')
+                if transition is not None and transition.target == state:
+                    return None
+        return transition
+
+    def add_transition(self, method, source:StateType, target:StateType, on_error:OptStateType=None, conditions:OptTransitionConditions=None, permission:OptTransitionPermission=None, custom:OptDict=None, sql_condition:Optional[Q]=None):
         if custom is None:
             custom = {}
         if conditions is None:
@@ -345,7 +722,8 @@ class FSMMeta:
             on_error=on_error,
             conditions=conditions,
             permission=permission,
-            custom=custom)
+            custom=custom,
+            sql_condition=sql_condition)
 
     def has_transition(self, state:StateType):
         """
@@ -370,11 +748,8 @@ class FSMMeta:
 
         if transition is None:
             return False
-        elif not transition.conditions:
-            return True
         else:
-            # return all(map(lambda condition: condition(instance), transition.conditions))
-            return  all(condition(instance) for condition in transition.conditions)
+            return transition.conditions_met(instance)
 
     def has_transition_perm(self, instance:Model, state:StateType, user:'User'):
         transition = self.get_transition(state)
@@ -407,7 +782,6 @@ class FSMMeta:
 
 
 def get_fsm_meta(method) -> FSMMeta:
-    from django_fsm_ex.decorators import FSM_META_ATTR_NAME
     try:
         meta = getattr(method, FSM_META_ATTR_NAME)
     except AttributeError:
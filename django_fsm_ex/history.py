@@ -0,0 +1,124 @@
+# coding: utf-8
+from datetime import datetime
+from typing import Iterator, Optional, Tuple, Type
+
+from django.db import transaction
+from django.db.models import Model
+from django.utils import timezone
+
+__author__ = 'banxi'
+
+__all__ = ['take_snapshot', 'states_as_of']
+
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def _log_field(model: Type[Model], field: str):
+    field = model._meta.get_field(field)
+    if not getattr(field, 'log_transitions', False):
+        raise ValueError(f'{model._meta.label}.{field.name} 没有设置 log_transitions,无法回溯历史状态')
+    return field
+
+
+def take_snapshot(model: Type[Model], field: str = 'state', batch: int = SNAPSHOT_BATCH_SIZE,
+                  using: Optional[str] = None) -> 'StateSnapshot':
+    """
+    保存当前所有行的状态快照
+
+    Store the current ``(pk, state)`` of every row of ``model`` as a ``StateSnapshot``,
+    reading and writing ``batch`` rows at a time. Run it periodically (``manage.py
+    fsm_snapshot``) so that ``states_as_of()`` only has to replay the log since the
+    nearest snapshot.
+
+    The rows are read in one transaction; use a database where a transaction sees a
+    consistent view (e.g. REPEATABLE READ on PostgreSQL) when rows change while the
+    snapshot is taken.
+    """
+    from django_fsm_ex.models import StateSnapshot, StateSnapshotEntry
+
+    field = _log_field(model, field)
+    with transaction.atomic(using=using):
+        snapshot = StateSnapshot.objects.using(using).create(
+            model=model._meta.label, field=field.name, taken_at=timezone.now())
+        rows = model._base_manager.using(using).order_by('pk').values_list('pk', field.attname)
+        entries, count = [], 0
+        for pk, state in rows.iterator(chunk_size=batch):
+            entries.append(StateSnapshotEntry(snapshot=snapshot, object_pk=str(pk),
+                                              state='' if state is None else str(state)))
+            if len(entries) >= batch:
+                count += len(entries)
+                StateSnapshotEntry.objects.using(using).bulk_create(entries)
+                entries = []
+        count += len(entries)
+        StateSnapshotEntry.objects.using(using).bulk_create(entries)
+        snapshot.rows = count
+        snapshot.save(update_fields=['rows'])
+    return snapshot
+
+
+def states_as_of(model: Type[Model], field: str, timestamp: datetime, batch: int = SNAPSHOT_BATCH_SIZE,
+                 using: Optional[str] = None) -> Iterator[Tuple[object, object]]:
+    """
+    回溯某一时刻所有行的状态
+
+    Stream ``(pk, state)`` of the rows of ``model`` as they were at ``timestamp``: the
+    nearest snapshot taken at or before ``timestamp`` is read ``batch`` entries at a time
+    (keyset on the object pk) and each chunk is patched with the transition log entries
+    of the same pk range logged after the snapshot and up to ``timestamp``. The log of
+    the pks after the last snapshot entry (of every pk without a snapshot) is then
+    replayed ``batch`` distinct pks at a time, so that memory stays bounded by ``batch``
+    rows plus their log entries.
+
+    The field must be declared with ``log_transitions=True``. Rows which did not exist in
+    the snapshot and have no logged transition before ``timestamp`` are not reported,
+    nor is the deletion of rows.
+    """
+    from django_fsm_ex.models import StateSnapshot, StateSnapshotEntry, TransitionLog
+
+    field = _log_field(model, field)
+    label = model._meta.label
+    to_pk, to_state = model._meta.pk.to_python, field.to_python
+
+    snapshot = StateSnapshot.objects.using(using).filter(
+        model=label, field=field.name, taken_at__lte=timestamp).order_by('-taken_at').first()
+    log = TransitionLog.objects.using(using).filter(model=label, field=field.name, created__lte=timestamp) \
+        .exclude(target='')
+    if snapshot is not None:
+        log = log.filter(created__gt=snapshot.taken_at)
+
+    def chunk(states, last, upper):
+        # 用 (last, upper] 区间内的日志修正状态
+        tail = log
+        if last is not None:
+            tail = tail.filter(object_pk__gt=last)
+        if upper is not None:
+            tail = tail.filter(object_pk__lte=upper)
+        for object_pk, target in tail.order_by('id').values_list('object_pk', 'target').iterator(chunk_size=batch):
+            states[object_pk] = target
+        for object_pk, state in states.items():
+            yield to_pk(object_pk), to_state(state) if state != '' else None
+
+    last = None
+    if snapshot is not None:
+        entries = StateSnapshotEntry.objects.using(using).filter(snapshot=snapshot).order_by('object_pk')
+        while True:
+            rows = list((entries if last is None else entries.filter(object_pk__gt=last))
+                        .values_list('object_pk', 'state')[:batch])
+            if not rows:
+                break
+            # 按数据库的排序规则划分区间,和 Python 的字符串排序可能不同
+            upper = rows[-1][0]
+            yield from chunk(dict(rows), last, upper)
+            last = upper
+            if len(rows) < batch:
+                break
+
+    # 快照之后新出现的行(没有快照时是所有行)只在日志中,同样按 object_pk 分段回放
+    keys = log.order_by('object_pk').values_list('object_pk', flat=True).distinct()
+    while True:
+        bound = list((keys if last is None else keys.filter(object_pk__gt=last))[batch - 1:batch])
+        upper = bound[0] if bound else None
+        yield from chunk({}, last, upper)
+        if upper is None:
+            return
+        last = upper
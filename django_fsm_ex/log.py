@@ -0,0 +1,164 @@
+# coding: utf-8
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Model
+from django.utils import timezone
+
+from django_fsm_ex.oncommit import CommitBuffer, current_buffer
+
+__author__ = 'banxi'
+
+__all__ = ['TransitionLogger', 'TransitionLogMiddleware', 'acting_user', 'transition_logger']
+
+DEFAULT_MAX_BUFFER = 1000
+
+# 当前线程执行转移的用户(user)和请求中缓冲的日志(request_buffer)
+_context = threading.local()
+
+
+@contextmanager
+def acting_user(user):
+    """
+    设置记录到转移日志中的用户
+
+    Set the user recorded in the transition log for the transitions run in the block,
+    e.g. in management commands or tasks; ``TransitionLogMiddleware`` does it for requests.
+    """
+    previous = getattr(_context, 'user', None)
+    _context.user = user
+    try:
+        yield user
+    finally:
+        _context.user = previous
+
+
+class _TransactionBuffer(CommitBuffer):
+    """一个事务中等待写入的日志"""
+
+    def __init__(self, logger: 'TransitionLogger', using: str):
+        super().__init__(using)
+        self.logger = logger
+
+    def write_current_level(self):
+        """
+        Write the entries logged at the current savepoint level right away, inside the
+        transaction: their rows commit or roll back with it, like in ``'sync'`` mode.
+        """
+        self.logger.write(self.pop_current_level(), self.using)
+
+    def write(self, entries: List):
+        self.logger.write(entries, self.using)
+
+
+class TransitionLogger:
+    """
+    批量写入状态转移日志
+
+    Collects ``TransitionLog`` entries and writes them with ``bulk_create``:
+
+    - ``'commit'`` mode (default): inside a transaction the entries are buffered and
+      written after it commits, entries of rolled back transactions or savepoints are
+      dropped. Outside of a transaction they are buffered per request by
+      ``TransitionLogMiddleware`` and written when the response is returned, or written
+      right away when there is no request.
+    - ``'sync'`` mode: every entry is inserted when it is logged, in the current transaction.
+
+    A buffer holding ``max_buffer`` entries is written at once, inside the current
+    transaction when there is one. Configured by the ``FSM_TRANSITION_LOG_MODE`` and
+    ``FSM_TRANSITION_LOG_MAX_BUFFER`` settings.
+    """
+
+    def __init__(self, mode: Optional[str] = None, max_buffer: Optional[int] = None):
+        self._mode = mode
+        self._max_buffer = max_buffer
+        self._local = threading.local()  # 和数据库连接一样按线程区分
+
+    @property
+    def mode(self) -> str:
+        return self._mode or getattr(settings, 'FSM_TRANSITION_LOG_MODE', 'commit')
+
+    @property
+    def max_buffer(self) -> int:
+        return self._max_buffer or getattr(settings, 'FSM_TRANSITION_LOG_MAX_BUFFER', DEFAULT_MAX_BUFFER)
+
+    def log(self, instance: Model, field, name: str, source, target, exception: Optional[Exception] = None):
+        from django_fsm_ex.models import TransitionLog
+
+        user = getattr(_context, 'user', None)
+        entry = TransitionLog(
+            model=instance._meta.label,
+            object_pk='' if instance.pk is None else str(instance.pk),
+            field=field.name,
+            name=name,
+            source='' if source is None else str(source),
+            target='' if target is None else str(target),
+            user_pk='' if user is None or user.pk is None else str(user.pk),
+            exception='' if exception is None else repr(exception),
+            created=timezone.now())
+        using = router.db_for_write(TransitionLog, instance=instance)
+
+        if self.mode == 'sync':
+            self.write([entry], using)
+        elif connections[using].in_atomic_block:
+            buffer = current_buffer(self._local, using, lambda alias: _TransactionBuffer(self, alias))
+            buffer.add(entry)
+            if buffer.size >= self.max_buffer:
+                buffer.write_current_level()
+        else:
+            entries = getattr(_context, 'request_buffer', None)
+            if entries is None:
+                self.write([entry], using)
+            else:
+                entries.append((using, entry))
+                if len(entries) >= self.max_buffer:
+                    self.flush_request(entries)
+
+    def flush_request(self, entries: List):
+        by_alias = {}
+        for using, entry in entries:
+            by_alias.setdefault(using, []).append(entry)
+        entries.clear()
+        for using, batch in by_alias.items():
+            self.write(batch, using)
+
+    def write(self, entries: List, using: str):
+        if entries:
+            from django_fsm_ex.models import TransitionLog
+
+            inserted = timezone.now()
+            for entry in entries:
+                entry.inserted = inserted
+            TransitionLog.objects.using(using).bulk_create(entries)
+
+
+transition_logger = TransitionLogger()
+
+
+class TransitionLogMiddleware:
+    """
+    记录当前用户,并在请求结束时写入缓冲的转移日志
+
+    Records ``request.user`` as the acting user of the transitions run by the request
+    and buffers their log entries (outside of transactions) until the response is returned.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and not user.is_authenticated:
+            user = None
+        entries = []
+        previous_user = getattr(_context, 'user', None)
+        previous_buffer = getattr(_context, 'request_buffer', None)
+        _context.user, _context.request_buffer = user, entries
+        try:
+            return self.get_response(request)
+        finally:
+            _context.user, _context.request_buffer = previous_user, previous_buffer
+            transition_logger.flush_request(entries)
@@ -0,0 +1,57 @@
+# coding: utf-8
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from django_fsm_ex.dwell import _day_start, dwell_stats, prune_transition_log, rollup_dwell
+
+__author__ = 'banxi'
+
+
+def _parse_day(value):
+    day = parse_date(value) if value else None
+    if value and day is None:
+        raise CommandError(f'invalid date {value}, expected YYYY-MM-DD')
+    return day
+
+
+class Command(BaseCommand):
+    help = 'Reports the time spent in each state, computed from the transition log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument('--field', default='state', help='name of the FSM field')
+        parser.add_argument('--since', help='first day (YYYY-MM-DD) of the stays to report, by end date')
+        parser.add_argument('--until', help='day (YYYY-MM-DD) after the last one reported or rolled up, today by default')
+        parser.add_argument('--rollup', action='store_true',
+                            help='store the daily summaries of the complete days not rolled up yet instead of reporting')
+        parser.add_argument('--prune', action='store_true',
+                            help='with --rollup, then delete the transition log rows of the rolled up days')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        since, until = _parse_day(options['since']), _parse_day(options['until'])
+        field, using = options['field'], options['database']
+
+        try:
+            if options['rollup']:
+                self.stdout.write(f'{rollup_dwell(model, field, until=until, using=using)} daily rows written')
+                if options['prune']:
+                    self.stdout.write(f'{prune_transition_log(model, field, using=using)} log rows deleted')
+                return
+            stats = dwell_stats(model, field, since=_day_start(since) if since else None,
+                                until=_day_start(until) if until else None, using=using)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'{"state":20} {"transition":20} {"count":>8} {"p50":>12} {"p90":>12} {"p99":>12} {"max":>12}')
+        for row in stats:
+            durations = (str(timedelta(seconds=round(value))) for value in (row.p50, row.p90, row.p99, row.max))
+            self.stdout.write(f'{row.state:20} {row.name or "*":20} {row.count:>8} ' +
+                              ' '.join(f'{value:>12}' for value in durations))
@@ -0,0 +1,49 @@
+# coding: utf-8
+import csv
+import json
+import signal
+
+from django.core.management.base import BaseCommand
+
+from django_fsm_ex.feed import ChangeEvent, change_feed
+
+__author__ = 'banxi'
+
+
+class Command(BaseCommand):
+    help = 'Streams the transition log after a cursor to stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None, help='cursor to resume from (exclusive)')
+        parser.add_argument('--model', '-m', action='append', dest='models',
+                            help='app_label.ModelName, can be repeated')
+        parser.add_argument('--batch', '-b', type=int, default=1000, help='rows per query')
+        parser.add_argument('--format', '-f', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--follow', action='store_true', help='keep polling for new events')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls (with --follow)')
+        parser.add_argument('--lag', type=float, default=0,
+                            help='seconds to stay behind the head, for the transactions not committed yet')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        feed = change_feed(since=options['since'], models=options['models'], batch=options['batch'],
+                           follow=options['follow'], interval=options['interval'], lag=options['lag'],
+                           using=options['database'])
+        previous = {signum: signal.signal(signum, lambda signum, frame: feed.stop())
+                    for signum in (signal.SIGINT, signal.SIGTERM)}
+        # 逐行写出,不在内存中保留结果
+        out = self.stdout
+        try:
+            if options['format'] == 'csv':
+                writer = csv.writer(out, lineterminator='\n')
+                writer.writerow(ChangeEvent._fields)
+                for event in feed:
+                    writer.writerow(event.as_dict().values())
+            else:
+                for event in feed:
+                    out.write(json.dumps(event.as_dict(), ensure_ascii=False))
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        # 下次从这里继续
+        self.stderr.write(f'cursor: {feed.cursor}')
@@ -0,0 +1,44 @@
+# coding: utf-8
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_fsm_ex.outbox import drain_outbox
+
+__author__ = 'banxi'
+
+
+class Command(BaseCommand):
+    help = 'Dispatches the transition outbox rows through the outbox_dispatch signal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', '-b', type=int, default=100, help='rows per transaction')
+        parser.add_argument('--loop', action='store_true', help='keep polling for new rows')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait when the outbox is empty (with --loop)')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        previous = {signum: signal.signal(signum, self._stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+        total_dispatched = total_failed = 0
+        try:
+            while not self.stopping:
+                dispatched, failed = drain_outbox(options['batch'], using=options['database'])
+                total_dispatched += dispatched
+                total_failed += failed
+                if options['verbosity'] >= 2 and (dispatched or failed):
+                    self.stdout.write(f'{dispatched} dispatched, {failed} failed')
+                if dispatched + failed < options['batch']:
+                    # 已经取完,失败的记录要到重试时间才会再取出
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(f'{total_dispatched} dispatched, {total_failed} failed')
+
+    def _stop(self, signum, frame):
+        self.stopping = True
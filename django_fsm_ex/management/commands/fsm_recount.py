@@ -0,0 +1,39 @@
+# coding: utf-8
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_fsm_ex.counters import RECOUNT_BATCH_SIZE, recount_states
+
+__author__ = 'banxi'
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the state counters of count_states=True fields'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName, every counted model by default')
+        parser.add_argument('--field', help='name of the FSM field, every counted field by default')
+        parser.add_argument('--batch', '-b', type=int, default=RECOUNT_BATCH_SIZE, help='rows per GROUP BY query')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        try:
+            models = [apps.get_model(label) for label in options['models']]
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        if not models:
+            # 代理模型和子表共用声明字段的模型的计数
+            models = [model for model in apps.get_models() if not model._meta.proxy]
+
+        for model in models:
+            if options['field']:
+                fields = [options['field']]
+            else:
+                fields = [field.name for field in model._meta.local_concrete_fields
+                          if getattr(field, 'count_states', False)]
+            for field in fields:
+                try:
+                    counts = recount_states(model, field, batch=options['batch'], using=options['database'])
+                except ValueError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(f'{model._meta.label}.{field}: {sum(counts.values())} rows in {len(counts)} states')
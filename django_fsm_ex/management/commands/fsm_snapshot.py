@@ -0,0 +1,40 @@
+# coding: utf-8
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_fsm_ex.history import SNAPSHOT_BATCH_SIZE, take_snapshot
+
+__author__ = 'banxi'
+
+
+class Command(BaseCommand):
+    help = 'Stores a snapshot of the states of a model, used by states_as_of()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument('--field', default='state', help='name of the FSM field')
+        parser.add_argument('--batch', '-b', type=int, default=SNAPSHOT_BATCH_SIZE, help='rows per INSERT')
+        parser.add_argument('--keep', type=int, default=None,
+                            help='delete the older snapshots of the field, keeping this many')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        from django_fsm_ex.models import StateSnapshot
+
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        try:
+            snapshot = take_snapshot(model, options['field'], batch=options['batch'], using=options['database'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f'{snapshot}: {snapshot.rows} rows')
+
+        if options['keep'] is not None:
+            snapshots = StateSnapshot.objects.using(options['database']) \
+                .filter(model=snapshot.model, field=snapshot.field).order_by('-taken_at')
+            old = list(snapshots.values_list('pk', flat=True)[max(options['keep'], 1):])
+            if old:
+                StateSnapshot.objects.using(options['database']).filter(pk__in=old).delete()
+                self.stdout.write(f'{len(old)} old snapshots deleted')
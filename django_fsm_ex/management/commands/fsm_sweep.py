@@ -0,0 +1,73 @@
+# coding: utf-8
+import signal
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_fsm_ex.sweep import SWEEP_BATCH_SIZE, scheduled_transitions, sweep
+
+__author__ = 'banxi'
+
+
+class Command(BaseCommand):
+    help = 'Runs the transitions declared with after= or auto=True on the rows which are due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName, every model with scheduled transitions by default')
+        parser.add_argument('--transition', '-t', action='append', dest='names',
+                            help='name of the transition method, can be repeated')
+        parser.add_argument('--batch', '-b', type=int, default=SWEEP_BATCH_SIZE, help='rows per transaction')
+        parser.add_argument('--loop', action='store_true', help='sweep again every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60.0, help='seconds between sweeps (with --loop)')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        try:
+            if options['models']:
+                models = [apps.get_model(label) for label in options['models']]
+            else:
+                # 代理模型和父模型共用同一张表
+                models = [model for model in apps.get_models()
+                          if not model._meta.proxy and scheduled_transitions(model)]
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stopping = False
+        previous = {signum: signal.signal(signum, self._stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            while True:
+                for model in models:
+                    self._sweep(model, options)
+                if not options['loop'] or self.stopping:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _sweep(self, model, options):
+        stats = {}  # name -> [done, skipped, failed, elapsed]
+        try:
+            batches = sweep(model, names=options['names'], batch=max(1, options['batch']), using=options['database'])
+            for result in batches:
+                counts = stats.setdefault(result.name, [0, 0, 0, 0.0])
+                counts[0] += result.done
+                counts[1] += result.skipped
+                counts[2] += result.failed
+                counts[3] += result.elapsed
+                for error in result.errors:
+                    self.stderr.write(f'{model._meta.label}.{result.name} {error}')
+                if self.stopping:
+                    break
+        except ValueError as e:
+            raise CommandError(str(e))
+        for name, (done, skipped, failed, elapsed) in stats.items():
+            checked = done + skipped + failed
+            self.stdout.write(
+                f'{model._meta.label}.{name}: {done} done, {skipped} skipped, {failed} failed in {elapsed:.2f}s '
+                f'({checked / elapsed if elapsed else 0.0:.1f} rows/s checked, '
+                f'{done / elapsed if elapsed else 0.0:.1f} rows/s done)')
+
+    def _stop(self, signum, frame):
+        self.stopping = True
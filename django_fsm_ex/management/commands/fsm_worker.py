@@ -0,0 +1,175 @@
+# coding: utf-8
+import signal
+import time
+from collections import deque
+from typing import Iterator, List, Optional
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Max
+
+from django_fsm_ex.dwell import percentile
+from django_fsm_ex.queryset import resolve_transition, source_states_q
+from django_fsm_ex.sweep import run_transitions
+
+__author__ = 'banxi'
+
+
+def _init_worker():
+    # spawn 启动的子进程需要重新加载 Django;fork 时已经加载过,不会重复执行
+    django.setup()
+    # 子进程不能复用父进程的数据库连接;终止信号由父进程处理,正在执行的批次会执行完
+    connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def process_batch(label, name, pks):
+    """
+    Run the ``name`` transition over the rows ``pks`` of model ``label`` in one transaction
+    and save them. Rows locked by another worker are skipped, rows which can no longer
+    proceed are counted as skipped, rows whose transition or save raises are rolled back
+    on their own savepoint and counted as failed. A database error (lock timeout,
+    lost connection...) aborts the whole batch.
+
+    Returns ``(done, skipped, failed, latencies, errors)``.
+    """
+    model = apps.get_model(label)
+    meta, field = resolve_transition(model, name)
+    done, failed, latencies, errors = 0, 0, [], []
+    try:
+        done, failed = _run_batch(model, meta, field, name, pks, latencies, errors)
+    except DatabaseError as e:
+        return 0, 0, len(pks), [], [f'batch {pks[0]}..{pks[-1]}: {e!r}']
+    return done, len(pks) - done - failed, failed, latencies, errors
+
+
+def _run_batch(model, meta, field, name, pks, latencies, errors):
+    using = model._default_manager.db
+    with transaction.atomic(using=using):
+        instances = list(model._default_manager.select_for_update(skip_locked=True)
+                         .filter(source_states_q(meta, field.attname), pk__in=pks))
+        return run_transitions(name, meta, instances, using, errors, latencies)
+
+
+def _pk_batches(queryset, batch: int, limit: Optional[int] = None) -> Iterator[List]:
+    """
+    Read the primary keys of ``queryset`` ``batch`` at a time, in order and continuing
+    after the last one read (keyset pagination), when the next batch is needed: the
+    primary keys are never all held in memory. Only the rows up to the largest primary
+    key at the start are read.
+    """
+    # 先固定要处理的范围,执行过程中新加入的行留给下一次运行
+    upper = queryset.aggregate(upper=Max('pk'))['upper']
+    if upper is None:
+        return
+    pks = queryset.filter(pk__lte=upper).order_by('pk').values_list('pk', flat=True)
+    last = None
+    while limit is None or limit > 0:
+        size = batch if limit is None else min(batch, limit)
+        chunk = list((pks if last is None else pks.filter(pk__gt=last))[:size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+        if limit is not None:
+            limit -= len(chunk)
+
+
+class Command(BaseCommand):
+    help = 'Runs a transition method over every row in a valid source state, using a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument('--transition', '-t', required=True, help='name of the transition method')
+        parser.add_argument('--processes', '-p', type=int, default=1,
+                            help='number of worker processes, 1 runs in the current process')
+        parser.add_argument('--batch', '-b', type=int, default=200, help='rows per transaction')
+        parser.add_argument('--limit', type=int, default=None, help='process at most this many rows')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        name = options['transition']
+        try:
+            meta, field = resolve_transition(model, name)
+        except (AttributeError, TypeError):
+            raise CommandError(f'{model._meta.label} has no transition method {name}')
+        batch, processes = max(1, options['batch']), max(1, options['processes'])
+        self.verbosity = options['verbosity']
+
+        batches = _pk_batches(model._default_manager.filter(source_states_q(meta, field.attname)),
+                              batch, options['limit'])
+
+        self.stopping = False
+        previous = {signum: signal.signal(signum, self._stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+        self.stats = {'done': 0, 'skipped': 0, 'failed': 0, 'batches': 0}
+        self.latencies = []
+        start = time.perf_counter()
+        try:
+            if processes == 1:
+                for pk_batch in batches:
+                    if self.stopping:
+                        break
+                    self._collect(process_batch(model._meta.label, name, pk_batch))
+            else:
+                self._run_pool(model._meta.label, name, batches, processes)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self._report(time.perf_counter() - start)
+
+    def _run_pool(self, label, name, batches, processes):
+        import multiprocessing
+
+        # fork 之前关闭连接,避免子进程共用父进程的连接
+        connections.close_all()
+        pending = deque()
+        pool = multiprocessing.Pool(processes, initializer=_init_worker)
+        try:
+            for pk_batch in batches:
+                if self.stopping:
+                    break
+                # 限制排队的批次数,以便收到 SIGTERM 后尽快退出
+                while len(pending) >= processes * 2:
+                    self._collect(pending.popleft().get())
+                pending.append(pool.apply_async(process_batch, (label, name, pk_batch)))
+            while pending:
+                self._collect(pending.popleft().get())
+        finally:
+            # 子进程忽略了 SIGTERM,不能用 terminate() 结束
+            pool.close()
+            pool.join()
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        self.stderr.write('Stopping after the running batches...')
+
+    def _collect(self, result):
+        done, skipped, failed, latencies, errors = result
+        self.stats['done'] += done
+        self.stats['skipped'] += skipped
+        self.stats['failed'] += failed
+        self.stats['batches'] += 1
+        self.latencies.extend(latencies)
+        for error in errors:
+            self.stderr.write(error)
+        if self.verbosity >= 2:
+            self.stdout.write(f'batch {self.stats["batches"]}: {done} done, {skipped} skipped, {failed} failed')
+
+    def _report(self, elapsed):
+        latencies = sorted(self.latencies)
+        stats = self.stats
+        rate = stats['done'] / elapsed if elapsed else 0.0
+        self.stdout.write(
+            f'{stats["done"]} done, {stats["skipped"]} skipped, {stats["failed"]} failed '
+            f'in {stats["batches"]} batches, {elapsed:.2f}s ({rate:.1f} rows/s)')
+        if latencies:
+            self.stdout.write(
+                'latency ms: p50 %.2f  p95 %.2f  p99 %.2f  max %.2f' % tuple(
+                    value * 1000 for value in (percentile(latencies, 50), percentile(latencies, 95),
+                                               percentile(latencies, 99), latencies[-1])))
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransitionOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_pk', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=100)),
+                ('source', models.CharField(blank=True, max_length=50)),
+                ('target', models.CharField(blank=True, max_length=50)),
+                ('payload', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'index_together': {('model', 'object_pk', 'id')},
+            },
+        ),
+    ]
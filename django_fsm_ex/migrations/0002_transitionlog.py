@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_fsm_ex', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransitionLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_pk', models.CharField(max_length=64)),
+                ('field', models.CharField(max_length=100)),
+                ('name', models.CharField(max_length=100)),
+                ('source', models.CharField(blank=True, max_length=50)),
+                ('target', models.CharField(blank=True, max_length=50)),
+                ('user_pk', models.CharField(blank=True, max_length=64)),
+                ('exception', models.TextField(blank=True)),
+                ('created', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['id'],
+                'index_together': {('model', 'object_pk', 'id')},
+            },
+        ),
+    ]
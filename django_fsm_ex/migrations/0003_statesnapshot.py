@@ -0,0 +1,37 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_fsm_ex', '0002_transitionlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('field', models.CharField(max_length=100)),
+                ('taken_at', models.DateTimeField()),
+                ('rows', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'index_together': {('model', 'field', 'taken_at')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StateSnapshotEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_pk', models.CharField(max_length=64)),
+                ('state', models.CharField(blank=True, max_length=50)),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='django_fsm_ex.StateSnapshot')),
+            ],
+            options={
+                'index_together': {('snapshot', 'object_pk')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_fsm_ex', '0003_statesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('field', models.CharField(max_length=100)),
+                ('state', models.CharField(blank=True, max_length=50)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('model', 'field', 'state')},
+            },
+        ),
+    ]
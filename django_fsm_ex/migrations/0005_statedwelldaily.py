@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_fsm_ex', '0004_statecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateDwellDaily',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('field', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('state', models.CharField(max_length=50)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('count', models.PositiveIntegerField()),
+                ('total', models.FloatField()),
+                ('p50', models.FloatField()),
+                ('p90', models.FloatField()),
+                ('p99', models.FloatField()),
+                ('max', models.FloatField()),
+            ],
+            options={
+                'unique_together': {('model', 'field', 'day', 'state', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_fsm_ex', '0005_statedwelldaily'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transitionoutbox',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_fsm_ex', '0006_transitionoutbox_retry_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transitionlog',
+            name='inserted',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
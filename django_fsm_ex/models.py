@@ -1,4 +1,135 @@
-# -*- coding: utf-8 -*-
-"""
-Empty file to mark package as valid django application.
-"""
+# coding: utf-8
+from django.db import models
+
+__author__ = 'banxi'
+
+
+class TransitionOutbox(models.Model):
+    """
+    状态转移的发件箱
+
+    One row per successful transition of a field declared with ``outbox=True``, written
+    in the transaction which saves the new state, and dispatched later by
+    ``manage.py fsm_outbox_drain``.
+    """
+    model = models.CharField(max_length=100)  # app_label.ModelName
+    object_pk = models.CharField(max_length=64)
+    name = models.CharField(max_length=100)
+    source = models.CharField(max_length=50, blank=True)
+    target = models.CharField(max_length=50, blank=True)
+    payload = models.TextField(blank=True)  # JSON
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    retry_at = models.DateTimeField(null=True, blank=True)  # 失败后下一次发送的时间
+
+    class Meta:
+        ordering = ['id']
+        index_together = [('model', 'object_pk', 'id')]
+
+    def __str__(self):
+        return f'{self.model}#{self.object_pk} {self.name}: {self.source} -> {self.target}'
+
+
+class TransitionLog(models.Model):
+    """
+    状态转移审计日志
+
+    One row per ``change_state`` call of a field declared with ``log_transitions=True``,
+    written in batches by ``django_fsm_ex.log.TransitionLogger``.
+    ``exception`` holds the ``repr()`` of the exception raised by the transition method.
+    ``created`` is the time of the transition, ``inserted`` the time the row was written
+    (after the transaction committed in ``'commit'`` mode).
+    """
+    model = models.CharField(max_length=100)  # app_label.ModelName
+    object_pk = models.CharField(max_length=64)
+    field = models.CharField(max_length=100)
+    name = models.CharField(max_length=100)
+    source = models.CharField(max_length=50, blank=True)
+    target = models.CharField(max_length=50, blank=True)
+    user_pk = models.CharField(max_length=64, blank=True)
+    exception = models.TextField(blank=True)
+    created = models.DateTimeField()
+    inserted = models.DateTimeField(null=True, blank=True)  # 写入数据库的时间,晚于 created
+
+    class Meta:
+        ordering = ['id']
+        index_together = [('model', 'object_pk', 'id')]
+
+    def __str__(self):
+        return f'{self.model}#{self.object_pk} {self.name}: {self.source} -> {self.target}'
+
+
+class StateSnapshot(models.Model):
+    """
+    某一时刻某个模型状态字段的快照
+
+    The states of every row of one model/field at ``taken_at``, stored as
+    ``StateSnapshotEntry`` rows; used with the transition log by ``states_as_of()``.
+    """
+    model = models.CharField(max_length=100)  # app_label.ModelName
+    field = models.CharField(max_length=100)
+    taken_at = models.DateTimeField()
+    rows = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        index_together = [('model', 'field', 'taken_at')]
+
+    def __str__(self):
+        return f'{self.model}.{self.field} @ {self.taken_at.isoformat()}'
+
+
+class StateSnapshotEntry(models.Model):
+    snapshot = models.ForeignKey(StateSnapshot, on_delete=models.CASCADE, related_name='entries')
+    object_pk = models.CharField(max_length=64)
+    state = models.CharField(max_length=50, blank=True)
+
+    class Meta:
+        index_together = [('snapshot', 'object_pk')]
+
+
+class StateCounter(models.Model):
+    """
+    某个模型状态字段每个状态的行数
+
+    Maintained for fields declared with ``count_states=True`` by the transitions and the
+    save/delete of their rows, see ``django_fsm_ex.counters``; rebuilt by
+    ``manage.py fsm_recount``.
+    """
+    model = models.CharField(max_length=100)  # app_label.ModelName
+    field = models.CharField(max_length=100)
+    state = models.CharField(max_length=50, blank=True)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('model', 'field', 'state')]
+
+    def __str__(self):
+        return f'{self.model}.{self.field}={self.state}: {self.count}'
+
+
+class StateDwellDaily(models.Model):
+    """
+    每天各状态停留时间的汇总
+
+    The distribution (in seconds) of the stays in ``state`` which ended on ``day``, left
+    through the ``name`` transition ('' for all of them), written by
+    ``django_fsm_ex.dwell.rollup_dwell()`` from the transition log.
+    """
+    model = models.CharField(max_length=100)  # app_label.ModelName
+    field = models.CharField(max_length=100)
+    day = models.DateField()
+    state = models.CharField(max_length=50)
+    name = models.CharField(max_length=100, blank=True)
+    count = models.PositiveIntegerField()
+    total = models.FloatField()
+    p50 = models.FloatField()
+    p90 = models.FloatField()
+    p99 = models.FloatField()
+    max = models.FloatField()
+
+    class Meta:
+        unique_together = [('model', 'field', 'day', 'state', 'name')]
+
+    def __str__(self):
+        return f'{self.model}.{self.field}={self.state} {self.day}: {self.count}'
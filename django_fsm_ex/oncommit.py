@@ -0,0 +1,97 @@
+# coding: utf-8
+import threading
+from typing import Callable, List
+
+from django.db import connections, transaction
+
+__author__ = 'banxi'
+
+__all__ = ['CommitBuffer', 'current_buffer']
+
+
+class _Committed:
+    """on_commit 回调: 事务提交后把记录交给所属的缓冲区"""
+    __slots__ = ('buffer', 'entry')
+
+    def __init__(self, buffer: 'CommitBuffer', entry):
+        self.buffer = buffer
+        self.entry = entry
+
+    def __call__(self):
+        self.buffer.committed.append(self.entry)
+
+
+class CommitBuffer:
+    """
+    一个事务中等待提交后处理的记录
+
+    Base class of the buffers which collect entries during a transaction of one
+    connection and handle them together once it commits (``write()``).
+
+    Every entry registers a small ``on_commit`` callback, so that Django drops the
+    entries of rolled back savepoints; the callback which writes the batch is kept
+    last in ``run_on_commit``, outside of any savepoint, so that it runs once after them
+    and stays there until the transaction ends, which tells whether the buffer is
+    still the current one. This module is the only place which touches Django's
+    private ``connection.run_on_commit`` list.
+    """
+
+    def __init__(self, using: str):
+        self.using = using
+        self.size = 0
+        self.committed = []
+        # 绑定方法每次访问都是新对象,保存一个用于按对象查找
+        self.callback = self.flush
+
+    def add(self, entry):
+        connection = connections[self.using]
+        transaction.on_commit(_Committed(self, entry), using=self.using)
+        self.size += 1
+        run_on_commit = connection.run_on_commit
+        if len(run_on_commit) >= 2 and run_on_commit[-2][1] is self.callback:
+            run_on_commit[-2], run_on_commit[-1] = run_on_commit[-1], run_on_commit[-2]
+        else:
+            connection.run_on_commit = [item for item in run_on_commit if item[1] is not self.callback]
+            connection.run_on_commit.append((set(), self.callback))
+
+    def is_pending(self) -> bool:
+        # 通常就在最后,从后往前找
+        return any(item[1] is self.callback for item in reversed(connections[self.using].run_on_commit))
+
+    def pop_current_level(self) -> List:
+        """
+        Remove and return the entries added at the current savepoint level: they will
+        not be passed to ``write()`` at commit.
+        """
+        connection = connections[self.using]
+        level = set(connection.savepoint_ids)
+        entries, kept = [], []
+        for item in connection.run_on_commit:
+            func = item[1]
+            if isinstance(func, _Committed) and func.buffer is self and item[0] == level:
+                entries.append(func.entry)
+            else:
+                kept.append(item)
+        connection.run_on_commit = kept
+        self.size -= len(entries)
+        return entries
+
+    def flush(self):
+        entries, self.committed = self.committed, []
+        self.size = 0
+        self.write(entries)
+
+    def write(self, entries: List):
+        raise NotImplementedError
+
+
+def current_buffer(local: threading.local, using: str, factory: Callable[[str], CommitBuffer]) -> CommitBuffer:
+    """
+    The buffer of the current transaction of ``using`` kept in ``local`` (per thread, like
+    the connections), or a new one made by ``factory(using)``.
+    """
+    buffers = local.__dict__.setdefault('buffers', {})  # alias -> CommitBuffer
+    buffer = buffers.get(using)
+    if buffer is None or not buffer.is_pending():
+        buffer = buffers[using] = factory(using)
+    return buffer
@@ -0,0 +1,158 @@
+# coding: utf-8
+import json
+from datetime import timedelta
+from typing import Iterable, Optional, Tuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, Model, OuterRef, Q
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from django_fsm_ex.signals import outbox_dispatch
+
+__author__ = 'banxi'
+
+__all__ = ['drain_outbox']
+
+OUTBOX_ATTR_NAME = '_fsm_outbox'
+"""实例 __dict__ 中等待随 save() 写入发件箱的转移记录"""
+
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_RETRY_DELAY = 5  # 秒,每次失败后加倍
+MAX_RETRY_DELAY = 3600
+
+
+def record_transition(instance: Model, name: str, source, target):
+    """
+    Buffer an outbox entry on the instance, written by its next ``save()``.
+    The payload comes from ``instance.fsm_outbox_payload(name, source, target)`` when defined.
+    """
+    get_payload = getattr(instance, 'fsm_outbox_payload', None)
+    payload = get_payload(name, source, target) if get_payload is not None else None
+    instance.__dict__.setdefault(OUTBOX_ATTR_NAME, []).append((name, source, target, payload))
+
+
+def _entry(instance: Model, name, source, target, payload):
+    from django_fsm_ex.models import TransitionOutbox
+
+    return TransitionOutbox(
+        model=instance._meta.label,
+        object_pk=str(instance.pk),
+        name=name,
+        source='' if source is None else str(source),
+        target='' if target is None else str(target),
+        payload='' if payload is None else json.dumps(payload, cls=DjangoJSONEncoder))
+
+
+def write_outbox(instance: Model, using=None):
+    """
+    Write the entries buffered on ``instance``. Called from ``post_save``; wrap the save in
+    ``transaction.atomic()`` so that the state change and its entries commit together.
+    """
+    bulk_write_outbox([instance], using)
+
+
+def bulk_write_outbox(instances: Iterable[Model], using=None):
+    """Write the entries buffered on each of ``instances`` with one ``INSERT``."""
+    entries = [_entry(instance, *entry)
+               for instance in instances for entry in instance.__dict__.pop(OUTBOX_ATTR_NAME, ())]
+    if entries:
+        from django_fsm_ex.models import TransitionOutbox
+
+        TransitionOutbox.objects.using(using).bulk_create(entries)
+
+
+def _write_outbox_on_save(sender, instance, using, **kwargs):
+    if OUTBOX_ATTR_NAME in instance.__dict__:
+        write_outbox(instance, using)
+
+
+_connected = False
+
+
+def connect_outbox():
+    """Connect the ``post_save`` receiver once, when the first ``outbox=True`` field is declared."""
+    global _connected
+    if not _connected:
+        post_save.connect(_write_outbox_on_save, weak=False, dispatch_uid='django_fsm_ex.outbox')
+        _connected = True
+
+
+def drain_outbox(batch_size: int = 100, using=None) -> Tuple[int, int]:
+    """
+    发送一批发件箱记录
+
+    Dispatch up to ``batch_size`` outbox rows, oldest first, by sending ``outbox_dispatch``
+    (sender is the model class) and delete the rows whose receivers all returned without
+    raising: delivery is at least once, receivers must be idempotent.
+
+    A failed row keeps its place with ``attempts`` and ``last_error`` updated and is retried
+    after a delay doubling from ``FSM_OUTBOX_RETRY_DELAY`` seconds (5 by default, at most an
+    hour); the later rows of the same object are held back until it is delivered, so each
+    object's rows are delivered in order. Failed rows and the rows held back behind them
+    are not selected, so they never keep the rows of other objects from being dispatched.
+    After ``FSM_OUTBOX_MAX_ATTEMPTS`` (10 by default) attempts a row is no longer retried
+    and stays in the table, with its object's later rows, to be inspected.
+    Rows without receivers are failed as well. The batch is locked with
+    ``SELECT ... FOR UPDATE`` while it is dispatched so that concurrent drainers wait.
+
+    Returns ``(dispatched, failed)``.
+    """
+    from django_fsm_ex.models import TransitionOutbox
+
+    max_attempts = getattr(settings, 'FSM_OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    retry_delay = getattr(settings, 'FSM_OUTBOX_RETRY_DELAY', DEFAULT_RETRY_DELAY)
+    now = timezone.now()
+    outbox = TransitionOutbox.objects.using(using)
+    # 同一对象更早的记录发送失败过时,后面的记录要等它发送成功
+    held_back = outbox.filter(model=OuterRef('model'), object_pk=OuterRef('object_pk'),
+                              id__lt=OuterRef('id'), attempts__gt=0)
+    due = outbox.annotate(held_back=Exists(held_back)) \
+        .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=now), attempts__lt=max_attempts, held_back=False)
+
+    dispatched, failed = [], []
+    with transaction.atomic(using=using):
+        rows = list(due.select_for_update().order_by('id')[:batch_size])
+        blocked = set()
+        for row in rows:
+            key = (row.model, row.object_pk)
+            if key in blocked:
+                continue
+            # 接收者出错时回滚它在数据库中做的修改
+            sid = transaction.savepoint(using=using)
+            error = _dispatch(row)
+            if error is None:
+                transaction.savepoint_commit(sid, using=using)
+            else:
+                transaction.savepoint_rollback(sid, using=using)
+            if error is None:
+                dispatched.append(row.pk)
+            else:
+                blocked.add(key)
+                row.attempts += 1
+                row.last_error = error
+                row.retry_at = now + timedelta(seconds=min(retry_delay * 2 ** (row.attempts - 1), MAX_RETRY_DELAY))
+                row.save(update_fields=['attempts', 'last_error', 'retry_at'])
+                failed.append(row.pk)
+        if dispatched:
+            TransitionOutbox.objects.using(using).filter(pk__in=dispatched).delete()
+    return len(dispatched), len(failed)
+
+
+def _dispatch(row) -> Optional[str]:
+    try:
+        sender = apps.get_model(row.model)
+    except LookupError as e:
+        return str(e)
+    if not outbox_dispatch.has_listeners(sender):
+        return f'{row.model} 没有 outbox_dispatch 的接收者'
+    payload = json.loads(row.payload) if row.payload else None
+    for receiver, response in outbox_dispatch.send_robust(
+            sender=sender, entry=row, object_pk=row.object_pk, name=row.name,
+            source=row.source, target=row.target, payload=payload):
+        if isinstance(response, Exception):
+            return repr(response)
+    return None
@@ -0,0 +1,446 @@
+# coding: utf-8
+from functools import reduce
+from operator import or_
+from typing import Iterable, List, Optional, Sequence, Tuple, Type
+
+from django.db import connections, models, transaction
+from django.db.models import Case, Model, Q, Value, When
+from django.utils import timezone
+
+from django_fsm_ex.counters import counter_buffer, count_bulk_update, pop_saved_transitions
+from django_fsm_ex.fields import FSMFieldMixin, FSMMeta, FSMFieldType, Transition, get_fsm_meta, version_field, \
+    version_increment
+from django_fsm_ex.outbox import bulk_write_outbox
+from django_fsm_ex.registry import registry
+from django_fsm_ex.signals import pre_bulk_transition, post_bulk_transition
+
+__author__ = 'banxi'
+
+__all__ = ['FSMQuerySet', 'FSMManager', 'SourceGuard', 'compile_guards']
+
+BULK_CHUNK_SIZE = 1000
+"""转移之间互为源状态时,按主键分批更新的默认批大小"""
+
+
+class SourceGuard:
+    """
+    某个转移方法中,转移到同一目标状态的所有源状态
+
+    Source states of one transition method which lead to the same target,
+    expressed so that it can be compiled into a ``WHERE`` clause.
+    """
+    def __init__(self, target):
+        self.target = target
+        self.states = set()
+        # 不为 None 时表示通配源状态('*' 或 '+'): 除 exclude 之外的所有状态
+        self.exclude = None
+        self.transitions = []  # type: List[Transition]
+
+    def matches(self, state) -> bool:
+        if state in self.states:
+            return True
+        return self.exclude is not None and state not in self.exclude
+
+    def as_q(self, attname: str) -> Q:
+        return _sources_q(attname, self.transitions, self.exclude)
+
+
+def _sources_q(attname: str, transitions: Iterable[Transition], exclude=None) -> Q:
+    """
+    ``WHERE`` clause of the rows from which one of ``transitions`` is available: the concrete
+    source states, or every state but ``exclude`` for a wildcard source, each combined with
+    the ``sql_condition`` of its transition. ``Q()`` matches every row.
+    """
+    plain, parts = [], []
+    for transition in transitions:
+        if transition.source in ('*', '+'):
+            # 通配源状态,排除其他转移的具体源状态
+            q = ~Q(**{f'{attname}__in': list(exclude)}) if exclude else Q()
+        elif transition.sql_condition is None:
+            plain.append(transition.source)
+            continue
+        else:
+            q = Q(**{attname: transition.source})
+        if transition.sql_condition is not None:
+            q &= transition.sql_condition
+        if not q:
+            return Q()
+        parts.append(q)
+    if plain:
+        parts.insert(0, Q(**{f'{attname}__in': plain}))
+    if not parts:
+        return Q(pk__in=[])
+    return reduce(or_, parts)
+
+
+def available_q(meta: FSMMeta, attname: str) -> Q:
+    """
+    ``WHERE`` clause of the rows from which the transition method is available,
+    with the same precedence as ``FSMMeta.get_transition``. Conditions are only
+    evaluated through ``sql_condition``.
+    """
+    table = meta.state_to_transition
+    concrete = [state for state in table if state not in ('*', '+')]
+    transitions = [table[state] for state in concrete]
+    exclude = set(concrete)
+    wildcard = table['*'] if '*' in table else table.get('+')
+    if wildcard is not None:
+        transitions.append(wildcard)
+        if wildcard.source == '+' and not hasattr(wildcard.target, 'get_state'):
+            exclude.add(wildcard.target)
+    return _sources_q(attname, transitions, exclude)
+
+
+def compile_guards(meta: FSMMeta) -> List[SourceGuard]:
+    """
+    Group the ``state_to_transition`` table of a transition method by target,
+    following the same precedence as ``FSMMeta.get_transition``:
+    concrete sources first, then ``'*'``, then ``'+'``.
+
+    Transitions without target do not change the state and are left out.
+    """
+    table = meta.state_to_transition
+    concrete = [state for state in table if state not in ('*', '+')]
+    guards = {}
+
+    def guard_for(transition: Transition) -> SourceGuard:
+        if hasattr(transition.target, 'get_state'):
+            method_label = getattr(transition.method, 'label', transition.name)
+            raise ValueError(f'{method_label}的目标状态由返回值决定,不能在数据库中批量执行')
+        guard = guards.get(transition.target)
+        if guard is None:
+            guard = guards[transition.target] = SourceGuard(transition.target)
+        guard.transitions.append(transition)
+        return guard
+
+    for state in concrete:
+        transition = table[state]
+        if transition.target is not None:
+            guard_for(transition).states.add(state)
+
+    wildcard = table['*'] if '*' in table else table.get('+')
+    if wildcard is not None and wildcard.target is not None:
+        exclude = set(concrete)
+        if wildcard.source == '+':
+            exclude.add(wildcard.target)
+        guard_for(wildcard).exclude = exclude
+
+    return list(guards.values())
+
+
+def _order_guards(guards: List[SourceGuard]) -> Optional[List[SourceGuard]]:
+    """
+    Order guards so that no UPDATE moves rows into the sources of a later one.
+    Returns None when the targets form a cycle (e.g. ``a -> b`` and ``b -> a``).
+    """
+    pending = list(guards)
+    ordered = []
+    while pending:
+        ready = next((guard for guard in pending
+                      if not any(other is not guard and other.matches(guard.target) for other in pending)), None)
+        if ready is None:
+            return None
+        ordered.append(ready)
+        pending.remove(ready)
+    return ordered
+
+
+def resolve_transition(model: Type[Model], name: str) -> Tuple[FSMMeta, FSMFieldType]:
+    """
+    Returns ``(meta, field)`` of the transition method ``name`` declared on ``model``
+    """
+    meta = get_fsm_meta(getattr(model, name))
+    # 通过 mixin 声明的转移,meta.field 可能是字段名
+    field_name = meta.field if isinstance(meta.field, str) else meta.field.name
+    return meta, model._meta.get_field(field_name)
+
+
+def source_states_q(meta: FSMMeta, attname: str) -> Q:
+    """
+    ``WHERE`` clause of the rows which are in a source state of the transition method,
+    without looking at its targets (so it also works for ``RETURN_VALUE``/``GET_STATE``).
+    Wildcard sources match every row.
+    """
+    table = meta.state_to_transition
+    if '*' in table or '+' in table:
+        return Q()
+    return Q(**{f'{attname}__in': list(table)})
+
+
+def _check_bulk_conditions(guards: List[SourceGuard]):
+    for guard in guards:
+        for transition in guard.transitions:
+            if transition.conditions and transition.sql_condition is None:
+                method_label = getattr(transition.method, 'label', transition.name)
+                raise ValueError(f'{method_label}设置了转移条件,不能在数据库中批量执行')
+
+
+class _ChunkConflict(Exception):
+    pass
+
+
+def _send_bulk_update(queryset: models.QuerySet, name: str, field: FSMFieldType, target, entered_at=None) -> int:
+    model = queryset.model
+    pre_bulk_transition.send(sender=model, queryset=queryset, name=name, field=field, target=target)
+    updates = {field.attname: target}
+    if field.entered_at_field is not None:
+        updates[field.entered_at_field.attname] = entered_at or timezone.now()
+    version = version_field(model)
+    if version is not None:
+        updates[version.attname] = version_increment(version)
+    if field.count_states:
+        # 计数时锁定的行在 UPDATE 之前不会改变状态
+        with transaction.atomic(using=queryset.db):
+            counted = count_bulk_update(queryset, field, target)
+            count = queryset.update(**updates)
+            counted(count)
+    else:
+        count = queryset.update(**updates)
+    post_bulk_transition.send(sender=model, queryset=queryset, name=name, field=field, target=target, count=count)
+    return count
+
+
+class FSMQuerySet(models.QuerySet):
+
+    def with_available_transitions(self, field: Optional[str] = None) -> 'FSMQuerySet':
+        """
+        为每个转移方法添加 ``<name>_available`` 布尔注解
+
+        Annotate each row with one ``<name>_available`` boolean per transition method of
+        ``field`` (``name`` being the attribute name of the method) (of every FSM field by default), computed in SQL from the state column
+        and the ``sql_condition`` of the transitions. Python ``conditions`` without an
+        ``sql_condition`` and permissions are not taken into account.
+        """
+        opts = self.model._meta
+        if field is None:
+            fields = [f for f in opts.fields if isinstance(f, FSMFieldMixin)]
+        else:
+            fields = [opts.get_field(field)]
+
+        annotations = {}
+        for state_field in fields:
+            # 按注册表中的属性名,工厂生成的同名方法各有自己的注解
+            for name, method in registry.get_transitions(self.model, state_field).items():
+                q = available_q(get_fsm_meta(method), state_field.attname)
+                annotations[f'{name}_available'] = Value(True, output_field=models.BooleanField()) if not q else Case(
+                    When(q, then=Value(True)), default=Value(False), output_field=models.BooleanField())
+        return self.annotate(**annotations)
+
+    def can_transition(self, name: str) -> 'FSMQuerySet':
+        """
+        Filter the rows from which the ``name`` transition is available,
+        see ``with_available_transitions()``.
+        """
+        meta, field = resolve_transition(self.model, name)
+        return self.filter(available_q(meta, field.attname))
+
+    def bulk_transition(self, name: str, check_conditions=True, batch_size: Optional[int] = None) -> int:
+        """
+        在数据库中批量执行状态转移
+
+        Move every row of the queryset which is in a valid source state of the
+        ``name`` transition to the corresponding target, with one UPDATE per
+        distinct target (or per ``batch_size`` rows when given).
+
+        The transition method itself is not called and no per-row signals are sent;
+        ``pre_bulk_transition`` and ``post_bulk_transition`` are sent once per UPDATE.
+        Transitions with conditions are refused unless they declare an ``sql_condition``
+        or ``check_conditions`` is False.
+
+        Returns the number of updated rows.
+        """
+        meta, field = resolve_transition(self.model, name)
+        guards = compile_guards(meta)
+        if check_conditions:
+            _check_bulk_conditions(guards)
+
+        ordered = _order_guards(guards)
+        if ordered is None and batch_size is None:
+            batch_size = BULK_CHUNK_SIZE
+
+        count = 0
+        with transaction.atomic(using=self.db, savepoint=False):
+            if batch_size is None:
+                for guard in ordered:
+                    count += _send_bulk_update(self.filter(guard.as_q(field.attname)), name, field, guard.target)
+                return count
+
+            # 先固定每个目标要更新的行,避免前一条 UPDATE 的结果被后一条再次转移
+            plan = [(guard, list(self.filter(guard.as_q(field.attname)).values_list('pk', flat=True)))
+                    for guard in (ordered or guards)]
+            for guard, pks in plan:
+                guard_q = guard.as_q(field.attname)
+                for start in range(0, len(pks), batch_size):
+                    queryset = self.filter(guard_q, pk__in=pks[start:start + batch_size])
+                    count += _send_bulk_update(queryset, name, field, guard.target)
+        return count
+
+    def claim(self, name: str, limit: int, check_conditions=True, skip_locked=True) -> List[Model]:
+        """
+        领取一批处于源状态的行并执行转移
+
+        Use the table as a work queue: select up to ``limit`` rows of the queryset which are
+        in a valid source state of the ``name`` transition, lock them with
+        ``SELECT ... FOR UPDATE SKIP LOCKED`` so that concurrent workers claim disjoint rows,
+        move them to the target state with one UPDATE per distinct target and return
+        the claimed instances, already in their new state::
+
+            for job in Job.objects.order_by('created').claim('start_processing', limit=100):
+                ...
+
+        Backends without ``SELECT ... FOR UPDATE`` (e.g. SQLite) do not lock the rows.
+        """
+        meta, field = resolve_transition(self.model, name)
+        guards = compile_guards(meta)
+        if check_conditions:
+            _check_bulk_conditions(guards)
+        if not guards:
+            return []
+
+        source_q = Q()
+        for guard in guards:
+            # 通配且没有排除状态时,所有行都是源状态
+            guard_q = guard.as_q(field.attname)
+            if not guard_q:
+                source_q = Q()
+                break
+            source_q |= guard_q
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            instances = list(self.filter(source_q).select_for_update(skip_locked=skip_locked)[:limit])
+            claimed = {}
+            for instance in instances:
+                state = instance.__dict__[field.attname]
+                guard = next(guard for guard in guards if guard.matches(state))
+                claimed.setdefault(guard.target, []).append(instance)
+
+            base_qs = self.model._base_manager.using(self.db)
+            now = timezone.now()
+            version = version_field(self.model)
+            for target, group in claimed.items():
+                pks = [instance.pk for instance in group]
+                for start in range(0, len(pks), BULK_CHUNK_SIZE):
+                    _send_bulk_update(base_qs.filter(pk__in=pks[start:start + BULK_CHUNK_SIZE]), name, field, target,
+                                      entered_at=now)
+                for instance in group:
+                    instance.__dict__[field.attname] = target
+                    field.set_proxy(instance, target)
+                    field.touch_entered_at(instance, now)
+                    if version is not None:
+                        # 行已经锁定,数据库中的版本号就是加载的版本号加一
+                        instance.__dict__[version.attname] = (instance.__dict__[version.attname] or 0) + 1
+                    # ConcurrentTransitionMixin 需要以新状态作为后续 save 的条件
+                    update_initial_state = getattr(instance, '_update_initial_state', None)
+                    if update_initial_state is not None:
+                        update_initial_state()
+        return instances
+
+    def bulk_save_transitions(self, instances: Iterable[Model], fields: Optional[Sequence[str]] = None,
+                              batch_size: Optional[int] = None) -> List[Model]:
+        """
+        批量保存执行过状态转移的实例
+
+        Write the FSM columns (and the other ``fields`` given by name) of many instances
+        with one ``UPDATE ... SET col = CASE pk WHEN ... END WHERE (pk = .. AND state = ..) OR ...``
+        statement per chunk, instead of one ``save()`` per instance.
+
+        Each row is guarded like ``ConcurrentTransitionMixin.save()`` does: by the state
+        (or version) loaded from the database. Instances whose row no longer matches are
+        not written and are returned, so that only those need to be refreshed and retried;
+        the others have their initial state (and version) updated.
+        When a chunk updates fewer rows than it holds, it is rolled back to its savepoint
+        and written again after locking the rows which still match.
+
+        Like ``bulk_update()``, no ``save`` signals are sent, but the outbox entries of the
+        written instances are (in the same transaction). Only the columns of the queryset
+        model's own table can be written.
+        """
+        instances = list(instances)
+        if not instances:
+            return []
+        opts = self.model._meta
+        local_fields = set(opts.concrete_model._meta.local_concrete_fields)
+        if fields is None:
+            fields = [field for field in opts.concrete_fields if isinstance(field, FSMFieldMixin)]
+        else:
+            fields = [opts.get_field(name) for name in fields]
+        # 和状态一起写入进入状态的时间
+        fields += [field.entered_at_field for field in fields
+                   if getattr(field, 'entered_at_field', None) is not None and field.entered_at_field not in fields]
+        version = getattr(self.model, 'version_field', None)
+        if version is not None:
+            version = opts.get_field(version)
+            fields = [field for field in fields if field != version] + [version]
+        for field in fields:
+            if field not in local_fields or field.primary_key:
+                raise ValueError(f'{field.name}不是{opts.object_name}表中可以批量更新的字段')
+        if any(instance.pk is None or instance._state.adding for instance in instances):
+            raise ValueError('批量保存的实例必须已经存在于数据库中')
+        if version is not None:
+            for instance in instances:
+                instance._loaded_version()
+
+        connection = connections[self.db]
+        # 每行的参数: CASE 中每个字段的 pk 和值,以及 WHERE 中的 pk 和状态
+        params_per_row = 2 * len(fields) + 1 + len(fields)
+        max_batch_size = connection.ops.bulk_batch_size([None] * params_per_row, instances)
+        batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+
+        conflicted = []
+        with transaction.atomic(using=self.db, savepoint=False):
+            for start in range(0, len(instances), batch_size):
+                conflicted.extend(self._bulk_save_chunk(instances[start:start + batch_size], fields, version))
+        return conflicted
+
+    def _bulk_save_chunk(self, chunk: List[Model], fields, version) -> List[Model]:
+        concrete_model = self.model._meta.concrete_model
+        rows = []
+        for instance in chunk:
+            values = {field.attname: getattr(instance, field.attname) for field in fields}
+            if version is not None:
+                values[version.attname] = (values[version.attname] or 0) + 1
+            get_state_filter = getattr(instance, '_get_state_filter', None)
+            state_filter = get_state_filter(concrete_model) if get_state_filter is not None else {}
+            rows.append((instance, values, Q(pk=instance.pk, **state_filter)))
+
+        try:
+            # 在保存点中更新,有冲突时回滚后只更新没有冲突的行
+            with transaction.atomic(using=self.db):
+                if self._bulk_update_rows(rows, fields) != len(rows):
+                    raise _ChunkConflict
+        except _ChunkConflict:
+            matched = set(self.model._base_manager.using(self.db).select_for_update()
+                          .filter(reduce(or_, (guard for instance, values, guard in rows)))
+                          .values_list('pk', flat=True))
+            rows = [row for row in rows if row[0].pk in matched]
+            if rows:
+                self._bulk_update_rows(rows, fields)
+
+        saved = set()
+        counted_fields = [field for field in fields if getattr(field, 'count_states', False)]
+        deltas = {}
+        for instance, values, guard in rows:
+            saved.add(id(instance))
+            if counted_fields:
+                pop_saved_transitions(instance, counted_fields, deltas)
+            if version is not None:
+                setattr(instance, version.attname, values[version.attname])
+            update_initial_state = getattr(instance, '_update_initial_state', None)
+            if update_initial_state is not None:
+                update_initial_state()
+        counter_buffer.add(deltas)
+        # 和 save() 一样写入转移前记录在实例上的发件箱记录,与状态在同一个事务中提交
+        bulk_write_outbox((instance for instance, values, guard in rows), self.db)
+        return [instance for instance in chunk if id(instance) not in saved]
+
+    def _bulk_update_rows(self, rows, fields) -> int:
+        updates = {
+            field.attname: Case(*(When(pk=instance.pk, then=Value(values[field.attname], output_field=field))
+                                  for instance, values, guard in rows), output_field=field)
+            for field in fields
+        }
+        queryset = self.model._base_manager.using(self.db).filter(reduce(or_, (guard for *_, guard in rows)))
+        return queryset.update(**updates)
+
+class FSMManager(models.Manager.from_queryset(FSMQuerySet)):
+    pass
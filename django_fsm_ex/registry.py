@@ -0,0 +1,111 @@
+# coding: utf-8
+import inspect
+from typing import Dict, Iterable, Optional, Type, TYPE_CHECKING
+
+from django.db.models import Model
+
+if TYPE_CHECKING:
+    from django_fsm_ex.fields import FSMFieldType, TransitionIndex
+
+__author__ = 'banxi'
+
+__all__ = ['TransitionRegistry', 'warmup']
+
+
+class TransitionRegistry:
+    """
+    状态转移方法的中心注册表
+
+    Collects the transition methods of a (model class, field) pair lazily, on first
+    use, instead of scanning every prepared model from a ``class_prepared`` receiver.
+
+    A subclass which neither adds nor overrides transitions of a field shares the
+    table of its parent; the table is only copied when the subclass changes it.
+    """
+
+    def __init__(self):
+        self._tables = {}  # (cls, field name) -> {name: method}
+        self._indexes = {}  # (cls, field name) -> TransitionIndex
+
+    def get_transitions(self, cls: Type[Model], field: 'FSMFieldType') -> Dict[str, object]:
+        key = (cls, field.name)
+        table = self._tables.get(key)
+        if table is None:
+            if not issubclass(cls, field.base_cls):
+                raise KeyError(cls)
+            table = self._tables[key] = self._collect(cls, field)
+        return table
+
+    def get_index(self, cls: Type[Model], field: 'FSMFieldType') -> 'TransitionIndex':
+        index = self._indexes.get((cls, field.name))
+        if index is None:
+            from django_fsm_ex.fields import TransitionIndex
+            index = TransitionIndex(field, self.get_transitions(cls, field),
+                                    save_transitions=getattr(cls, 'fsm_save_transitions', False))
+            self._indexes[(cls, field.name)] = index
+        return index
+
+    def warmup(self, models: Optional[Iterable[Type[Model]]] = None):
+        """
+        Collect transitions, compile indexes and resolve ``state_choices`` proxies ahead of time,
+        e.g. from ``AppConfig.ready()``, so that the first request does not pay for it.
+        Defaults to every installed model.
+        """
+        from django.apps import apps
+        from django_fsm_ex.fields import FSMFieldMixin
+
+        if models is None:
+            models = apps.get_models()
+        for model in models:
+            for field in model._meta.fields:
+                if isinstance(field, FSMFieldMixin):
+                    self.get_index(model, field)
+                    field.resolve_state_proxies()
+
+    def _collect(self, cls: Type[Model], field: 'FSMFieldType') -> Dict[str, object]:
+        from django_fsm_ex.fields import FSM_META_ATTR_NAME
+
+        def is_field_transition_method(attr):
+            if inspect.ismethod(attr) or inspect.isfunction(attr):
+                fsm_meta = getattr(attr, FSM_META_ATTR_NAME, None)
+                if fsm_meta is not None and fsm_meta.field in (field, field.name):
+                    fsm_meta.field = field
+                    return True
+            return False
+
+        # 只需要检查父类之外新引入的类(子类本身以及新混入的 mixin)
+        parent = next((base for base in cls.__mro__[1:] if issubclass(base, field.base_cls)), None)
+        if parent is None:
+            parent_table, known = {}, ()
+        else:
+            parent_table, known = self.get_transitions(parent, field), parent.__mro__
+
+        names = set()
+        for klass in cls.__mro__:
+            if klass not in known:
+                names.update(name for name, attr in vars(klass).items()
+                             if name in parent_table or is_field_transition_method(attr))
+
+        table = parent_table
+        for name in sorted(names):
+            attr = getattr(cls, name, None)
+            if not is_field_transition_method(attr):
+                attr = None
+            if parent_table.get(name) is attr:
+                continue
+            if table is parent_table:
+                table = dict(parent_table)
+            if attr is None:
+                del table[name]
+            else:
+                table[name] = attr
+
+        # 和 inspect.getmembers 一样按名称排序
+        return table if table is parent_table else dict(sorted(table.items()))
+
+
+registry = TransitionRegistry()
+
+
+def warmup(models: Optional[Iterable[Type[Model]]] = None):
+    registry.warmup(models)
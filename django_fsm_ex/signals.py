@@ -5,10 +5,64 @@ __all__ = [
   'pre_transition',
   'post_transition',
   'transition_not_allowed',
-  'no_transition'
+  'no_transition',
+  'pre_bulk_transition',
+  'post_bulk_transition',
+  'post_transition_committed',
+  'outbox_dispatch',
 ]
 
-pre_transition = Signal(providing_args=['instance', 'name','field', 'source', 'target'])
-post_transition = Signal(providing_args=['instance', 'name','field', 'source', 'target', 'exception'])
-transition_not_allowed = Signal(providing_args=['instance', 'name','field', 'source', 'target'])
-no_transition = Signal(providing_args=['instance', 'name','field', 'source'])
+
+class _TransitionSignal(Signal):
+    """
+    按 sender 缓存是否有接收者的信号
+
+    ``has_listeners(sender)`` is answered from a dict after the first call for a sender,
+    so that a transition without receivers costs one lookup. The cache is cleared
+    whenever a receiver is connected, disconnected or garbage collected.
+    Unlike ``Signal(use_caching=True)``, whose cache is keyed by weak references,
+    ``send(sender=None)`` and other senders which cannot be weakly referenced still work.
+    """
+
+    def __init__(self, providing_args=None):
+        super().__init__(providing_args=providing_args)
+        self._listening = {}  # sender -> bool
+
+    def connect(self, *args, **kwargs):
+        super().connect(*args, **kwargs)
+        self._listening.clear()
+
+    def disconnect(self, *args, **kwargs):
+        disconnected = super().disconnect(*args, **kwargs)
+        self._listening.clear()
+        return disconnected
+
+    def _remove_receiver(self, receiver=None):
+        super()._remove_receiver(receiver)
+        self._listening.clear()
+
+    def has_listeners(self, sender=None):
+        try:
+            return self._listening[sender]
+        except KeyError:
+            listening = self._listening[sender] = super().has_listeners(sender)
+            return listening
+        except TypeError:
+            # 不可哈希的 sender
+            return super().has_listeners(sender)
+
+
+pre_transition = _TransitionSignal(providing_args=['instance', 'name','field', 'source', 'target'])
+post_transition = _TransitionSignal(providing_args=['instance', 'name','field', 'source', 'target', 'exception'])
+transition_not_allowed = _TransitionSignal(providing_args=['instance', 'name','field', 'source', 'target'])
+no_transition = _TransitionSignal(providing_args=['instance', 'name','field', 'source'])
+
+# 批量状态转移时,每条 UPDATE 语句发送一次
+pre_bulk_transition = _TransitionSignal(providing_args=['queryset', 'name', 'field', 'target'])
+post_bulk_transition = _TransitionSignal(providing_args=['queryset', 'name', 'field', 'target', 'count'])
+
+# 与 post_transition 参数相同,在事务提交后发送;事务回滚时丢弃
+post_transition_committed = _TransitionSignal(providing_args=['instance', 'name','field', 'source', 'target', 'exception'])
+
+# fsm_outbox_drain 发送发件箱记录,sender 是模型类
+outbox_dispatch = _TransitionSignal(providing_args=['entry', 'object_pk', 'name', 'source', 'target', 'payload'])
@@ -0,0 +1,154 @@
+# coding: utf-8
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Type
+
+from django.db import DatabaseError, transaction
+from django.db.models import Model, Q
+from django.utils import timezone
+
+from django_fsm_ex.fields import FSMFieldMixin, FSMFieldType, FSMMeta, get_fsm_meta
+from django_fsm_ex.queryset import available_q
+from django_fsm_ex.registry import registry
+from django_fsm_ex.transition import can_proceed
+
+__author__ = 'banxi'
+
+__all__ = ['SweepBatch', 'scheduled_transitions', 'sweep']
+
+SWEEP_BATCH_SIZE = 500
+
+
+class SweepBatch(NamedTuple):
+    """``sweep()`` 处理的一批行的结果"""
+    name: str
+    done: int
+    skipped: int
+    failed: int
+    errors: List[str]
+    elapsed: float  # 秒,包括查询
+
+
+def scheduled_transitions(model: Type[Model]) -> List[Tuple[str, FSMMeta, FSMFieldType]]:
+    """
+    Returns ``(name, meta, field)`` of the transition methods of ``model`` declared with
+    ``after`` or ``auto``, the longest delay first and ``auto`` transitions without delay
+    last: when several are due from the same state, the one with the longest delay wins.
+    """
+    scheduled, seen = [], set()
+    # 按注册表中的属性名,工厂生成的同名方法各自执行;别名只执行一次
+    for field in model._meta.fields:
+        if not isinstance(field, FSMFieldMixin):
+            continue
+        for name, method in registry.get_transitions(model, field).items():
+            meta = get_fsm_meta(method)
+            if (meta.after is None and not meta.auto) or meta in seen:
+                continue
+            seen.add(meta)
+            if meta.after is not None and field.entered_at_field is None:
+                raise ValueError(f'{model._meta.label}.{field.name} 没有设置 track_entered_at,不能执行 {name} 的定时转移')
+            scheduled.append((name, meta, field))
+    return sorted(scheduled, key=lambda item: item[1].after or timedelta(0), reverse=True)
+
+
+def sweep(model: Type[Model], names: Optional[Iterable[str]] = None, batch: int = SWEEP_BATCH_SIZE,
+          now: Optional[datetime] = None, using: Optional[str] = None) -> Iterator[SweepBatch]:
+    """
+    执行到期的定时转移和条件满足的自动转移
+
+    For each transition of ``model`` declared with ``after`` (or only ``names``), find the
+    rows in one of its source states which entered it before ``now - after`` with
+    ``WHERE state IN (...) AND state_entered_at <= cutoff ORDER BY state_entered_at, pk``,
+    served by the ``(state, state_entered_at)`` index, ``batch`` rows at a time and
+    continuing after the last row seen (keyset pagination, no ``OFFSET``).
+
+    Transitions declared with ``auto`` (and no ``after``) are looked for the same way with
+    ``WHERE state IN (...) AND <sql_condition> ORDER BY pk``: only the rows in a source
+    state, and whose ``sql_condition`` holds, are loaded; their Python ``conditions`` are
+    then checked on each row.
+
+    Each batch runs in one transaction with its rows locked (``SKIP LOCKED``, rows locked
+    by another sweeper are left to it). The transition goes through the normal
+    ``change_state`` path, then the row is saved, each row on its own savepoint:
+    rows whose conditions are not met are skipped, rows whose transition raises are
+    rolled back and counted as failed. A database error aborts the sweep.
+
+    Yields a ``SweepBatch`` per batch.
+    """
+    now = now or timezone.now()
+    scheduled = scheduled_transitions(model)
+    if names is not None:
+        names = set(names)
+        scheduled = [item for item in scheduled if item[0] in names]
+    manager = model._default_manager.db_manager(using)
+    for name, meta, field in scheduled:
+        due = manager.filter(available_q(meta, field.attname))
+        if meta.after is not None:
+            entered_at = field.entered_at_field.attname
+            due = due.filter(**{f'{entered_at}__lte': now - meta.after}).order_by(entered_at, 'pk')
+        else:
+            entered_at = None
+            due = due.order_by('pk')
+        cursor = None
+        while True:
+            rows = due
+            if cursor is not None:
+                at, pk = cursor
+                if entered_at is None:
+                    rows = rows.filter(pk__gt=pk)
+                else:
+                    rows = rows.filter(Q(**{f'{entered_at}__gt': at}) | Q(**{entered_at: at, 'pk__gt': pk}))
+            start = time.perf_counter()
+            with transaction.atomic(using=manager.db):
+                instances = list(rows.select_for_update(skip_locked=True)[:batch])
+                if not instances:
+                    break
+                last = instances[-1]
+                cursor = (last.__dict__[entered_at] if entered_at else None, last.pk)
+                result = _run_batch(name, meta, instances, manager.db)
+            yield result._replace(elapsed=time.perf_counter() - start)
+            if len(instances) < batch:
+                break
+
+
+def _run_batch(name: str, meta: FSMMeta, instances: List[Model], using: str) -> SweepBatch:
+    errors = []
+    done, failed = run_transitions(name, meta, instances, using, errors)
+    return SweepBatch(name, done, len(instances) - done - failed, failed, errors, 0.0)
+
+
+def run_transitions(name: str, meta: FSMMeta, instances: Iterable[Model], using: str, errors: List[str],
+                    latencies: Optional[List[float]] = None) -> Tuple[int, int]:
+    """
+    Run the ``name`` transition on each of ``instances`` (loaded and locked by the caller,
+    inside its transaction) and save it, each instance on its own savepoint. Instances
+    which cannot proceed are skipped; those whose transition or save raises are rolled
+    back, counted as failed and described in ``errors``. A ``DatabaseError`` is raised,
+    aborting the caller's transaction. Transitions which write to the database
+    themselves (``sql_update``, ``save=True``) are not saved again. The seconds taken
+    by each instance done are appended to ``latencies`` when given.
+
+    Returns ``(done, failed)``; shared by ``sweep()`` and ``manage.py fsm_worker``.
+    """
+    done = failed = 0
+    for instance in instances:
+        method = getattr(instance, name)
+        if not can_proceed(method):
+            continue
+        start = time.perf_counter()
+        try:
+            with transaction.atomic(using=using):
+                method()
+                # sql_update 和 save=True 的转移已经写入数据库
+                if not (meta.sql_update or meta.save or getattr(instance, 'fsm_save_transitions', False)):
+                    instance.save()
+        except DatabaseError:
+            raise
+        except Exception as e:
+            failed += 1
+            errors.append(f'{instance.pk}: {e!r}')
+        else:
+            done += 1
+            if latencies is not None:
+                latencies.append(time.perf_counter() - start)
+    return done, failed
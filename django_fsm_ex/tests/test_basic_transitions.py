@@ -199,6 +199,19 @@ def test_all_conditions(model):
                 ('published', 'hidden'), ('published', 'stolen'), ('hidden', 'stolen'), ('*', ''), ('+', 'blocked')}
     assert (actual == expected)
 
+def test_available_conditions_from_unknown_state():
+    model = BlogPost(state='unknown')
+    transitions = model.get_available_state_transitions()
+    actual = set((transition.source, transition.target) for transition in transitions)
+    expected = {('*', 'moderated'), ('*', ''), ('+', 'blocked')}
+    assert (actual == expected)
+
+def test_transition_index_is_compiled_once():
+    field = BlogPost._meta.get_field('state')
+    index = field.get_transition_index(BlogPost)
+    assert index is field.get_transition_index(BlogPost)
+    assert list(index.lookup('hidden')) == ['block', 'empty', 'moderate', 'steal']
+
 def test_duplicate_source_error():
     with pytest.raises(AssertionError):
         class BlogPostDuplicateSource(models.Model):
@@ -209,3 +222,21 @@ def test_duplicate_source_error():
             def publish(self):
                 pass
         assert BlogPostDuplicateSource
+
+def test_signal_listeners_cache(model):
+    calls = []
+
+    def receiver(sender, **kwargs):
+        calls.append(sender)
+
+    assert not pre_transition.has_listeners(BlogPost)
+    pre_transition.connect(receiver, sender=BlogPost)
+    try:
+        assert pre_transition.has_listeners(BlogPost)
+        model.publish()
+        # 没有缓存 sender 的弱引用,sender=None 也可以发送
+        pre_transition.send(sender=None, instance=model, name='publish', field=None, source='new', target='published')
+    finally:
+        pre_transition.disconnect(receiver, sender=BlogPost)
+    assert calls == [BlogPost]
+    assert not pre_transition.has_listeners(BlogPost)
@@ -1,13 +1,18 @@
 # coding: utf-8
 import abc
+from contextlib import contextmanager
 
-from django_fsm_ex.errors import InvalidResultState, ConcurrentTransition
+from django.db import router, transaction
+from django.db.models import DEFERRED
+
+from django_fsm_ex.errors import InvalidResultState, ConcurrentTransition, TransitionNotAllowed
 from django_fsm_ex.fields import get_fsm_meta,FSMFieldMixin
 from django_fsm_ex.types import OptList, OptDict
 
 __author__ = 'banxi'
 
 __all__ = [
+    'FSMModelMixin',
     'ConcurrentTransitionMixin',
     'can_proceed',
     'has_transition_perm',
@@ -16,7 +21,57 @@ __all__ = [
 ]
 
 
-class ConcurrentTransitionMixin:
+class FSMModelMixin:
+    """
+    从数据库加载时直接写入状态字段
+
+    Rows fetched from the database put their state values straight into the instance
+    instead of going through ``FSMFieldDescriptor`` (protected check, proxy lookup) for
+    every row, and are switched to their ``state_choices`` proxy class with one cached
+    lookup. Rows loaded with deferred fields take the default Django path.
+    """
+
+    @classmethod
+    def _get_state_field_positions(cls):
+        """
+        Returns ``((index, field), ...)`` of the state fields among the concrete fields, computed once per class
+        """
+        positions = cls.__dict__.get('_fsm_state_field_positions')
+        if positions is None:
+            positions = tuple((index, field) for index, field in enumerate(cls._meta.concrete_fields)
+                              if isinstance(field, FSMFieldMixin))
+            cls._fsm_state_field_positions = positions
+            # 从第一个字段到最后一个状态字段的 attname, 用于按 Model.__init__ 的顺序写入实例 __dict__
+            cls._fsm_hydration_attnames = tuple(
+                field.attname for field in cls._meta.concrete_fields[:positions[-1][0] + 1]) if positions else ()
+        return positions
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        positions = cls._get_state_field_positions()
+        if not positions or len(values) != len(cls._meta.concrete_fields):
+            return super().from_db(db, field_names, values)
+
+        new = cls.__new__(cls)
+        # 保持和 Model.__init__ 相同的属性写入顺序,实例 __dict__ 才能继续共享 key
+        new.__dict__['_state'] = None
+        new.__dict__.update(zip(cls._fsm_hydration_attnames, values))
+        values = list(values)
+        proxy = None
+        for index, field in positions:
+            # Model.__init__ 会跳过 DEFERRED 的字段,因此状态字段不会再经过 descriptor
+            values[index] = DEFERRED
+            if field.state_proxy:
+                proxy = field.get_state_proxy(new.__dict__[field.attname]) or proxy
+        new.__init__(*values)
+        new._state.adding = False
+        new._state.db = db
+        if proxy is not None:
+            new.__class__ = proxy
+        return new
+
+
+class ConcurrentTransitionMixin(FSMModelMixin):
     """
     Protects a Model from undesirable effects caused by concurrently executed transitions,
     e.g. running the same transition multiple times at the same time, or running different
@@ -40,30 +95,38 @@ class ConcurrentTransitionMixin:
     Following these recommendations, you can rely on ConcurrentTransitionMixin to cause
     a rollback of all the changes that have been executed in an inconsistent (out of sync)
     state, thus practically negating their effect.
+
+    When the guarded UPDATE matches no row, an extra ``exists()`` query tells a conflict
+    apart from a new instance with preset PK. Set ``check_conflict_exists = False`` to
+    raise *ConcurrentTransition* right away for instances known to be in the database
+    (loaded or saved before, i.e. ``_state.adding`` is False); a row deleted in the
+    meantime is then reported as a conflict too. New instances keep the default behaviour.
+
+    Set ``version_field`` to the name of an integer field to switch to true optimistic
+    locking: the version is bumped on every save and the UPDATE is guarded by the primary
+    key and the version loaded from the database only, so an ``A -> B -> A`` sequence run
+    by another worker is detected as well and the state columns stay out of the WHERE clause.
+    The version must be loaded with the row: saving an instance loaded without it (with
+    ``only()`` or ``defer()``) raises *ValueError* instead of writing without the guard.
     """
+    check_conflict_exists = True
+    version_field = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._update_initial_state()
 
     @property
     def state_fields(self):
-        return filter(
-            lambda field: isinstance(field, FSMFieldMixin),
-            self._meta.fields
-        )
+        return (field for index, field in self._get_state_field_positions())
 
     def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
         # _do_update is called once for each model class in the inheritance hierarchy.
         # We can only filter the base_qs on state fields (can be more than one!) present in this particular model.
 
-        # Select state fields to filter on
-        filter_on = filter(lambda field: field.model == base_qs.model, self.state_fields)
-
         # state filter will be used to narrow down the standard filter checking only PK
-        state_filter = dict((field.attname, self.__initial_states[field.attname]) for field in filter_on)
-
         updated = super()._do_update(
-            base_qs=base_qs.filter(**state_filter),
+            base_qs=base_qs.filter(**self._get_state_filter(base_qs.model)),
             using=using,
             pk_val=pk_val,
             values=values,
@@ -77,21 +140,126 @@ class ConcurrentTransitionMixin:
         # INSERT if UPDATE fails.
         # Thus, we need to make sure we only catch the case when the object *is* in the DB, but with changed state; and
         # mimic standard _do_update behavior otherwise. Django will pick it up and execute _do_insert.
-        if not updated and base_qs.filter(pk=pk_val).exists():
+        # With check_conflict_exists disabled, an instance known to be persisted skips the extra query.
+        if not updated and ((not self.check_conflict_exists and not self._state.adding)
+                            or base_qs.filter(pk=pk_val).exists()):
             raise ConcurrentTransition("Cannot save object! The state has been changed since fetched from the database!")
 
         return updated
 
+    def _get_state_filter(self, model) -> dict:
+        """
+        The guard of an UPDATE of the table of ``model``: the version, or the state
+        columns of that table, as loaded from the database.
+        """
+        state_filter = {}
+        if self.version_field is not None:
+            version = self._meta.get_field(self.version_field)
+            if version.model == model:
+                state_filter[version.attname] = self._loaded_version()
+        else:
+            for (index, field), initial_state in zip(self._get_state_field_positions(), self._fsm_initial_states):
+                # 延迟加载(deferred)的状态字段没有初始值,无法作为条件
+                if field.model == model and initial_state is not DEFERRED:
+                    state_filter[field.attname] = initial_state
+        return state_filter
+
+    def _loaded_version(self):
+        # 延迟加载的版本号只能读到当前值,不能用来检查冲突
+        if self._fsm_initial_version is DEFERRED:
+            raise ValueError(f'{self._meta.object_name}.{self.version_field} 是延迟加载的字段,'
+                             f'无法检查并发修改,查询时需要加载它')
+        return self._fsm_initial_version
+
     def _update_initial_state(self):
-        self.__initial_states = dict(
-            (field.attname, field.value_from_object(self)) for field in self.state_fields
+        # 按 _get_state_field_positions() 的顺序保存初始状态
+        values = self.__dict__
+        self._fsm_initial_states = tuple(
+            values.get(field.attname, DEFERRED) for index, field in self._get_state_field_positions()
         )
+        if self.version_field is not None:
+            self._fsm_initial_version = values.get(self._meta.get_field(self.version_field).attname, DEFERRED)
+
+    def _set_initial_state(self, field, state):
+        positions = [f for index, f in self._get_state_field_positions()]
+        initial_states = list(self._fsm_initial_states)
+        initial_states[positions.index(field)] = state
+        self._fsm_initial_states = tuple(initial_states)
+
+    @contextmanager
+    def locked_transition(self, *methods, nowait=False, skip_locked=False, using=None):
+        """
+        悲观锁: 在锁定的行上执行状态转移
+
+        Opens a transaction, re-reads only the state (and version) columns of the row with
+        ``SELECT ... FOR UPDATE`` and loads them into the instance, then checks that every
+        bound transition method in ``methods`` can proceed from the locked state::
+
+            with instance.locked_transition(instance.approve):
+                instance.approve()
+                instance.save()
+
+        Raises *TransitionNotAllowed* when a method cannot proceed, and *ConcurrentTransition*
+        when ``skip_locked`` is set and the row is locked by another transaction.
+        """
+        using = using or router.db_for_write(self.__class__, instance=self)
+        fields = [field for index, field in self._get_state_field_positions()]
+        attnames = [field.attname for field in fields]
+        if self.version_field is not None:
+            attnames.append(self._meta.get_field(self.version_field).attname)
+
+        with transaction.atomic(using=using):
+            rows = list(self.__class__._base_manager.using(using)
+                        .select_for_update(nowait=nowait, skip_locked=skip_locked)
+                        .filter(pk=self.pk).values_list(*attnames))
+            if not rows:
+                if skip_locked:
+                    raise ConcurrentTransition('Cannot lock object! It is locked by another transaction.')
+                raise self.DoesNotExist(f'{self._meta.object_name} matching query does not exist.')
+
+            for attname, value in zip(attnames, rows[0]):
+                self.__dict__[attname] = value
+            for field in fields:
+                field.set_proxy(self, field.get_state(self))
+            self._update_initial_state()
+
+            for method in methods:
+                if not can_proceed(method):
+                    method_label = getattr(method, 'label', method.__name__)
+                    raise TransitionNotAllowed(f'锁定后的状态不能进行{method_label}操作',
+                                               object=self, method=method,
+                                               current_state=get_fsm_meta(method).field.get_state(self))
+            yield self
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        if self.version_field is None:
+            super().save(*args, **kwargs)
+        else:
+            version = self._meta.get_field(self.version_field)
+            self._loaded_version()
+            previous = getattr(self, version.attname)
+            setattr(self, version.attname, (previous or 0) + 1)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {version.name}
+            try:
+                super().save(*args, **kwargs)
+            except Exception:
+                setattr(self, version.attname, previous)
+                raise
         self._update_initial_state()
 
 
+def _bound_transition(bound_method):
+    # 按注册表中的属性名查找,别名和工厂生成的同名方法各自对应自己的转移
+    meta = get_fsm_meta(bound_method)
+    instance = getattr(bound_method, '__self__')
+    field = meta.resolve_field(instance.__class__)
+    index = field.get_transition_index(instance.__class__)
+    func = getattr(bound_method, '__func__', None)
+    name = index.names.get(func, bound_method.__name__)
+    return instance, index.lookup(field.get_state(instance)).get(name)
+
+
 def can_proceed(bound_method, check_conditions=True):
     """
     Returns True if model in state allows to call bound_method
@@ -99,12 +267,8 @@ def can_proceed(bound_method, check_conditions=True):
     Set ``check_conditions`` argument to ``False`` to skip checking
     conditions.
     """
-    meta = get_fsm_meta(bound_method)
-    instance = getattr(bound_method, '__self__')
-    current_state = meta.field.get_state(instance)
-
-    return meta.has_transition(current_state) and (
-    not check_conditions or meta.conditions_met(instance, current_state))
+    instance, transition = _bound_transition(bound_method)
+    return transition is not None and (not check_conditions or transition.conditions_met(instance))
 
 
 def has_transition_perm(bound_method, user):
@@ -113,13 +277,10 @@ def has_transition_perm(bound_method, user):
 
     Returns True if model in state allows to call bound_method and user have rights on it
     """
-    meta = get_fsm_meta(bound_method)
-    instance = getattr(bound_method, '__self__')
-    current_state = meta.field.get_state(instance)
-
-    return (meta.has_transition(current_state) and
-            meta.conditions_met(instance, current_state) and
-            meta.has_transition_perm(instance, current_state, user))
+    instance, transition = _bound_transition(bound_method)
+    return (transition is not None and
+            transition.conditions_met(instance) and
+            transition.has_perm(instance, user))
 
 
 class State(abc.ABC):
@@ -0,0 +1,139 @@
+# coding: utf-8
+from contextlib import contextmanager
+from typing import List
+
+from django.db import router, transaction
+from django.db.models import Model
+
+from django_fsm_ex.counters import COUNTER_ATTR_NAME
+from django_fsm_ex.errors import TransitionNotAllowed
+from django_fsm_ex.fields import UNIT_OF_WORK_ATTR_NAME, get_fsm_meta
+from django_fsm_ex.deferred import send_post_transition
+from django_fsm_ex.outbox import OUTBOX_ATTR_NAME
+
+__author__ = 'banxi'
+
+__all__ = ['UnitOfWork', 'unit_of_work']
+
+
+class UnitOfWork:
+    """
+    在一个实例上连续执行多个状态转移
+
+    Collects the ``post_transition`` signals of the transitions run on ``instance``
+    so that they are sent in order by ``flush()``, after the final state is saved.
+    """
+
+    def __init__(self, instance: Model):
+        self.instance = instance
+        self.pending = []  # type: List[dict]
+
+    def validate(self, *names: str):
+        """
+        Check that the transition methods ``names`` can run one after the other from the
+        current state, following the targets declared in the transition tables.
+        The conditions of every step are checked on the instance as it is now (each
+        method checks them again when it runs): a condition which depends on what an
+        earlier method does fails here. A target decided by the method's return value
+        ends the check of its field.
+
+        Raises *TransitionNotAllowed* (or *ValueError* for an ``sql_update`` transition,
+        which cannot be part of a unit of work) before anything is run.
+        """
+        instance = self.instance
+        states = {}
+        for name in names:
+            method = getattr(instance, name)
+            meta = get_fsm_meta(method)
+            if meta.sql_update:
+                raise ValueError(f'{getattr(method, "label", name)}直接更新数据库,不能在 unit_of_work 中执行')
+            field = meta.resolve_field(instance.__class__)
+            if field.name not in states:
+                states[field.name] = field.get_state(instance)
+            elif states[field.name] is _UNKNOWN:
+                continue
+            transition = meta.resolve(states[field.name])
+            if transition is not None and not transition.conditions_met(instance):
+                transition = None
+            if transition is None:
+                method_label = getattr(method, 'label', name)
+                state = states[field.name]
+                raise TransitionNotAllowed(
+                    f'{getattr(state, "label", state)}状态不能进行{method_label}操作',
+                    object=instance, method=method, field=field, current_state=state)
+            if transition.target is not None:
+                states[field.name] = _UNKNOWN if hasattr(transition.target, 'get_state') else transition.target
+
+    def run(self, *names: str, **kwargs):
+        """
+        Validate the whole path, then run the transition methods ``names`` in order.
+        ``kwargs`` are passed to every method.
+        """
+        self.validate(*names)
+        return [getattr(self.instance, name)(**kwargs) for name in names]
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for signal_kwargs in pending:
+            send_post_transition(signal_kwargs)
+
+
+_UNKNOWN = object()
+
+
+@contextmanager
+def unit_of_work(instance: Model, save=True, using=None):
+    """
+    在一个实例上执行一组状态转移,统一保存和发送信号
+
+    Run several transitions on ``instance`` with a single save and one ordered
+    delivery of ``post_transition``::
+
+        with unit_of_work(application) as uow:
+            uow.run('to_approvement', 'dept_approved', 'dean_approved')
+
+    Transitions may also be called directly on the instance inside the block;
+    ``sql_update`` transitions, which write to the database right away, are rejected.
+    On a clean exit the instance is saved once (a guarded write with
+    ``ConcurrentTransitionMixin``, the rows are compared with the state loaded before
+    the first transition) unless ``save`` is False, then the deferred signals are sent,
+    in one transaction: ``post_transition`` receivers see the saved row, and those
+    deferred to commit run after it.
+    When the block, the save or a receiver raises, nothing is saved, the signals not
+    sent yet are dropped and the instance is restored as it was before the block (its
+    fields, and its class for ``state_choices`` proxies).
+    ``pre_transition`` is still sent by every transition.
+    """
+    if UNIT_OF_WORK_ATTR_NAME in instance.__dict__:
+        raise ValueError('unit_of_work 不能嵌套使用')
+    uow = UnitOfWork(instance)
+    initial = _snapshot(instance)
+    instance.__dict__[UNIT_OF_WORK_ATTR_NAME] = uow
+    try:
+        try:
+            yield uow
+        finally:
+            del instance.__dict__[UNIT_OF_WORK_ATTR_NAME]
+        with transaction.atomic(using=using or router.db_for_write(instance.__class__, instance=instance)):
+            if save:
+                instance.save(using=using)
+            uow.flush()
+    except BaseException:
+        _restore(instance, initial)
+        raise
+
+
+def _snapshot(instance: Model):
+    values = dict(instance.__dict__)
+    # 转移时原地修改的计数和发件箱记录
+    for name in (COUNTER_ATTR_NAME, OUTBOX_ATTR_NAME):
+        if name in values:
+            values[name] = values[name].copy()
+    return instance.__class__, values
+
+
+def _restore(instance: Model, snapshot):
+    cls, values = snapshot
+    instance.__class__ = cls
+    instance.__dict__.clear()
+    instance.__dict__.update(values)
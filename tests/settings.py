@@ -26,6 +26,7 @@ MIGRATION_MODULES = {
 'auth': None,
 'contenttypes': None,
 'guardian': None,
+'django_fsm_ex': None,
 }
 
 
@@ -0,0 +1,92 @@
+from django.db import models
+from django.db.models import Q
+from django_fsm_ex import FSMField, FSMManager, transition
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class ActionableArticle(models.Model):
+    state = FSMField(default='draft')
+    approved = models.BooleanField(default=False)
+
+    objects = FSMManager()
+
+    @transition(field=state, source='draft', target='published',
+                conditions=[lambda self: self.approved], sql_condition=Q(approved=True))
+    def publish(self):
+        pass
+
+    @transition(field=state, source=['draft', 'published'], target='archived')
+    def archive(self):
+        pass
+
+    @transition(field=state, source='+', target='deleted')
+    def delete_article(self):
+        pass
+
+    @transition(field=state, source='draft', target='published', conditions=[lambda self: True])
+    def force_publish(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def step(source, target):
+    @transition(field='state', source=source, target=target)
+    def run(self):
+        pass
+    return run
+
+
+class PipelineArticle(models.Model):
+    state = FSMField(default='new')
+
+    objects = FSMManager()
+
+    # 工厂生成的方法 __name__ 都是 run
+    start = step('new', 'running')
+    finish = step('running', 'done')
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def create_articles():
+    ActionableArticle.objects.bulk_create([
+        ActionableArticle(state='draft'),
+        ActionableArticle(state='draft', approved=True),
+        ActionableArticle(state='published'),
+        ActionableArticle(state='deleted'),
+    ])
+
+
+def test_annotations_match_python_availability():
+    create_articles()
+    rows = ActionableArticle.objects.with_available_transitions('state').order_by('pk')
+    for article in rows:
+        available = {t.name for t in article.get_available_state_transitions()}
+        for name in ('publish', 'archive', 'delete_article'):
+            assert getattr(article, f'{name}_available') == (name in available)
+
+
+def test_can_transition_filter():
+    create_articles()
+    assert list(ActionableArticle.objects.can_transition('publish').values_list('approved', flat=True)) == [True]
+    assert ActionableArticle.objects.can_transition('archive').count() == 3
+    assert set(ActionableArticle.objects.can_transition('delete_article').values_list('state', flat=True)) == {
+        'draft', 'published'}
+
+
+def test_bulk_transition_uses_sql_condition():
+    create_articles()
+    assert ActionableArticle.objects.bulk_transition('publish') == 1
+    with pytest.raises(ValueError):
+        ActionableArticle.objects.bulk_transition('force_publish')
+
+
+def test_annotations_are_keyed_by_attribute_name():
+    PipelineArticle.objects.bulk_create([PipelineArticle(state='new'), PipelineArticle(state='running')])
+    rows = PipelineArticle.objects.with_available_transitions().order_by('pk')
+    assert [(row.start_available, row.finish_available) for row in rows] == [(True, False), (False, True)]
@@ -0,0 +1,89 @@
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
+from django_fsm_ex import ConcurrentTransitionMixin, FSMField, FSMManager, transition
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class BulkSavedOrder(ConcurrentTransitionMixin, models.Model):
+    state = FSMField(default='new')
+    note = models.CharField(max_length=50, default='')
+
+    objects = FSMManager()
+
+    @transition(field=state, source='new', target='paid')
+    def pay(self):
+        self.note = 'paid'
+
+    @transition(field=state, source='new', target='cancelled')
+    def cancel(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class BulkSavedVersionedOrder(ConcurrentTransitionMixin, models.Model):
+    version_field = 'version'
+
+    state = FSMField(default='new')
+    version = models.PositiveIntegerField(default=0)
+
+    objects = FSMManager()
+
+    @transition(field=state, source='new', target='paid')
+    def pay(self):
+        pass
+
+    @transition(field=state, source='new', target='cancelled')
+    def cancel(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def test_bulk_save_writes_states_in_one_update():
+    BulkSavedOrder.objects.bulk_create(BulkSavedOrder() for _ in range(3))
+    orders = list(BulkSavedOrder.objects.order_by('pk'))
+    for order in orders:
+        order.pay()
+
+    with CaptureQueriesContext(connection) as queries:
+        conflicted = BulkSavedOrder.objects.bulk_save_transitions(orders, fields=['state', 'note'])
+    assert conflicted == []
+    assert len([query for query in queries if query['sql'].startswith('UPDATE')]) == 1
+    assert list(BulkSavedOrder.objects.values_list('state', 'note')) == [('paid', 'paid')] * 3
+
+    # 初始状态已经更新,可以继续正常保存
+    orders[0].note = 'changed'
+    orders[0].save()
+
+
+def test_bulk_save_reports_conflicts():
+    BulkSavedOrder.objects.bulk_create(BulkSavedOrder() for _ in range(3))
+    orders = list(BulkSavedOrder.objects.order_by('pk'))
+    other = BulkSavedOrder.objects.get(pk=orders[1].pk)
+    other.cancel()
+    other.save()
+    BulkSavedOrder.objects.filter(pk=orders[2].pk).delete()
+    for order in orders:
+        order.pay()
+
+    conflicted = BulkSavedOrder.objects.bulk_save_transitions(orders, batch_size=2)
+    assert conflicted == orders[1:]
+    assert list(BulkSavedOrder.objects.order_by('pk').values_list('state', flat=True)) == ['paid', 'cancelled']
+
+
+def test_bulk_save_bumps_version():
+    order = BulkSavedVersionedOrder.objects.create()
+    stale = BulkSavedVersionedOrder.objects.get(pk=order.pk)
+    order.pay()
+    assert BulkSavedVersionedOrder.objects.bulk_save_transitions([order]) == []
+    assert order.version == 2
+    assert BulkSavedVersionedOrder.objects.get(pk=order.pk).version == 2
+
+    stale.cancel()
+    assert BulkSavedVersionedOrder.objects.bulk_save_transitions([stale]) == [stale]
+    assert stale.version == 1
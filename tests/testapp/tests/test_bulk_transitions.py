@@ -0,0 +1,127 @@
+from django.db import models
+from django_fsm_ex import FSMField, FSMManager, transition, pre_bulk_transition, post_bulk_transition
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class BulkBlogPost(models.Model):
+    state = FSMField(default='new', protected=True)
+
+    objects = FSMManager()
+
+    @transition(field=state, source='new', target='published')
+    def publish(self):
+        pass
+
+    @transition(field=state, source='published', target='hidden')
+    def hide(self):
+        pass
+
+    @transition(field=state, source=['published', 'hidden'], target='stolen')
+    def steal(self):
+        pass
+
+    @transition(field=state, source='new', target='removed')
+    @transition(field=state, source='*', target='moderated')
+    def moderate(self):
+        pass
+
+    @transition(field=state, source='+', target='blocked')
+    def block(self):
+        pass
+
+    @transition(field=state, source='hidden', target='published')
+    @transition(field=state, source='published', target='hidden')
+    def toggle(self):
+        pass
+
+    @transition(field=state, source='new', target='published', conditions=[lambda self: True])
+    def review(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def create_posts(*states):
+    BulkBlogPost.objects.bulk_create(BulkBlogPost(state=state) for state in states)
+
+
+def states():
+    return sorted(BulkBlogPost.objects.values_list('state', flat=True))
+
+
+def test_bulk_transition_updates_only_sources():
+    create_posts('new', 'published', 'published', 'hidden')
+    assert BulkBlogPost.objects.bulk_transition('hide') == 2
+    assert states() == ['hidden', 'hidden', 'hidden', 'new']
+
+
+def test_bulk_transition_respects_queryset_filter():
+    create_posts('published', 'published')
+    first = BulkBlogPost.objects.order_by('pk').first()
+    assert BulkBlogPost.objects.filter(pk=first.pk).bulk_transition('steal') == 1
+    assert states() == ['published', 'stolen']
+
+
+def test_bulk_transition_wildcards():
+    create_posts('new', 'published', 'moderated')
+    assert BulkBlogPost.objects.bulk_transition('moderate') == 3
+    assert states() == ['moderated', 'moderated', 'removed']
+
+    create_posts('new', 'blocked')
+    assert BulkBlogPost.objects.bulk_transition('block') == 4
+    assert states() == ['blocked'] * 5
+
+
+def test_bulk_transition_cycle():
+    create_posts('published', 'hidden', 'new')
+    assert BulkBlogPost.objects.bulk_transition('toggle') == 2
+    assert states() == ['hidden', 'new', 'published']
+
+
+def test_bulk_transition_batches_signals():
+    create_posts('new', 'new', 'new')
+    calls = []
+
+    def on_pre(sender, name, target, **kwargs):
+        calls.append((name, target))
+
+    def on_post(sender, name, target, count, **kwargs):
+        calls.append((name, target, count))
+
+    pre_bulk_transition.connect(on_pre, sender=BulkBlogPost)
+    post_bulk_transition.connect(on_post, sender=BulkBlogPost)
+    try:
+        BulkBlogPost.objects.bulk_transition('publish', batch_size=2)
+    finally:
+        pre_bulk_transition.disconnect(on_pre, sender=BulkBlogPost)
+        post_bulk_transition.disconnect(on_post, sender=BulkBlogPost)
+    assert calls == [
+        ('publish', 'published'), ('publish', 'published', 2),
+        ('publish', 'published'), ('publish', 'published', 1),
+    ]
+
+
+def test_bulk_transition_with_conditions():
+    create_posts('new')
+    with pytest.raises(ValueError):
+        BulkBlogPost.objects.bulk_transition('review')
+    assert BulkBlogPost.objects.bulk_transition('review', check_conditions=False) == 1
+
+
+def test_claim_limits_and_returns_transitioned_instances():
+    create_posts('new', 'new', 'new', 'hidden')
+    claimed = BulkBlogPost.objects.order_by('pk').claim('publish', limit=2)
+    assert [post.state for post in claimed] == ['published', 'published']
+    assert states() == ['hidden', 'new', 'published', 'published']
+    assert BulkBlogPost.objects.claim('publish', limit=10)[0].state == 'published'
+    assert BulkBlogPost.objects.claim('publish', limit=10) == []
+
+
+def test_claim_groups_rows_by_target():
+    create_posts('new', 'published', 'hidden')
+    claimed = BulkBlogPost.objects.order_by('pk').claim('moderate', limit=10)
+    assert [post.state for post in claimed] == ['removed', 'moderated', 'moderated']
+    assert states() == ['moderated', 'moderated', 'removed']
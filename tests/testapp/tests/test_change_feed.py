@@ -0,0 +1,97 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_fsm_ex import change_feed
+from django_fsm_ex.models import TransitionLog
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+def create_entries(*models):
+    TransitionLog.objects.bulk_create(
+        TransitionLog(model=model, object_pk=str(i), field='state', name='pay', source='new', target='paid',
+                      created=timezone.now(), inserted=timezone.now())
+        for i, model in enumerate(models))
+    return list(TransitionLog.objects.values_list('id', flat=True))
+
+
+def test_feed_pages_by_keyset_and_resumes():
+    ids = create_entries('testapp.A', 'testapp.B', 'testapp.A', 'testapp.A', 'testapp.B')
+    feed = change_feed(batch=2)
+    with CaptureQueriesContext(connection) as queries:
+        assert [event.cursor for event in feed] == ids
+    assert len(queries) == 3
+    assert all('OFFSET' not in query['sql'] for query in queries)
+    assert feed.cursor == ids[-1]
+
+    feed = change_feed(since=ids[1], models=['testapp.A'])
+    assert [event.cursor for event in feed] == [ids[2], ids[3]]
+    assert list(change_feed(since=feed.cursor, models=['testapp.A'])) == []
+
+
+def test_feed_command_streams_jsonl():
+    ids = create_entries('testapp.A', 'testapp.B')
+    stdout, stderr = StringIO(), StringIO()
+    call_command('fsm_feed', since=str(ids[0]), stdout=stdout, stderr=stderr)
+    events = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert [(event['cursor'], event['model']) for event in events] == [(ids[1], 'testapp.B')]
+    assert stderr.getvalue().strip() == f'cursor: {ids[1]}'
+
+
+def test_feed_command_csv():
+    create_entries('testapp.A')
+    stdout = StringIO()
+    call_command('fsm_feed', format='csv', stdout=stdout, stderr=StringIO())
+    header, row = stdout.getvalue().splitlines()
+    assert header.startswith('cursor,model,object_pk')
+    assert 'testapp.A' in row
+
+
+def test_feed_lag_stops_at_recent_rows():
+    ids = create_entries('testapp.A', 'testapp.A', 'testapp.A')
+    old = timezone.now() - timedelta(minutes=1)
+    # 中间的一行转移得早但刚写入,之后的行即使已经足够旧也不能先读
+    TransitionLog.objects.update(created=old)
+    TransitionLog.objects.filter(id__in=[ids[0], ids[2]]).update(inserted=old)
+    feed = change_feed(lag=10)
+    assert [event.cursor for event in feed] == [ids[0]]
+    assert feed.cursor == ids[0]
+
+    TransitionLog.objects.filter(id=ids[1]).update(inserted=old)
+    assert [event.cursor for event in change_feed(since=feed.cursor, lag=10)] == ids[1:]
+
+
+def test_feed_command_lag():
+    ids = create_entries('testapp.A')
+    stdout, stderr = StringIO(), StringIO()
+    call_command('fsm_feed', lag=10, stdout=stdout, stderr=stderr)
+    assert stdout.getvalue() == ''
+    assert stderr.getvalue().strip() == 'cursor: 0'
+
+    TransitionLog.objects.update(inserted=timezone.now() - timedelta(minutes=1))
+    call_command('fsm_feed', lag=10, stdout=stdout, stderr=stderr)
+    assert json.loads(stdout.getvalue())['cursor'] == ids[0]
+
+
+def test_feed_follow_polls_until_stopped(monkeypatch):
+    ids = create_entries('testapp.A')
+    feed = change_feed(follow=True, interval=5)
+    sleeps = []
+
+    def sleep(seconds):
+        # 等待期间写入新的行,第二次等待时停止
+        sleeps.append(seconds)
+        if len(sleeps) == 1:
+            ids.extend(create_entries('testapp.B')[1:])
+        else:
+            feed.stop()
+
+    monkeypatch.setattr('django_fsm_ex.feed.time.sleep', sleep)
+    assert [event.cursor for event in feed] == ids
+    assert sleeps == [5, 5]
@@ -0,0 +1,112 @@
+import threading
+
+from django.db import models, transaction
+from django_fsm_ex import FSMField, post_transition, post_transition_committed, transition
+from django_fsm_ex import deferred
+
+import pytest
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+class DeferredArticle(models.Model):
+    state = FSMField(default='new', defer_post_transition=True)
+
+    @transition(field=state, source='*', target='published')
+    def publish(self):
+        pass
+
+    @transition(field=state, source='published', target='hidden')
+    def hide(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class CommittedArticle(models.Model):
+    state = FSMField(default='new')
+
+    @transition(field=state, source='new', target='published')
+    def publish(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+@pytest.fixture
+def received():
+    calls = []
+
+    def receiver(sender, instance, name, **kwargs):
+        calls.append((sender.__name__, instance.pk, name))
+
+    post_transition.connect(receiver, sender=DeferredArticle)
+    post_transition_committed.connect(receiver, sender=CommittedArticle)
+    yield calls
+    post_transition.disconnect(receiver, sender=DeferredArticle)
+    post_transition_committed.disconnect(receiver, sender=CommittedArticle)
+
+
+def test_delivery_waits_for_commit_and_coalesces(received):
+    article = DeferredArticle.objects.create()
+    with transaction.atomic():
+        article.publish()
+        article.publish()
+        article.hide()
+        assert received == []
+    assert received == [('DeferredArticle', article.pk, 'publish'), ('DeferredArticle', article.pk, 'hide')]
+
+
+def test_rolled_back_delivery_is_dropped(received):
+    first = DeferredArticle.objects.create()
+    second = DeferredArticle.objects.create()
+    with transaction.atomic():
+        first.publish()
+        try:
+            with transaction.atomic():
+                second.publish()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+    assert received == [('DeferredArticle', first.pk, 'publish')]
+
+    # 回滚的重复信号不影响之后的投递
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                second.publish()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        second.publish()
+    assert received[-1] == ('DeferredArticle', second.pk, 'publish')
+
+
+def test_committed_signal_and_autocommit(received):
+    article = CommittedArticle.objects.create()
+    article.publish()
+    assert received == [('CommittedArticle', article.pk, 'publish')]
+
+
+def test_batch_survives_savepoint_rollback_and_is_per_thread(received):
+    article = DeferredArticle.objects.create()
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                article.publish()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        article.publish()
+        article.publish()
+        batch = deferred._local.buffers['default']
+
+        # 其他线程的连接有自己的批次
+        batches = []
+        thread = threading.Thread(target=lambda: batches.append(deferred._local.__dict__.get('buffers')))
+        thread.start()
+        thread.join()
+        assert batches == [None]
+    assert received == [('DeferredArticle', article.pk, 'publish')]
+    assert not batch.is_pending()
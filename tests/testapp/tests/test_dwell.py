@@ -0,0 +1,87 @@
+from datetime import date, datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import models
+from django_fsm_ex import FSMField, dwell_stats, prune_transition_log, rollup_dwell, transition
+from django_fsm_ex.dwell import percentile
+from django_fsm_ex.models import StateDwellDaily, TransitionLog
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+DAY = datetime(2026, 1, 10)
+
+
+class DwellTicket(models.Model):
+    state = FSMField(default='new', log_transitions=True)
+
+    @transition(field=state, source='new', target='review')
+    def submit(self):
+        pass
+
+    @transition(field=state, source='review', target='done')
+    def approve(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def log(object_pk, name, source, target, created):
+    TransitionLog.objects.create(model='testapp.DwellTicket', object_pk=str(object_pk), field='state',
+                                 name=name, source=source, target=target, created=created)
+
+
+@pytest.fixture
+def history():
+    log(1, 'submit', 'new', 'review', DAY + timedelta(hours=10))
+    log(1, 'approve', 'review', 'done', DAY + timedelta(hours=12))
+    log(2, 'submit', 'new', 'review', DAY + timedelta(hours=9))
+    log(2, 'submit', 'review', '', DAY + timedelta(hours=11))  # 出错,状态没有变化
+    log(2, 'approve', 'review', 'done', DAY + timedelta(days=1, hours=9))
+    log(3, 'submit', 'new', 'review', DAY + timedelta(days=1, hours=10))
+
+
+def test_dwell_stats_per_state_and_transition(history):
+    stats = {(row.state, row.name): row for row in dwell_stats(DwellTicket)}
+    assert set(stats) == {('review', 'approve'), ('review', '')}
+    row = stats['review', '']
+    assert (row.count, row.total, row.max) == (2, 26 * 3600, 24 * 3600)
+    assert (row.p50, row.p90) == (2 * 3600, 24 * 3600)
+
+    since_day_two = dwell_stats(DwellTicket, since=DAY + timedelta(days=1))
+    assert [(row.name, row.count, row.max) for row in since_day_two] == [('', 1, 24 * 3600), ('approve', 1, 24 * 3600)]
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 11))
+    # 和 PERCENTILE_DISC 一样取累计比例达到百分位的第一个值
+    assert [percentile(values, percent) for percent in (10, 50, 90, 99, 100)] == [1, 5, 9, 10, 10]
+    assert percentile([], 50) == 0.0
+
+
+def test_rollup_and_prune(history):
+    assert rollup_dwell(DwellTicket, until=date(2026, 1, 12)) == 4
+    assert rollup_dwell(DwellTicket, until=date(2026, 1, 12)) == 0
+    days = StateDwellDaily.objects.filter(name='').order_by('day').values_list('day', 'count', 'total')
+    assert list(days) == [(date(2026, 1, 10), 1, 7200), (date(2026, 1, 11), 1, 86400)]
+
+    with pytest.raises(ValueError):
+        prune_transition_log(DwellTicket, before=date(2026, 1, 20))
+    # 保留每个对象最后一条改变状态的记录
+    assert prune_transition_log(DwellTicket) == 3
+    assert sorted(TransitionLog.objects.values_list('object_pk', 'name')) == [
+        ('1', 'approve'), ('2', 'approve'), ('3', 'submit')]
+
+
+def test_dwell_command(history):
+    out = StringIO()
+    call_command('fsm_dwell', 'testapp.DwellTicket', stdout=out)
+    lines = out.getvalue().splitlines()
+    assert lines[1].split() == ['review', '*', '2', '2:00:00', '1', 'day,', '0:00:00',
+                                '1', 'day,', '0:00:00', '1', 'day,', '0:00:00']
+
+    out = StringIO()
+    call_command('fsm_dwell', 'testapp.DwellTicket', rollup=True, prune=True, until='2026-01-12', stdout=out)
+    assert out.getvalue().splitlines() == ['4 daily rows written', '3 log rows deleted']
@@ -0,0 +1,109 @@
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
+from django_fsm_ex import FSMField, transition
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class WorkerJob(models.Model):
+    state = FSMField(default='queued')
+    fail = models.BooleanField(default=False)
+
+    @transition(field=state, source='queued', target='processed')
+    def process(self):
+        if self.fail:
+            raise RuntimeError('boom')
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class SqlWorkerJob(models.Model):
+    state = FSMField(default='queued')
+    note = models.CharField(max_length=20, default='')
+
+    @transition(field=state, source='queued', target='processed', sql_update=True)
+    def process(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def run_worker(*args, **options):
+    stdout, stderr = StringIO(), StringIO()
+    call_command('fsm_worker', *args, stdout=stdout, stderr=stderr, **options)
+    return stdout.getvalue(), stderr.getvalue()
+
+
+def test_worker_drains_source_state():
+    WorkerJob.objects.bulk_create([WorkerJob() for _ in range(5)] + [WorkerJob(state='processed')])
+    WorkerJob.objects.create(fail=True)
+
+    stdout, stderr = run_worker('testapp.WorkerJob', transition='process', batch=2)
+    assert '5 done, 0 skipped, 1 failed in 3 batches' in stdout
+    assert 'boom' in stderr
+    assert list(WorkerJob.objects.filter(state='queued').values_list('fail', flat=True)) == [True]
+
+
+def test_worker_limit():
+    WorkerJob.objects.bulk_create(WorkerJob() for _ in range(3))
+    stdout, stderr = run_worker('testapp.WorkerJob', transition='process', limit=2)
+    assert stdout.startswith('2 done')
+    assert WorkerJob.objects.filter(state='queued').count() == 1
+
+
+def test_worker_unknown_transition():
+    with pytest.raises(CommandError):
+        run_worker('testapp.WorkerJob', transition='missing')
+
+
+class InlinePool:
+    """multiprocessing.Pool 的替身: 在当前进程中依次执行"""
+    created = []
+
+    def __init__(self, processes, initializer=None):
+        self.processes = processes
+        self.initializer = initializer
+        self.closed = self.joined = False
+        self.created.append(self)
+        initializer()
+
+    def apply_async(self, func, args):
+        result = func(*args)
+        return type('AsyncResult', (), {'get': lambda self: result})()
+
+    def close(self):
+        self.closed = True
+
+    def join(self):
+        self.joined = True
+
+
+@pytest.mark.django_db(transaction=True)
+def test_worker_pool(monkeypatch):
+    import multiprocessing
+
+    monkeypatch.setattr(multiprocessing, 'Pool', InlinePool)
+    InlinePool.created.clear()
+    WorkerJob.objects.bulk_create(WorkerJob() for _ in range(7))
+
+    stdout, stderr = run_worker('testapp.WorkerJob', transition='process', processes=2, batch=2)
+    assert stdout.startswith('7 done, 0 skipped, 0 failed in 4 batches')
+    assert not WorkerJob.objects.filter(state='queued').exists()
+    pool, = InlinePool.created
+    assert (pool.processes, pool.closed, pool.joined) == (2, True, True)
+
+
+def test_worker_does_not_save_sql_update_transitions():
+    SqlWorkerJob.objects.bulk_create(SqlWorkerJob() for _ in range(2))
+    with CaptureQueriesContext(connection) as queries:
+        stdout, stderr = run_worker('testapp.SqlWorkerJob', transition='process')
+    assert stdout.startswith('2 done')
+    # 每行只有转移本身的一条 UPDATE,不再整行保存
+    updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+    assert len(updates) == 2 and all('"note"' not in sql for sql in updates)
@@ -1,5 +1,6 @@
-from django.db import models
-from django_fsm_ex import ConcurrentTransitionMixin, transition, FSMField, ConcurrentTransition
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
+from django_fsm_ex import ConcurrentTransitionMixin, transition, FSMField, ConcurrentTransition, TransitionNotAllowed
 
 import pytest
 pytestmark = pytest.mark.django_db
@@ -82,3 +83,77 @@ def test_inheritance_crud_succeed():
     post = ExtendedBlogPost.objects.get(pk=post.pk)
     assert ('rejected' == post.review_state)
     assert ('test_inheritance_crud_succeed2' == post.text)
+
+def test_deferred_load_keeps_state_guard():
+    post = LockedBlogPost.objects.create(text='deferred')
+    stale = LockedBlogPost.objects.only('id', 'state').get(pk=post.pk)
+
+    post.publish()
+    post.save()
+
+    stale.publish()
+    with pytest.raises(ConcurrentTransition):
+        stale.save()
+
+
+class FastLockedBlogPost(LockedBlogPost):
+    check_conflict_exists = False
+
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+def test_conflict_without_exists_query():
+    post1 = FastLockedBlogPost.objects.create()
+    post2 = FastLockedBlogPost.objects.get(pk=post1.pk)
+
+    post1.publish()
+    post1.save()
+
+    post2.publish()
+    with CaptureQueriesContext(connection) as queries:
+        with pytest.raises(ConcurrentTransition):
+            post2.save()
+    assert len(queries) == 1
+
+
+def test_preset_pk_insert_without_exists_check():
+    post = FastLockedBlogPost(pk=4242, text='preset')
+    post.save()
+    assert FastLockedBlogPost.objects.filter(pk=4242).exists()
+
+
+def test_locked_transition_refreshes_state():
+    post = LockedBlogPost.objects.create()
+    stale = LockedBlogPost.objects.get(pk=post.pk)
+    post.publish()
+    post.save()
+
+    with stale.locked_transition(stale.remove):
+        assert stale.state == 'published'
+        stale.remove()
+        stale.save()
+    assert LockedBlogPost.objects.get(pk=post.pk).state == 'removed'
+
+
+def test_locked_transition_rechecks_transition():
+    post = LockedBlogPost.objects.create()
+    stale = LockedBlogPost.objects.get(pk=post.pk)
+    post.publish()
+    post.save()
+
+    with pytest.raises(TransitionNotAllowed):
+        with stale.locked_transition(stale.publish):
+            pass  # pragma: no cover
+
+
+def test_locked_transition_skip_locked_missing_row():
+    post = LockedBlogPost.objects.create()
+    LockedBlogPost.objects.filter(pk=post.pk).delete()
+    with pytest.raises(ConcurrentTransition):
+        with post.locked_transition(skip_locked=True):
+            pass  # pragma: no cover
+    with pytest.raises(LockedBlogPost.DoesNotExist):
+        with post.locked_transition():
+            pass  # pragma: no cover
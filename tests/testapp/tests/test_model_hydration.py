@@ -0,0 +1,83 @@
+from unittest import mock
+
+from django.db import models
+from django_fsm_ex import ConcurrentTransitionMixin, FSMField, FSMModelMixin, transition
+from django_fsm_ex.fields import FSMFieldDescriptor
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class Issue(FSMModelMixin, models.Model):
+    STATE_CHOICES = (
+        ('open', 'Open', 'OpenIssue'),
+        ('closed', 'Closed', 'testapp.ClosedIssue'),
+    )
+    state = FSMField(default='open', state_choices=STATE_CHOICES, protected=True)
+    title = models.CharField(max_length=50, default='')
+
+    @transition(field=state, source='open', target='closed')
+    def close(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class PlainNote(ConcurrentTransitionMixin, models.Model):
+    text = models.CharField(max_length=50, default='')
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class OpenIssue(Issue):
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+class ClosedIssue(Issue):
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+def test_proxy_classes_are_resolved_once():
+    field = Issue._meta.get_field('state')
+    field.resolve_state_proxies()
+    with mock.patch('django_fsm_ex.fields.apps.get_model') as get_model:
+        issue = Issue()
+        issue.close()
+    assert not get_model.called
+    assert isinstance(issue, ClosedIssue)
+
+
+def test_rows_are_hydrated_without_descriptor():
+    Issue.objects.create(title='a')
+    Issue.objects.create(title='b', state='closed')
+
+    with mock.patch.object(FSMFieldDescriptor, '__set__') as descriptor_set:
+        issues = list(Issue.objects.order_by('title'))
+    assert not descriptor_set.called
+    assert [type(issue) for issue in issues] == [OpenIssue, ClosedIssue]
+    assert [issue.state for issue in issues] == ['open', 'closed']
+    assert not issues[0]._state.adding
+
+    # protected 字段依然不能直接修改
+    with pytest.raises(AttributeError):
+        issues[0].state = 'closed'
+
+
+def test_deferred_rows_use_default_path():
+    Issue.objects.create(title='a', state='closed')
+    issue = Issue.objects.only('id', 'state').get()
+    assert isinstance(issue, ClosedIssue)
+    assert issue.title == 'a'
+
+
+def test_model_without_state_field():
+    note = PlainNote.objects.create(text='a')
+    note.text = 'b'
+    note.save()
+    assert PlainNote.objects.get(pk=note.pk).text == 'b'
@@ -0,0 +1,123 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import models, transaction
+from django.utils import timezone
+from django_fsm_ex import ConcurrentTransitionMixin, FSMField, FSMManager, outbox_dispatch, transition
+from django_fsm_ex.models import TransitionOutbox
+from django_fsm_ex.outbox import drain_outbox
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class OutboxShipment(ConcurrentTransitionMixin, models.Model):
+    state = FSMField(default='new', outbox=True)
+    fail = models.BooleanField(default=False)
+
+    objects = FSMManager()
+
+    @transition(field=state, source='new', target='sent')
+    def send(self):
+        pass
+
+    @transition(field=state, source='sent', target='delivered')
+    def deliver(self):
+        pass
+
+    def fsm_outbox_payload(self, name, source, target):
+        return {'fail': self.fail}
+
+    class Meta:
+        app_label = 'testapp'
+
+
+@pytest.fixture
+def dispatched():
+    calls = []
+
+    def receiver(sender, object_pk, name, payload, **kwargs):
+        if payload['fail']:
+            raise RuntimeError('unavailable')
+        calls.append((object_pk, name))
+
+    outbox_dispatch.connect(receiver, sender=OutboxShipment)
+    yield calls
+    outbox_dispatch.disconnect(receiver, sender=OutboxShipment)
+
+
+def test_entries_are_written_with_save():
+    shipment = OutboxShipment.objects.create()
+    shipment.send()
+    assert not TransitionOutbox.objects.exists()
+    with transaction.atomic():
+        shipment.save()
+    entry = TransitionOutbox.objects.get()
+    assert (entry.model, entry.object_pk, entry.name, entry.source, entry.target) == (
+        'testapp.OutboxShipment', str(shipment.pk), 'send', 'new', 'sent')
+    assert json.loads(entry.payload) == {'fail': False}
+
+
+def test_drain_dispatches_in_order_per_object(dispatched):
+    ok = OutboxShipment.objects.create()
+    broken = OutboxShipment.objects.create(fail=True)
+    for shipment in (ok, broken):
+        shipment.send()
+        shipment.save()
+        shipment.deliver()
+        shipment.save()
+
+    stdout = StringIO()
+    call_command('fsm_outbox_drain', stdout=stdout)
+    assert stdout.getvalue().strip() == '2 dispatched, 1 failed'
+    assert dispatched == [(str(ok.pk), 'send'), (str(ok.pk), 'deliver')]
+
+    # 失败的记录保留,同一对象之后的记录不会先发送
+    remaining = list(TransitionOutbox.objects.values_list('name', 'attempts'))
+    assert remaining == [('send', 1), ('deliver', 0)]
+    assert 'unavailable' in TransitionOutbox.objects.first().last_error
+
+
+def test_failed_rows_do_not_starve_other_objects(dispatched):
+    shipments = [OutboxShipment.objects.create(fail=True) for _ in range(2)] + [OutboxShipment.objects.create()]
+    for shipment in shipments:
+        shipment.send()
+        shipment.save()
+
+    assert drain_outbox(batch_size=2) == (0, 2)
+    # 失败的记录等待重试,不再排在前面
+    assert drain_outbox(batch_size=2) == (1, 0)
+    assert dispatched == [(str(shipments[2].pk), 'send')]
+    assert drain_outbox(batch_size=2) == (0, 0)
+
+
+def test_failed_rows_are_retried_until_max_attempts(dispatched, settings):
+    settings.FSM_OUTBOX_MAX_ATTEMPTS = 2
+    shipment = OutboxShipment.objects.create(fail=True)
+    shipment.send()
+    shipment.save()
+
+    assert drain_outbox() == (0, 1)
+    row = TransitionOutbox.objects.get()
+    assert row.retry_at > timezone.now()
+    TransitionOutbox.objects.update(retry_at=None)
+    assert drain_outbox() == (0, 1)
+    TransitionOutbox.objects.update(retry_at=None)
+    assert drain_outbox() == (0, 0)
+    assert TransitionOutbox.objects.get().attempts == 2
+
+
+def test_bulk_save_transitions_writes_entries():
+    shipments = [OutboxShipment.objects.create() for _ in range(3)]
+    stale = OutboxShipment.objects.get(pk=shipments[2].pk)
+    stale.send()
+    stale.save()
+    TransitionOutbox.objects.all().delete()
+    for shipment in shipments:
+        shipment.send()
+
+    conflicted = OutboxShipment.objects.bulk_save_transitions(shipments)
+    assert conflicted == [shipments[2]]
+    entries = TransitionOutbox.objects.values_list('object_pk', 'name')
+    assert list(entries) == [(str(shipments[0].pk), 'send'), (str(shipments[1].pk), 'send')]
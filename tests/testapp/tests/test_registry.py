@@ -0,0 +1,114 @@
+from django.db import models
+from django_fsm_ex import FSMField, transition, warmup, can_proceed, has_transition_perm
+from django_fsm_ex.registry import registry
+
+
+class RegistryDocument(models.Model):
+    state = FSMField(default='new')
+
+    @transition(field=state, source='new', target='review')
+    def submit(self):
+        pass
+
+    @transition(field=state, source='review', target='done')
+    def approve(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class PlainDocument(RegistryDocument):
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+class ArchivableDocument(RegistryDocument):
+    @transition(field='state', source='done', target='archived')
+    def archive(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+class ManualDocument(RegistryDocument):
+    def approve(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+def step(source, target):
+    @transition(field='state', source=source, target=target)
+    def run(self):
+        pass
+    return run
+
+
+class PipelineDocument(models.Model):
+    state = FSMField(default='new')
+
+    # 工厂生成的方法 __name__ 都是 run
+    start = step('new', 'running')
+    finish = step('running', 'done')
+
+    @transition(field=state, source='done', target='archived')
+    def archive(self):
+        pass
+
+    shelve = archive
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def state_field():
+    return RegistryDocument._meta.get_field('state')
+
+
+def test_subclass_without_changes_shares_parent_table():
+    field = state_field()
+    assert registry.get_transitions(PlainDocument, field) is registry.get_transitions(RegistryDocument, field)
+
+
+def test_subclass_transitions_are_copied_on_write():
+    field = state_field()
+    parent = registry.get_transitions(RegistryDocument, field)
+    assert list(registry.get_transitions(ArchivableDocument, field)) == ['approve', 'archive', 'submit']
+    assert list(parent) == ['approve', 'submit']
+    assert list(registry.get_transitions(ManualDocument, field)) == ['submit']
+
+
+def test_string_field_transition_is_bound_on_first_call():
+    document = ArchivableDocument(state='done')
+    assert can_proceed(document.archive)
+    document.archive()
+    assert document.state == 'archived'
+
+
+def test_warmup_compiles_indexes():
+    warmup([RegistryDocument, PlainDocument])
+    field = state_field()
+    assert registry.get_index(PlainDocument, field) is field.get_transition_index(PlainDocument)
+    assert list(field.get_transition_index(PlainDocument).lookup('review')) == ['approve']
+
+
+def test_transitions_are_keyed_by_attribute_name():
+    document = PipelineDocument()
+    field = document._meta.get_field('state')
+    assert list(field.get_state_transitions(document)) == ['start']
+    assert can_proceed(document.start)
+    assert not can_proceed(document.finish)
+    assert has_transition_perm(document.start, None)
+    assert not has_transition_perm(document.finish, None)
+
+    document.start()
+    assert can_proceed(document.finish) and not can_proceed(document.start)
+    document.finish()
+    assert list(field.get_state_transitions(document)) == ['archive', 'shelve']
+    assert can_proceed(document.shelve)
@@ -0,0 +1,94 @@
+from django.db import connection, models
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from django_fsm_ex import ConcurrentTransitionMixin, FSMField, TransitionNotAllowed, transition
+from django_fsm_ex.models import TransitionLog
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class SqlUpdateTask(ConcurrentTransitionMixin, models.Model):
+    state = FSMField(default='new')
+    ready = models.BooleanField(default=True)
+
+    @transition(field=state, source=['new', 'retry'], target='running', sql_update=True,
+                sql_condition=Q(ready=True))
+    def start(self):
+        pass
+
+    @transition(field=state, source='running', target='done')
+    def finish(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class SqlUpdatePost(models.Model):
+    state = FSMField(default='new', count_states=True, log_transitions=True)
+
+    @transition(field=state, source=['new', 'draft'], target='published', sql_update=True)
+    def publish(self):
+        pass
+
+    @transition(field=state, source='new', target='draft')
+    def draft(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def test_transition_is_one_update():
+    task = SqlUpdateTask.objects.create()
+    with CaptureQueriesContext(connection) as queries:
+        task.start()
+    assert len(queries) == 1
+    assert task.state == 'running'
+    assert SqlUpdateTask.objects.get(pk=task.pk).state == 'running'
+
+    # ConcurrentTransitionMixin 的初始状态已经同步
+    task.finish()
+    task.save()
+
+
+def test_lost_race_is_rejected():
+    task = SqlUpdateTask.objects.create()
+    other = SqlUpdateTask.objects.get(pk=task.pk)
+    other.start()
+    with pytest.raises(TransitionNotAllowed):
+        task.start()
+    assert task.state == 'new'
+
+
+def test_sql_condition_is_checked():
+    task = SqlUpdateTask.objects.create(ready=False)
+    with pytest.raises(TransitionNotAllowed):
+        task.start()
+
+
+def test_fixed_target_is_required():
+    with pytest.raises(ValueError):
+        transition(field='state', source='new', sql_update=True)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_stale_instance_is_rejected():
+    post = SqlUpdatePost.objects.create()
+    stale = SqlUpdatePost.objects.get(pk=post.pk)
+    post.draft()
+    post.save()
+
+    # 数据库中的 draft 也是 publish 的源状态,但不是内存中的 new
+    with pytest.raises(TransitionNotAllowed):
+        stale.publish()
+    assert SqlUpdatePost.objects.get(pk=post.pk).state == 'draft'
+
+    post.publish()
+    published = SqlUpdatePost.objects.get(pk=post.pk)
+    with pytest.raises(TransitionNotAllowed):
+        published.publish()
+    assert SqlUpdatePost.state_counts('state') == {'published': 1}
+    assert list(TransitionLog.objects.filter(model='testapp.SqlUpdatePost').exclude(target='')
+                .values_list('source', 'target')) == [('new', 'draft'), ('draft', 'published')]
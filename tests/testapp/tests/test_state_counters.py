@@ -0,0 +1,101 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import models, transaction
+from django_fsm_ex import FSMField, FSMManager, transition
+from django_fsm_ex.counters import count_bulk_update
+from django_fsm_ex.models import StateCounter
+
+import pytest
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+class CountedTicket(models.Model):
+    state = FSMField(default='open', count_states=True)
+
+    objects = FSMManager()
+
+    @transition(field=state, source='open', target='assigned')
+    def assign(self):
+        pass
+
+    @transition(field=state, source='assigned', target='closed')
+    def close(self):
+        pass
+
+    @transition(field=state, source='open', target='closed', sql_update=True)
+    def discard(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class PlainCountedTicket(CountedTicket):
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+def test_counts_follow_create_transition_and_delete():
+    tickets = [CountedTicket.objects.create() for _ in range(3)]
+    tickets[0].assign()
+    assert CountedTicket.state_counts('state') == {'open': 3}  # 保存后才计数
+    tickets[0].save()
+    tickets[1].discard()
+    PlainCountedTicket.objects.get(pk=tickets[2].pk).delete()
+    assert CountedTicket.state_counts('state') == {'assigned': 1, 'closed': 1}
+
+
+def test_deltas_are_applied_on_commit():
+    ticket = CountedTicket.objects.create()
+    with transaction.atomic():
+        ticket.assign()
+        ticket.save()
+        ticket.close()
+        ticket.save()
+        CountedTicket.objects.create()
+        assert CountedTicket.state_counts('state') == {'open': 1}
+    assert CountedTicket.state_counts('state') == {'open': 1, 'closed': 1}
+
+
+def test_rolled_back_deltas_are_dropped():
+    ticket = CountedTicket.objects.create()
+    with transaction.atomic():
+        with pytest.raises(RuntimeError), transaction.atomic():
+            ticket.assign()
+            ticket.save()
+            raise RuntimeError
+        CountedTicket.objects.create()
+    assert CountedTicket.state_counts('state') == {'open': 2}
+
+
+def test_bulk_transition_is_counted():
+    for _ in range(3):
+        CountedTicket.objects.create()
+    assert CountedTicket.objects.bulk_transition('assign') == 3
+    assert CountedTicket.state_counts('state') == {'assigned': 3}
+
+
+def test_bulk_update_of_other_rows_is_recounted():
+    CountedTicket.objects.create()
+    field = CountedTicket._meta.get_field('state')
+    queryset = CountedTicket.objects.filter(state='open')
+    with transaction.atomic():
+        counted = count_bulk_update(queryset, field, 'assigned')
+        # 计数之后才进入 queryset 的行,原来的状态未知
+        CountedTicket.objects.create()
+        counted(queryset.update(state='assigned'))
+    assert CountedTicket.state_counts('state') == {'assigned': 2}
+
+
+def test_recount_repairs_counters():
+    for _ in range(4):
+        CountedTicket.objects.create()
+    CountedTicket.objects.filter(pk__in=CountedTicket.objects.values('pk')[:1]).update(state='closed')
+    StateCounter.objects.create(model='testapp.CountedTicket', field='state', state='gone', count=5)
+
+    out = StringIO()
+    call_command('fsm_recount', 'testapp.CountedTicket', batch=3, stdout=out)
+    assert '4 rows in 2 states' in out.getvalue()
+    assert CountedTicket.state_counts('state') == {'open': 3, 'closed': 1}
@@ -0,0 +1,102 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import models
+from django.utils import timezone
+from django_fsm_ex import FSMField, states_as_of, take_snapshot, transition
+from django_fsm_ex.log import transition_logger
+from django_fsm_ex.models import StateSnapshot, TransitionLog
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class HistoryOrder(models.Model):
+    state = FSMField(default='new', log_transitions=True)
+
+    @transition(field=state, source='new', target='paid')
+    def pay(self):
+        pass
+
+    @transition(field=state, source='paid', target='shipped')
+    def ship(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+@pytest.fixture(autouse=True)
+def sync_log(monkeypatch):
+    monkeypatch.setattr(transition_logger, '_mode', 'sync')
+
+
+def run(order, *names):
+    for name in names:
+        getattr(order, name)()
+    order.save()
+
+
+def set_log_time(when):
+    TransitionLog.objects.filter(created__gt=when).update(created=when)
+
+
+def test_states_as_of_snapshot_and_tail():
+    t0 = timezone.now() - timedelta(days=3)
+    orders = [HistoryOrder.objects.create() for _ in range(5)]
+    run(orders[0], 'pay')
+    set_log_time(t0)
+
+    snapshot = take_snapshot(HistoryOrder, 'state')
+    assert snapshot.rows == 5
+    StateSnapshot.objects.filter(pk=snapshot.pk).update(taken_at=t0 + timedelta(days=1))
+
+    run(orders[0], 'ship')
+    run(orders[1], 'pay')
+    TransitionLog.objects.filter(name='ship').update(created=t0 + timedelta(days=2))
+    TransitionLog.objects.filter(name='pay', object_pk=str(orders[1].pk)).update(created=t0 + timedelta(days=4))
+
+    expected = {order.pk: 'new' for order in orders}
+    expected[orders[0].pk] = 'shipped'
+    for batch in (2, 1000):
+        as_of = dict(states_as_of(HistoryOrder, 'state', t0 + timedelta(days=3), batch=batch))
+        assert as_of == expected
+
+    # 早于快照时只能重放日志
+    assert dict(states_as_of(HistoryOrder, 'state', t0)) == {orders[0].pk: 'paid'}
+
+
+def test_log_tail_is_replayed_in_chunks():
+    orders = [HistoryOrder.objects.create() for _ in range(3)]
+    run(orders[0], 'pay')
+    take_snapshot(HistoryOrder, 'state')
+    # 快照之后创建的行只在日志中
+    orders += [HistoryOrder.objects.create() for _ in range(4)]
+    for order in orders[1:]:
+        run(order, 'pay')
+    run(orders[4], 'ship')
+
+    expected = {order.pk: 'paid' for order in orders}
+    expected[orders[4].pk] = 'shipped'
+    later = timezone.now() + timedelta(seconds=1)
+    for batch in (1, 2, 1000):
+        pairs = list(states_as_of(HistoryOrder, 'state', later, batch=batch))
+        assert len(pairs) == len(expected) and dict(pairs) == expected
+
+    # 没有快照时整个日志也是分段回放的
+    StateSnapshot.objects.all().delete()
+    pairs = list(states_as_of(HistoryOrder, 'state', later, batch=2))
+    assert len(pairs) == len(expected) and dict(pairs) == expected
+
+
+def test_snapshot_command_keeps_latest():
+    HistoryOrder.objects.create()
+    for _ in range(3):
+        call_command('fsm_snapshot', 'testapp.HistoryOrder', keep=2, stdout=StringIO())
+    assert StateSnapshot.objects.count() == 2
+
+
+def test_field_without_log_is_refused():
+    with pytest.raises(ValueError):
+        take_snapshot(StateSnapshot, 'model')
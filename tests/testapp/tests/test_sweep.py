@@ -0,0 +1,133 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import models
+from django.utils import timezone
+from django_fsm_ex import FSMField, sweep, transition
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class LeaveApplication(models.Model):
+    state = FSMField(default='dept', track_entered_at=True)
+    locked = models.BooleanField(default=False)
+
+    @transition(field=state, source='dept', target='new', after=timedelta(days=7),
+                conditions=[lambda application: not application.locked])
+    def expire(self):
+        pass
+
+    @transition(field=state, source='new', target='dept')
+    def submit(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def make_applications(count, days_ago, **kwargs):
+    applications = [LeaveApplication.objects.create(**kwargs) for _ in range(count)]
+    LeaveApplication.objects.filter(pk__in=[a.pk for a in applications]) \
+        .update(state_entered_at=timezone.now() - timedelta(days=days_ago))
+    return applications
+
+
+def test_entered_at_field_and_index_are_added():
+    field = LeaveApplication._meta.get_field('state')
+    assert field.entered_at_field is LeaveApplication._meta.get_field('state_entered_at')
+    assert [index.fields for index in LeaveApplication._meta.indexes] == [['state', 'state_entered_at']]
+    assert 'track_entered_at' not in field.deconstruct()[3]
+
+
+def test_transition_updates_entered_at():
+    application, = make_applications(1, days_ago=3)
+    application.refresh_from_db()
+    before = application.state_entered_at
+    application.expire()
+    assert application.state_entered_at > before
+
+
+def test_sweep_runs_due_transitions_in_batches():
+    due = make_applications(5, days_ago=8)
+    recent = make_applications(2, days_ago=1)
+    locked = make_applications(1, days_ago=9, locked=True)
+
+    results = list(sweep(LeaveApplication, batch=2))
+    assert [result.done for result in results] == [1, 2, 2]  # 最早的一行条件不满足
+    assert sum(result.skipped for result in results) == 1
+    states = dict(LeaveApplication.objects.values_list('pk', 'state'))
+    assert {states[a.pk] for a in due} == {'new'}
+    assert {states[a.pk] for a in recent + locked} == {'dept'}
+    assert [result[:5] for result in sweep(LeaveApplication, batch=2)] == [('expire', 0, 1, 0, [])]
+
+
+def test_sweep_command():
+    make_applications(3, days_ago=10)
+    out = StringIO()
+    call_command('fsm_sweep', 'testapp.LeaveApplication', stdout=out)
+    assert 'testapp.LeaveApplication.expire: 3 done, 0 skipped, 0 failed in ' in out.getvalue()
+    assert not LeaveApplication.objects.filter(state='dept').exists()
+
+
+def test_after_must_be_a_timedelta():
+    with pytest.raises(ValueError):
+        transition(field='state', source='a', target='b', after=7)
+
+
+class ShippingOrder(models.Model):
+    state = FSMField(default='paid')
+    items_left = models.PositiveIntegerField(default=1)
+    on_hold = models.BooleanField(default=False)
+
+    @transition(field=state, source='paid', target='shipped', auto=True,
+                conditions=[lambda order: order.items_left == 0 and not order.on_hold],
+                sql_condition=models.Q(items_left=0))
+    def ship(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def test_auto_transitions_only_load_candidate_rows():
+    ready = [ShippingOrder.objects.create(items_left=0) for _ in range(3)]
+    waiting = ShippingOrder.objects.create(items_left=2)
+    held = ShippingOrder.objects.create(items_left=0, on_hold=True)
+    ShippingOrder.objects.create(items_left=0, state='shipped')
+
+    # items_left=2 的行在查询中就被排除,只有 held 被加载后跳过
+    results = list(sweep(ShippingOrder, batch=10))
+    assert [result[:4] for result in results] == [('ship', 3, 1, 0)]
+    states = dict(ShippingOrder.objects.values_list('pk', 'state'))
+    assert {states[order.pk] for order in ready} == {'shipped'}
+    assert states[waiting.pk] == states[held.pk] == 'paid'
+
+
+def auto_step(source, target):
+    @transition(field='state', source=source, target=target, auto=True)
+    def run(self):
+        pass
+    return run
+
+
+class PipelineOrder(models.Model):
+    state = FSMField(default='new')
+
+    # 工厂生成的方法 __name__ 都是 run
+    start = auto_step('new', 'running')
+    finish = auto_step('running', 'done')
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def test_factory_built_transitions_are_swept():
+    new = PipelineOrder.objects.create()
+    running = PipelineOrder.objects.create(state='running')
+    results = list(sweep(PipelineOrder))
+    assert [result[:2] for result in results] == [('finish', 1), ('start', 1)]
+    states = dict(PipelineOrder.objects.values_list('pk', 'state'))
+    assert states[running.pk] == 'done'
+    assert states[new.pk] == 'running'
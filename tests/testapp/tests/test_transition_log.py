@@ -0,0 +1,110 @@
+from django.contrib.auth.models import User
+from django.db import connection, models, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django_fsm_ex import FSMField, transition
+from django_fsm_ex.log import TransitionLogMiddleware, TransitionLogger, acting_user, transition_logger
+from django_fsm_ex.models import TransitionLog
+
+import pytest
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+class LoggedOrder(models.Model):
+    state = FSMField(default='new', log_transitions=True)
+
+    @transition(field=state, source='new', target='paid')
+    def pay(self):
+        pass
+
+    @transition(field=state, source='paid', target='new')
+    def refund(self):
+        pass
+
+    @transition(field=state, source='*', target=None, on_error='failed')
+    def explode(self):
+        raise RuntimeError('boom')
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def logged():
+    return list(TransitionLog.objects.values_list('name', 'source', 'target'))
+
+
+def inserts(queries):
+    return [query for query in queries if 'INSERT' in query['sql'] and 'transitionlog' in query['sql']]
+
+
+def test_entries_are_bulk_inserted_on_commit():
+    order = LoggedOrder.objects.create()
+    with CaptureQueriesContext(connection) as queries:
+        with transaction.atomic():
+            order.pay()
+            order.refund()
+            order.pay()
+            assert logged() == []
+    assert len(inserts(queries)) == 1
+    assert logged() == [('pay', 'new', 'paid'), ('refund', 'paid', 'new'), ('pay', 'new', 'paid')]
+    # inserted 是提交后写入的时间
+    assert all(created <= inserted for created, inserted in TransitionLog.objects.values_list('created', 'inserted'))
+
+
+def test_rolled_back_entries_are_dropped():
+    order = LoggedOrder.objects.create()
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                order.pay()
+                raise ValueError
+        except ValueError:
+            pass
+        with pytest.raises(RuntimeError):
+            order.explode()
+    assert logged() == [('explode', 'paid', 'failed')]
+    assert 'boom' in TransitionLog.objects.get().exception
+
+
+def test_sync_mode_and_max_buffer(monkeypatch):
+    order = LoggedOrder.objects.create()
+    monkeypatch.setattr(transition_logger, '_mode', 'sync')
+    with transaction.atomic():
+        order.pay()
+        assert logged() == [('pay', 'new', 'paid')]
+
+    monkeypatch.setattr(transition_logger, '_mode', None)
+    monkeypatch.setattr(transition_logger, '_max_buffer', 2)
+    with transaction.atomic():
+        order.refund()
+        order.pay()
+        assert len(logged()) == 3
+        order.refund()
+    assert len(logged()) == 4
+
+
+def test_middleware_records_user_and_buffers_request():
+    user = User.objects.create(username='alice')
+    order = LoggedOrder.objects.create()
+
+    def view(request):
+        order.pay()
+        assert logged() == []
+        return HttpResponse()
+
+    request = RequestFactory().get('/')
+    request.user = user
+    TransitionLogMiddleware(view)(request)
+    assert list(TransitionLog.objects.values_list('name', 'user_pk')) == [('pay', str(user.pk))]
+
+    with acting_user(user):
+        order.refund()
+    assert TransitionLog.objects.last().user_pk == str(user.pk)
+
+
+def test_logger_settings(settings):
+    settings.FSM_TRANSITION_LOG_MODE = 'sync'
+    settings.FSM_TRANSITION_LOG_MAX_BUFFER = 10
+    logger = TransitionLogger()
+    assert (logger.mode, logger.max_buffer) == ('sync', 10)
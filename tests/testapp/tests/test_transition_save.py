@@ -0,0 +1,82 @@
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
+from django_fsm_ex import ConcurrentTransition, ConcurrentTransitionMixin, FSMField, transition
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class SavedInvoice(ConcurrentTransitionMixin, models.Model):
+    state = FSMField(default='new')
+    paid_by = models.CharField(max_length=50, default='')
+    notes = models.TextField(default='')
+
+    @transition(field=state, source='new', target='paid', save=True)
+    def pay(self, by):
+        self.paid_by = by
+
+    @transition(field=state, source='paid', target='new')
+    def refund(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class AutoSavedInvoice(models.Model):
+    fsm_save_transitions = True
+
+    state = FSMField(default='new')
+    notes = models.TextField(default='')
+
+    @transition(field=state, source='new', target='paid')
+    def pay(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+class ManualInvoice(AutoSavedInvoice):
+    fsm_save_transitions = False
+
+    class Meta:
+        app_label = 'testapp'
+        proxy = True
+
+
+def test_only_dirty_fields_are_saved():
+    invoice = SavedInvoice.objects.create(notes='long text')
+    with CaptureQueriesContext(connection) as queries:
+        invoice.pay('alice')
+    assert len(queries) == 1
+    sql = queries[0]['sql']
+    assert '"state"' in sql and '"paid_by"' in sql and '"notes"' not in sql
+    assert SavedInvoice.objects.filter(state='paid', paid_by='alice').exists()
+
+    # 初始状态已经更新,之后的保存不会冲突
+    invoice.refund()
+    invoice.save()
+
+
+def test_guarded_update_still_detects_conflicts():
+    invoice = SavedInvoice.objects.create()
+    other = SavedInvoice.objects.get(pk=invoice.pk)
+    invoice.pay('alice')
+    with pytest.raises(ConcurrentTransition):
+        other.pay('bob')
+
+
+def test_model_level_setting_and_new_instance():
+    invoice = AutoSavedInvoice()
+    invoice.pay()
+    assert AutoSavedInvoice.objects.get(pk=invoice.pk).state == 'paid'
+
+
+def test_model_level_setting_is_read_per_class():
+    invoice = AutoSavedInvoice.objects.create()
+    manual = ManualInvoice.objects.create()
+    invoice.pay()
+    manual.pay()
+    assert AutoSavedInvoice.objects.get(pk=invoice.pk).state == 'paid'
+    assert AutoSavedInvoice.objects.get(pk=manual.pk).state == 'new'
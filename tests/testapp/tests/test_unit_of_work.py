@@ -0,0 +1,120 @@
+from django.db import models
+from django_fsm_ex import (ConcurrentTransitionMixin, FSMField, TransitionNotAllowed, post_transition,
+                           transition, unit_of_work)
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class UowApplication(ConcurrentTransitionMixin, models.Model):
+    state = FSMField(default='new')
+    dean_available = models.BooleanField(default=True)
+
+    @transition(field=state, source='new', target='approving')
+    def to_approvement(self):
+        pass
+
+    @transition(field=state, source='approving', target='dept_approved')
+    def dept_approved(self):
+        pass
+
+    @transition(field=state, source='dept_approved', target='dean_approved',
+                conditions=[lambda self: self.dean_available])
+    def dean_approved(self):
+        pass
+
+    @transition(field=state, source='approving', target='withdrawn', sql_update=True)
+    def withdraw(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+@pytest.fixture
+def received():
+    calls = []
+
+    def receiver(instance, name, target, **kwargs):
+        calls.append((name, target, UowApplication.objects.get(pk=instance.pk).state))
+
+    post_transition.connect(receiver, sender=UowApplication)
+    yield calls
+    post_transition.disconnect(receiver, sender=UowApplication)
+
+
+def test_signals_are_flushed_after_one_save(received):
+    application = UowApplication.objects.create()
+    with unit_of_work(application) as uow:
+        uow.run('to_approvement', 'dept_approved', 'dean_approved')
+        assert received == []
+    assert received == [
+        ('to_approvement', 'approving', 'dean_approved'),
+        ('dept_approved', 'dept_approved', 'dean_approved'),
+        ('dean_approved', 'dean_approved', 'dean_approved'),
+    ]
+
+
+def test_invalid_path_runs_nothing(received):
+    application = UowApplication.objects.create()
+    with pytest.raises(TransitionNotAllowed):
+        with unit_of_work(application) as uow:
+            uow.run('to_approvement', 'dean_approved')
+    assert application.state == 'new'
+    assert received == []
+
+
+def test_exception_drops_signals(received):
+    application = UowApplication.objects.create()
+    with pytest.raises(RuntimeError):
+        with unit_of_work(application):
+            application.to_approvement()
+            raise RuntimeError
+    assert received == []
+    assert application.state == 'new'
+    assert UowApplication.objects.get(pk=application.pk).state == 'new'
+
+
+def test_conditions_of_every_step_are_checked(received):
+    application = UowApplication.objects.create(dean_available=False)
+    with pytest.raises(TransitionNotAllowed):
+        with unit_of_work(application) as uow:
+            uow.run('to_approvement', 'dept_approved', 'dean_approved')
+    assert application.state == 'new'
+
+
+def test_sql_update_transitions_are_rejected(received):
+    application = UowApplication.objects.create()
+    with pytest.raises(ValueError):
+        with unit_of_work(application) as uow:
+            uow.run('to_approvement', 'withdraw')
+    assert application.state == 'new'
+
+    with pytest.raises(ValueError):
+        with unit_of_work(application):
+            application.to_approvement()
+            application.withdraw()
+    assert application.state == 'new'
+    assert UowApplication.objects.get(pk=application.pk).state == 'new'
+
+
+def test_failed_receiver_rolls_back_the_save():
+    def receiver(name, **kwargs):
+        if name == 'dept_approved':
+            raise RuntimeError
+
+    application = UowApplication.objects.create()
+    post_transition.connect(receiver, sender=UowApplication)
+    try:
+        with pytest.raises(RuntimeError):
+            with unit_of_work(application) as uow:
+                uow.run('to_approvement', 'dept_approved')
+    finally:
+        post_transition.disconnect(receiver, sender=UowApplication)
+    assert application.state == 'new'
+    assert UowApplication.objects.get(pk=application.pk).state == 'new'
+
+    # 恢复后的实例仍然可以正常保存
+    with unit_of_work(application) as uow:
+        uow.run('to_approvement')
+    assert UowApplication.objects.get(pk=application.pk).state == 'approving'
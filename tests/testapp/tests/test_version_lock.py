@@ -0,0 +1,112 @@
+from django.db import connection, models, transaction
+from django.test.utils import CaptureQueriesContext
+from django_fsm_ex import ConcurrentTransitionMixin, ConcurrentTransition, FSMField, FSMManager, transition
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class VersionedArticle(ConcurrentTransitionMixin, models.Model):
+    version_field = 'version'
+
+    state = FSMField(default='new', protected=True)
+    review_state = FSMField(default='waiting', protected=True)
+    version = models.PositiveIntegerField(default=0)
+    text = models.CharField(max_length=50, default='')
+
+    objects = FSMManager()
+
+    @transition(field=state, source='new', target='published')
+    def publish(self):
+        pass
+
+    @transition(field=state, source='published', target='new')
+    def unpublish(self):
+        pass
+
+    @transition(field=state, source='new', target='archived', sql_update=True)
+    def archive(self):
+        pass
+
+    class Meta:
+        app_label = 'testapp'
+
+
+def test_version_is_bumped_on_save():
+    article = VersionedArticle.objects.create()
+    assert article.version == 1
+    article.publish()
+    article.save()
+    assert VersionedArticle.objects.get(pk=article.pk).version == 2
+
+
+def test_aba_sequence_is_detected():
+    article1 = VersionedArticle.objects.create()
+    article2 = VersionedArticle.objects.get(pk=article1.pk)
+
+    article1.publish()
+    article1.save()
+    article1.unpublish()
+    article1.save()
+
+    article2.publish()
+    with pytest.raises(ConcurrentTransition):
+        article2.save()
+    assert article2.version == 1
+
+
+def test_guard_uses_pk_and_version_only():
+    article = VersionedArticle.objects.create()
+    article.publish()
+    with CaptureQueriesContext(connection) as queries:
+        article.save(update_fields=['state'])
+    where = queries[0]['sql'].split('WHERE')[1]
+    assert '"version"' in where
+    assert '"state"' not in where and '"review_state"' not in where
+    assert VersionedArticle.objects.get(pk=article.pk).version == 2
+
+
+def test_sql_update_bumps_version():
+    article = VersionedArticle.objects.create()
+    stale = VersionedArticle.objects.get(pk=article.pk)
+
+    article.archive()
+    assert article.version == 2
+    assert VersionedArticle.objects.get(pk=article.pk).version == 2
+    stale.text = 'stale'
+    with pytest.raises(ConcurrentTransition), transaction.atomic():
+        stale.save()
+
+    article.text = 'fresh'
+    article.save()
+    assert VersionedArticle.objects.get(pk=article.pk).version == 3
+
+
+def test_bulk_transition_and_claim_bump_version():
+    article = VersionedArticle.objects.create()
+    stale = VersionedArticle.objects.get(pk=article.pk)
+    assert VersionedArticle.objects.bulk_transition('publish') == 1
+    with pytest.raises(ConcurrentTransition), transaction.atomic():
+        stale.save()
+
+    claimed, = VersionedArticle.objects.claim('unpublish', limit=10)
+    assert claimed.version == VersionedArticle.objects.get(pk=article.pk).version == 3
+    claimed.save()
+    assert VersionedArticle.objects.get(pk=article.pk).version == 4
+
+
+def test_deferred_version_is_rejected():
+    article = VersionedArticle.objects.create()
+    stale = VersionedArticle.objects.only('id', 'state').get(pk=article.pk)
+    article.publish()
+    article.save()
+    article.unpublish()
+    article.save()
+
+    # 延迟加载的版本号是当前值,不能用来发现 A -> B -> A
+    stale.text = 'stale'
+    with pytest.raises(ValueError):
+        stale.save()
+    with pytest.raises(ValueError):
+        VersionedArticle.objects.bulk_save_transitions([stale])
+    assert VersionedArticle.objects.get(pk=article.pk).text == ''